@@ -1,11 +1,14 @@
 import config
 import utils
 import q_learner
+import ghosts
+import kernels
+import gridmap
 
 import math
 import os.path
-import pygame as pg
 import random
+import numpy as np
 
 class Agent():
 
@@ -37,19 +40,24 @@ class Agent():
 	def cell_is_allowed(self, cell):
 		return True
 
+	def cells_are_allowed(self, xs, ys):
+		return np.ones(len(xs), dtype = bool)
+
 	def move_to(self, pos):
-		(x, y) = pos
 		if pos != self.new_pos and \
-		   self.cell_is_allowed(pos) and \
-		   x >= 0 and x < config.GRID_W and \
-		   y >= 0 and y < config.GRID_H:
+		   gridmap.get_map().is_open(pos) and \
+		   self.cell_is_allowed(pos):
 			   self.old_pos = self.pos
 			   self.new_pos = pos
 			   self.interp_timer.reset()
 
-	def render(self, screen):
+	'''
+	@param pos position to draw at, the current position by default
+	'''
+	def render(self, screen, pos = None):
+		import pygame as pg
 		rad = self.radius * min(config.CELL_W, config.CELL_H)
-		pos = utils.to_screen(self.pos)
+		pos = utils.to_screen(self.pos if pos is None else pos)
 
 		pg.draw.circle(screen, self.color, pos, int(rad))
 
@@ -60,17 +68,36 @@ class VIP(Agent):
 				pos, 0.5, (0, 255, 255))
 
 		self.move_timer = utils.Timer(config.VIP_EPISODE * config.STEP_TIME)
+		# scripted path, see set_path
+		self.path = None
+		self.path_timer = utils.Timer(config.SCENARIO_PERIOD * config.STEP_TIME)
+
+	'''
+	@param path iterator of cells taken one per move while the VIP is
+	            SCRIPTED, the VIP stays put once it ends
+	'''
+	def set_path(self, path):
+		self.path = path
+		self.path_timer.reset()
 
 	def update(self, deltatime):
 		super(VIP, self).update(deltatime)
 
 		self.move_timer.update(deltatime)
+		self.path_timer.update(deltatime)
 		if config.VIP_STATE == config.VIPState.AUTO and self.move_timer.is_finished():
 			self.move_timer.reset()
 			(x, y) = self.pos
 			self.move_to((x + random.randint(-1, 1),
 						  y + random.randint(-1, 1)))
 
+		elif config.VIP_STATE == config.VIPState.SCRIPTED and \
+				self.path is not None and self.path_timer.is_finished():
+			self.path_timer.reset()
+			cell = next(self.path, None)
+			if cell is not None:
+				self.move_to(cell)
+
 class QAgent(Agent):
 
 	last_s = None
@@ -82,6 +109,9 @@ class QAgent(Agent):
 		self.controller = controller
 		self.can_suffer = can_suffer
 		self.move_timer = utils.Timer(config.STEP_TIME)
+		# last action taken and reward received, for recording
+		self.last_a = None
+		self.last_r = 0
 
 
 	def randomize(self):
@@ -105,12 +135,18 @@ class QAgent(Agent):
 	def get_state(self, pos):
 		raise NotImplementedError
 
+	def get_states(self, xs, ys):
+		raise NotImplementedError
+
 	def get_my_state(self):
 		return self.get_state(self.get_int_pos())
 
 	def get_reward(self, s):
 		raise NotImplementedError
 
+	def get_rewards(self, xs, ys):
+		raise NotImplementedError
+
 	def do_action(self, a):
 		raise NotImplementedError
 
@@ -137,6 +173,8 @@ class QAgent(Agent):
 			s_ = self.get_my_state()
 			r = self.get_reward(s_)
 			self.reward_monitor.update(r)
+			self.last_a = a
+			self.last_r = r
 
 			# add suffering factor for data
 			if self.can_suffer:
@@ -151,12 +189,37 @@ class QAgent(Agent):
 			else:
 				self.controller.update_trajectory(s, a, r, s_)
 
+	'''
+	Writes the backups still pending at the end of a run
+	'''
+	def flush_traces(self):
+		if self.controller is not None:
+			self.controller.flush_traces(
+					tuple(np.array([v]) for v in self.get_my_state()))
+
 	def get_superpos_qs(self, cell_pos):
 		return self.controller.get_action_qs(self.get_state(cell_pos))
 
+	'''
+	@return action values of every cell as an array (x, y, actions), read
+	        with a single slice of the Q table
+	'''
+	def get_superpos_q_grid(self):
+		return self.controller.get_action_qs(
+				self.get_states(slice(None), slice(None)))
+
 	def dump(self, filename):
 		self.controller.dump(filename)
 
+'''
+Whether guards see hostiles past the walls of the map, every position
+may be an array
+'''
+def sees(guard_xs, guard_ys, hostile_xs, hostile_ys):
+	grid_map = gridmap.get_map()
+	return grid_map.get_sight()[grid_map.get_cells(guard_xs, guard_ys),
+			grid_map.get_cells(hostile_xs, hostile_ys)]
+
 def threat_level(vip_pos, guard_pos, hostile_pos):
 
 	tv = utils.sub(hostile_pos, vip_pos)
@@ -170,50 +233,127 @@ def threat_level(vip_pos, guard_pos, hostile_pos):
 			vip_pos, hostile_pos)))
 
 	coverage = 0
-	if utils.norm2(gv) != 0 and utils.norm2(gv) < utils.norm2(tv):
+	if utils.norm2(gv) != 0 and utils.norm2(gv) < utils.norm2(tv) and \
+	   (not config.LINE_OF_SIGHT or sees(*guard_pos, *hostile_pos)):
 		coverage = 10 * max(utils.dot(tv, gv), 0) / \
 				math.sqrt(utils.norm2(tv) * utils.norm2(gv))
 
 	return dst_threat - coverage
 
+'''
+Vectorized @threat_level over arrays of guard and hostile cells, scalars
+are broadcast
+'''
+def threat_levels(vip_pos, guard_xs, guard_ys, hostile_xs, hostile_ys):
+	(vx, vy) = vip_pos
+	tx = np.asarray(hostile_xs, dtype = float) - vx
+	ty = np.asarray(hostile_ys, dtype = float) - vy
+	gx = np.asarray(guard_xs, dtype = float) - vx
+	gy = np.asarray(guard_ys, dtype = float) - vy
+
+	tv2 = tx * tx + ty * ty
+	gv2 = gx * gx + gy * gy
+
+	dst_threat = 70 * np.exp(-np.sqrt(tv2))
+
+	covered = (gv2 != 0) & (gv2 < tv2)
+	if config.LINE_OF_SIGHT:
+		covered &= sees(guard_xs, guard_ys, hostile_xs, hostile_ys)
+	with np.errstate(divide = "ignore", invalid = "ignore"):
+		coverage = np.where(covered,
+				10 * np.maximum(tx * gx + ty * gy, 0) / np.sqrt(tv2 * gv2), 0)
+
+	return np.where(tv2 == 0, 0, dst_threat - coverage)
+
+'''
+Vectorized @Guard.get_reward, every position may be an array
+'''
+def guard_rewards(vip_pos, guard_xs, guard_ys, hostile_xs, hostile_ys):
+	(vx, vy) = vip_pos
+	vip_dst2 = (guard_xs - vx) ** 2 + (guard_ys - vy) ** 2
+
+	return -1 - threat_levels(vip_pos,
+			guard_xs, guard_ys, hostile_xs, hostile_ys) - \
+			10 * ((vip_dst2 > 4) | (vip_dst2 <= 0))
+
+'''
+Vectorized @Hostile.get_reward, every position may be an array
+'''
+def hostile_rewards(vip_pos, guard_xs, guard_ys, hostile_xs, hostile_ys):
+	return -1 + threat_levels(vip_pos,
+			guard_xs, guard_ys, hostile_xs, hostile_ys)
+
+'''
+Vectorized @Hostile.cell_is_allowed with the legality masks of the map,
+every position may be an array
+'''
+def hostile_cells_allowed(vip_pos, xs, ys):
+	return gridmap.get_map().get_hostile_allowed(vip_pos, xs, ys)
+
+'''
+Creates a controller over (x, y, vip_x, vip_y, other_x, other_y) states
+and cardinal actions with the configured update settings
+
+@param load_file saved table to load if the file exists, or None
+@param q_table   table to start from instead of a new or saved one
+'''
+def create_controller(load_file, gamma, exploration, q_table = None):
+	return q_learner.QController(
+		(config.GRID_W, config.GRID_H, 
+		 config.GRID_W, config.GRID_H,
+		 config.GRID_W, config.GRID_H), (4,),
+		 load_file = load_file if \
+		 load_file is not None and os.path.isfile(load_file) else None,
+		 gamma = gamma,
+		 exploration = exploration,
+		 update_mode = config.UPDATE_MODE,
+		 trace_length = config.TRACE_LENGTH,
+		 trace_decay = config.TRACE_DECAY,
+		 sweep_budget = config.SWEEP_BUDGET,
+		 sweep_threshold = config.SWEEP_THRESHOLD,
+		 q_table = q_table,
+		 update_weight = config.MAIN_UPDATE_WEIGHT)
+
 class Guard(QAgent):
 
+	# ghosts of guards can step with the fused kernel
+	step_kind = kernels.GUARD
+
+	'''
+	@param q_table table to start from instead of a new or saved one
+	'''
 	def __init__(self, pos, vip, hostile, use_saved_data = True, 
-			controller = None, is_ghost = False):
+			controller = None, q_table = None):
 		if controller is None:
 			# state space:  (x, y, vip_x, vip_y, hostile_x, hostile_y)
 			# action space: (dx, dy)
-			controller = q_learner.QController(
-				(config.GRID_W, config.GRID_H, 
-				 config.GRID_W, config.GRID_H,
-				 config.GRID_W, config.GRID_H), (4,),
-				 load_file = config.GUARD_Q_FILE if \
-				 use_saved_data and os.path.isfile(config.GUARD_Q_FILE) else None,
-				 gamma = 0.2,
-				 exploration = 0)
+			controller = create_controller(
+				config.GUARD_Q_FILE if use_saved_data else None,
+				gamma = config.GUARD_GAMMA,
+				exploration = 0,
+				q_table = q_table)
 
 		super(Guard, self).__init__(
-				pos, 0.4, 
-				(0, 255, 0) if not is_ghost else (200, 255, 200), 
+				pos, 0.4, (0, 255, 0), 
 				controller = controller,
 				can_suffer = True) 
 
 		self.vip = vip
 		self.hostile = hostile
 
-	def create_ghost(self, pos):
-		return Guard(pos, self.vip, self.hostile, 
-				controller = q_learner.QController(
-					linked_controller = self.controller,
-					exploration = config.GHOST_EXPLORATION,
-					follow_reward = config.GHOST_FOLLOW_REWARD),
-					is_ghost = True)
+	def create_ghost_pool(self, capacity = 0):
+		return ghosts.GhostPool(self, (200, 255, 200), capacity)
 
 	def get_state(self, pos):
 		return pos + \
 			   self.vip.get_int_pos() + \
 			   self.hostile.get_int_pos()
 
+	def get_states(self, xs, ys):
+		return (xs, ys) + \
+			   self.vip.get_int_pos() + \
+			   self.hostile.get_int_pos()
+
 	def get_reward(self, s):
 		vip_dst2 = utils.dst2(
 				self.vip.get_int_pos(),
@@ -225,62 +365,76 @@ class Guard(QAgent):
 				self.hostile.get_int_pos()) - \
 				10 * int(vip_dst2 > 4 or vip_dst2 <= 0)
 
+	def get_other_pos(self):
+		return self.hostile.get_int_pos()
+
+	def get_rewards(self, xs, ys):
+		(hx, hy) = self.hostile.get_int_pos()
+		return guard_rewards(self.vip.get_int_pos(), xs, ys, hx, hy)
+
 	def do_action(self, a):
-		(dx, dy) = utils.CARDINALS[a[0]]
-		(x, y) = self.new_pos
-		self.move_to((x + dx, y + dy))
+		self.move_to(gridmap.get_map().get_next_cell(self.new_pos, a[0]))
 
 class Hostile(QAgent):
 
+	# ghosts of hostiles can step with the fused kernel
+	step_kind = kernels.HOSTILE
+
+	'''
+	@param q_table table to start from instead of a new or saved one
+	'''
 	def __init__(self, pos, vip, guard, use_saved_data = True, 
-			controller = None, is_ghost = False):
+			controller = None, q_table = None):
 		if controller is None:
 			# state space:	(x, y, vip_x, vip_y, guard_x, guard_y)
 			# action space: (dx, dy)
-			controller = q_learner.QController(
-				(config.GRID_W, config.GRID_H, 
-				 config.GRID_W, config.GRID_H,
-				 config.GRID_W, config.GRID_H), (4,),
-				 load_file = config.HOSTILE_Q_FILE if \
-				 use_saved_data and os.path.isfile(config.HOSTILE_Q_FILE) else None,
-				 gamma = 0.8,
-				 exploration = 0.4)
+			controller = create_controller(
+				config.HOSTILE_Q_FILE if use_saved_data else None,
+				gamma = config.HOSTILE_GAMMA,
+				exploration = 0.4,
+				q_table = q_table)
 
 		super(Hostile, self).__init__(
-				pos, 0.4, 
-				(255, 0, 0) if not is_ghost else (255, 200, 200), 
+				pos, 0.4, (255, 0, 0), 
 				controller) 
 
 		self.vip = vip
 		self.guard = guard
 
-	def create_ghost(self, pos):
-		return Hostile(pos, self.vip, self.guard, 
-				controller = q_learner.QController(
-					linked_controller = self.controller,
-					exploration = config.GHOST_EXPLORATION,
-					follow_reward = config.GHOST_FOLLOW_REWARD),
-				is_ghost = True)
+	def create_ghost_pool(self, capacity = 0):
+		return ghosts.GhostPool(self, (255, 200, 200), capacity)
 
 	def get_state(self, pos):
 		return pos + \
 			   self.vip.get_int_pos() + \
 			   self.guard.get_int_pos()
 
+	def get_states(self, xs, ys):
+		return (xs, ys) + \
+			   self.vip.get_int_pos() + \
+			   self.guard.get_int_pos()
+
 	def get_reward(self, s):
 		return -1 + threat_level(
 				self.vip.get_int_pos(),
 				self.guard.get_int_pos(),
 				self.get_int_pos())
 
+	def get_other_pos(self):
+		return self.guard.get_int_pos()
+
+	def get_rewards(self, xs, ys):
+		(gx, gy) = self.guard.get_int_pos()
+		return hostile_rewards(self.vip.get_int_pos(), gx, gy, xs, ys)
+
 	def cell_is_allowed(self, cell):
-		dst2 = utils.dst2(cell, self.vip.get_int_pos())
-		return dst2 > config.HOSTILE_CLOSEST_DST2
+		return bool(hostile_cells_allowed(self.vip.get_int_pos(), *cell))
+
+	def cells_are_allowed(self, xs, ys):
+		return hostile_cells_allowed(self.vip.get_int_pos(), xs, ys)
 
 	def do_action(self, a):
-		(dx, dy) = utils.CARDINALS[a[0]]
-		(x, y) = self.new_pos
-		self.move_to((x + dx, y + dy))
+		self.move_to(gridmap.get_map().get_next_cell(self.new_pos, a[0]))
 
 
 
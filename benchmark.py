@@ -0,0 +1,514 @@
+import config
+import agent
+import utils
+import q_learner
+import world
+import spatial
+import kernels
+import simulation
+import evaluation
+import scenarios
+
+import sys
+import random
+import numpy as np
+import time
+import itertools
+import subprocess
+import tracemalloc
+import io
+import contextlib
+
+'''
+Creates a VIP, guard and hostile without a world or window
+'''
+def create_agents():
+	vip = agent.VIP((config.GRID_W / 2, config.GRID_H / 2))
+	guard = agent.Guard((0, 0), vip, None, use_saved_data = False)
+	hostile = agent.Hostile((config.GRID_W - 1, config.GRID_H - 1),
+			vip, guard, use_saved_data = False)
+	guard.hostile = hostile
+
+	return vip, guard, hostile
+
+'''
+Measures memory and allocation time per ghost of a ghost pool against
+one Guard object and linked QController per ghost
+'''
+def bench_ghosts(count = 20000):
+	vip, guard, hostile = create_agents()
+
+	# object per ghost
+	tracemalloc.start()
+	start = time.perf_counter()
+	objects = [agent.Guard((0, 0), vip, hostile,
+			controller = q_learner.QController(
+				linked_controller = guard.controller,
+				exploration = config.GHOST_EXPLORATION,
+				follow_reward = config.GHOST_FOLLOW_REWARD))
+			for _ in range(count)]
+	object_time = time.perf_counter() - start
+	object_bytes = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	del objects
+
+	# ghost pool
+	tracemalloc.start()
+	start = time.perf_counter()
+	pool = guard.create_ghost_pool()
+	pool.set_count(count)
+	pool_time = time.perf_counter() - start
+	pool_bytes = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+
+	# resizing
+	start = time.perf_counter()
+	for i in range(100):
+		pool.set_count(count if i % 2 else 0)
+	resize_time = (time.perf_counter() - start) / 100
+
+	print(f"\nGhost allocation for {count} ghosts \n\n"
+		  f"  Objects: \n"
+		  f"      bytes per ghost: {object_bytes / count:.1f} \n"
+		  f"      create time:     {object_time * 1000:.2f} ms \n\n"
+		  f"  Pool: \n"
+		  f"      bytes per ghost: {pool_bytes / count:.1f} "
+		  f"({pool.get_bytes_per_ghost()} in arrays) \n"
+		  f"      create time:     {pool_time * 1000:.2f} ms \n"
+		  f"      resize time:     {resize_time * 1000:.3f} ms \n")
+
+'''
+Times a fresh interpreter importing the given modules, taking the best
+of several runs
+'''
+def time_import(modules, repeats = 5):
+	code = "import time; start = time.perf_counter(); " \
+		   f"import {', '.join(modules)}; " \
+		   "print(time.perf_counter() - start)"
+
+	best = None
+	for _ in range(repeats):
+		out = subprocess.run([sys.executable, "-c", code],
+				capture_output = True, text = True)
+		if out.returncode != 0:
+			return None
+		t = float(out.stdout.split()[-1])
+		best = t if best is None else min(best, t)
+
+	return best
+
+'''
+Compares import time of the simulation core with the GUI and plotting
+libraries it used to import eagerly
+'''
+def bench_imports():
+	core = ["config", "utils", "q_learner", "agent", "ghosts"]
+	eager = core + ["pygame", "pyqtgraph"]
+
+	print("\nImport time \n")
+	for name, modules in [("core", core), ("core + GUI (eager)", eager)]:
+		t = time_import(modules)
+		if t is None:
+			print(f"  {name}: failed to import")
+		else:
+			print(f"  {name}: {t * 1000:.1f} ms")
+	print()
+
+'''
+@return config settings of a headless run of @steps steps without
+        stopping early
+'''
+def fixed_length(steps):
+	return {
+		"RENDER_ENABLED": False,
+		"ITERATION_MAX": steps,
+		"CONVERGE_REWARD_TOLERANCE": 0,
+		"CONVERGE_Q_CHANGE": 0,
+	}
+
+'''
+Runs a headless world until the guard's recent average reward reaches
+@target, seeding both random generators with @seed
+
+@return number of steps taken, or None if @max_steps was reached first
+'''
+def steps_to_reward(target, max_steps, seed):
+	random.seed(seed)
+	np.random.seed(seed)
+
+	with config.override(fixed_length(max_steps)):
+		w = world.World()
+
+	while not w.update(config.STEP_TIME):
+		if w.guard.get_iteration_count() >= w.guard.reward_monitor.average_size \
+				and w.guard.get_average_reward() >= target:
+			return w.guard.get_iteration_count()
+
+	return None
+
+'''
+Compares steps to reach a target guard reward for each update mode
+'''
+def bench_update_modes(target = 2.0, max_steps = 5000, seeds = 5):
+	default_mode = config.UPDATE_MODE
+
+	print(f"\nSteps to a guard average reward of {target} "
+		  f"({config.GHOST_COUNT} ghosts, trace length {config.TRACE_LENGTH}) \n")
+	for mode in config.UpdateMode:
+		config.UPDATE_MODE = mode
+		steps = [steps_to_reward(target, max_steps, seed)
+				for seed in range(seeds)]
+		reached = [s for s in steps if s is not None]
+
+		median = "-" if len(reached) == 0 else int(np.median(reached))
+		print(f"  {mode.name:10} median {median} steps, "
+			  f"reached in {len(reached)} / {seeds} runs")
+	print()
+
+	config.UPDATE_MODE = default_mode
+
+'''
+@return number of backups written to the guard's Q table so far
+'''
+def guard_update_count(w):
+	if w.guard.controller.sweeper is not None:
+		return w.guard.controller.sweeper.update_count
+
+	return w.guard.controller.update_count + \
+		   sum(c.update_count for c in w.ghost_guards.get_controllers())
+
+'''
+Compares backups spent per unit of guard reward improvement between
+direct updates and prioritized sweeping with several budgets
+'''
+def bench_sweeping(budgets = (0, 25, 100, 400), steps = 2000, seeds = 3):
+	default_budget = config.SWEEP_BUDGET
+
+	print(f"\nBackups per unit of guard reward improvement over {steps} steps "
+		  f"({config.GHOST_COUNT} ghosts) \n")
+	for budget in budgets:
+		config.SWEEP_BUDGET = budget
+		updates = []
+		improvements = []
+		for seed in range(seeds):
+			random.seed(seed)
+			np.random.seed(seed)
+			with config.override(fixed_length(steps)):
+				w = world.World()
+
+			start_reward = None
+			while not w.update(config.STEP_TIME):
+				if w.guard.get_iteration_count() == \
+						w.guard.reward_monitor.average_size:
+					start_reward = w.guard.get_average_reward()
+
+			updates.append(guard_update_count(w))
+			improvements.append(w.guard.get_average_reward() - start_reward)
+
+		name = "direct" if budget == 0 else f"budget {budget}"
+		improvement = np.mean(improvements)
+		per_unit = np.mean(updates) / improvement if improvement > 0 else float("inf")
+		print(f"  {name:12} backups {int(np.mean(updates)):8}, "
+			  f"improvement {improvement:6.2f}, "
+			  f"backups per unit {per_unit:10.0f}")
+	print()
+
+	config.SWEEP_BUDGET = default_budget
+
+# update weightings compared by bench_efficiency, as config settings
+WEIGHTINGS = {
+	"follow": {"GHOST_FOLLOW_REWARD": True},
+	"follow x0.5": {"GHOST_FOLLOW_REWARD": True, "GHOST_FOLLOW_WEIGHT": 0.5},
+	"anti": {"GHOST_FOLLOW_REWARD": False},
+	"anti x0.5": {"GHOST_FOLLOW_REWARD": False, "GHOST_ANTI_FOLLOW_WEIGHT": 0.5},
+	"anti x0.1": {"GHOST_FOLLOW_REWARD": False, "GHOST_ANTI_FOLLOW_WEIGHT": 0.1},
+	"main x0.5": {"GHOST_FOLLOW_REWARD": True, "MAIN_UPDATE_WEIGHT": 0.5},
+}
+
+'''
+Trains a headless world of @steps steps with @settings
+
+@return (mean guard reward per step, guard reward improvement from the
+        first full average, CPU seconds)
+'''
+def measure_efficiency(settings, steps, seed):
+	random.seed(seed)
+	np.random.seed(seed)
+
+	with config.override({**fixed_length(steps), **settings}):
+		w = world.World()
+
+		start_reward = None
+		start = time.process_time()
+		while not w.update(config.STEP_TIME):
+			if w.guard.get_iteration_count() == \
+					w.guard.reward_monitor.average_size:
+				start_reward = w.guard.get_average_reward()
+		cpu_time = time.process_time() - start
+
+	return (w.get_fitness(), w.guard.get_average_reward() - start_reward,
+			cpu_time)
+
+'''
+Compares guard reward per simulated step and reward improvement per CPU
+second of every ghost update weighting in @weightings across ghost
+counts, to find the swarm that learns most for its compute
+'''
+def bench_efficiency(ghost_counts = (0, 25, 100, 400), weightings = WEIGHTINGS,
+		exploration = 0.5, steps = 1000, seeds = 3):
+	print(f"\nGuard learning efficiency over {steps} steps "
+		  f"(ghost exploration {exploration}, {seeds} seeds) \n")
+	print("    ghosts  weighting      reward/step  improvement"
+		  "  CPU ms/step  improvement/CPU s")
+	for count in ghost_counts:
+		for (name, weighting) in weightings.items():
+			settings = {**weighting, "GHOST_COUNT": count,
+					"GHOST_EXPLORATION": exploration}
+			results = np.array([measure_efficiency(settings, steps, seed)
+					for seed in range(seeds)])
+			(reward, improvement, cpu_time) = results.mean(axis = 0)
+
+			print(f"  {count:8}  {name:12} {reward:12.3f} {improvement:12.3f}"
+				  f" {cpu_time / steps * 1000:12.3f} {improvement / cpu_time:18.3f}")
+		print()
+
+'''
+Times multi-agent world steps with the spatial index against comparing
+every pair, and nearest queries alone on a larger grid
+'''
+def bench_multi(hostile_counts = (1, 10, 50, 100, 200, 400, 800), steps = 100):
+	print(f"\nMulti-agent step time over {steps} steps "
+		  f"(a guard per 4 hostiles, no ghosts) \n")
+	print("  hostiles   guards    index ms  all pairs ms")
+	for hostiles in hostile_counts:
+		guards = max(1, hostiles // 4)
+		times = []
+		for bucket in (config.SPATIAL_BUCKET or 4, 0):
+			settings = {**fixed_length(steps), "GHOST_COUNT": 0,
+				"GUARD_COUNT": guards, "HOSTILE_COUNT": hostiles,
+				"SPATIAL_BUCKET": bucket}
+			with config.override(settings):
+				random.seed(0)
+				np.random.seed(0)
+				w = world.MultiWorld()
+
+				start = time.perf_counter()
+				while not w.update(config.STEP_TIME): pass
+				times.append((time.perf_counter() - start) / steps)
+
+		print(f"  {hostiles:8} {guards:8} {times[0] * 1000:11.3f} "
+			  f"{times[1] * 1000:13.3f}")
+
+	size = 256
+	print(f"\nNearest queries on a {size} x {size} grid \n")
+	print("    points    index ms  all pairs ms")
+	rng = np.random.default_rng(0)
+	for count in (100, 1000, 4000):
+		(xs, ys, qxs, qys) = rng.integers(0, size, (4, count))
+		index = spatial.GridIndex(size, size, 8)
+
+		start = time.perf_counter()
+		index.build(xs, ys)
+		index.nearest(qxs, qys)
+		index_time = time.perf_counter() - start
+
+		start = time.perf_counter()
+		spatial.brute_nearest(xs, ys, qxs, qys)
+		pairs_time = time.perf_counter() - start
+
+		print(f"  {count:8} {index_time * 1000:11.3f} {pairs_time * 1000:13.3f}")
+	print()
+
+'''
+@return mean seconds per call of @func over @repeats calls
+'''
+def time_calls(func, repeats):
+	start = time.perf_counter()
+	for _ in range(repeats):
+		func()
+	return (time.perf_counter() - start) / repeats
+
+'''
+Checks the fused step kernel against the reference ghost step, then
+compares step time of the reference path, the interpreted kernel and
+the compiled kernel if Numba is installed. Exits with an error after the
+check if any kernel differs from the reference.
+'''
+def bench_kernels(counts = (100, 1000, 10000), repeats = 20):
+	vip, guard, hostile = create_agents()
+	pools = [guard.create_ghost_pool(), hostile.create_ghost_pool()]
+	kernel_names = [("interpreted", kernels.step_kernel)]
+	if kernels.get_numba() is not None:
+		kernel_names.append(("compiled", kernels.get_compiled_kernel()))
+
+	print("\nFused step kernel equivalence (largest differences) \n")
+	failed = []
+	for pool in pools:
+		pool.set_count(500)
+		for exploration in (0.2, 1.0):
+			pool.controller.exploration = exploration
+			for (name, kernel) in kernel_names:
+				diff = kernels.check_equivalence(pool, kernel)
+				label = f"{pool.owner.__class__.__name__:8} " \
+						f"exploration {exploration:.1f} {name:12}"
+				print(f"  {label} " +
+					  ", ".join(f"{k} {v:.3g}" for (k, v) in diff.items()))
+				if not kernels.is_equivalent(diff):
+					failed.append(label)
+
+	if kernels.get_numba() is None:
+		print("\n  Numba is not installed, the compiled kernel is skipped.")
+
+	if len(failed) > 0:
+		sys.exit("\nThe fused kernel differs from the reference step: \n  " +
+				"\n  ".join(failed))
+
+	print("\nGhost step time per pool step \n")
+	print("    ghosts  reference ms  " +
+		  "  ".join(f"{name:>12} ms" for (name, _) in kernel_names))
+	pool = pools[0]
+	for count in counts:
+		pool.set_count(count)
+		with config.override({"BACKEND": config.Backend.NUMPY}):
+			times = [time_calls(pool.step, repeats)]
+		for (name, kernel) in kernel_names:
+			# the interpreted kernel is too slow to repeat on large pools
+			n = repeats if name != "interpreted" else max(1, repeats * 100 // count)
+			times.append(time_calls(lambda: kernels.fused_step(pool, kernel), n))
+
+		print(f"  {count:8} {times[0] * 1000:13.3f}  " +
+			  "  ".join(f"{t * 1000:15.3f}" for t in times[1:]) +
+			  ("  " + "  ".join(f"({times[0] / t:.1f}x)" for t in times[1:])))
+	print()
+
+'''
+Runs a rendering loop capped at the target frame rate for @duration
+seconds, with a mouse input arriving every @input_interval seconds
+
+@param threaded whether the world updates on a SimulationThread
+@return         (input latencies, frames, simulation steps)
+'''
+def measure_latency(screen, threaded, duration, input_interval):
+	w = world.World()
+	# compiles kernels of the backend before timing
+	w.update(config.STEP_TIME)
+	target = simulation.SimulationThread(w) if threaded else w
+
+	latencies = []
+	# (arrival time, input number) of inputs not drawn yet
+	pending = []
+	posted = 0
+	frames = 0
+	start = time.perf_counter()
+	next_input = start
+	while time.perf_counter() - start < duration:
+		frame_start = time.perf_counter()
+
+		# inputs that arrived during the last frame are handled now
+		while next_input <= frame_start:
+			target.on_mouse_move(utils.to_screen(utils.randcell()))
+			posted += 1
+			pending.append((next_input, posted))
+			next_input += input_interval
+
+		target.update(config.STEP_TIME)
+		screen.fill((255, 255, 255))
+		target.render(screen)
+		frames += 1
+
+		# an input is handled once a frame showing it is drawn
+		drawn = target.get_drawn_inputs() if threaded else posted
+		done = time.perf_counter()
+		while len(pending) > 0 and pending[0][1] <= drawn:
+			latencies.append(done - pending.pop(0)[0])
+
+		time.sleep(max(0, 1 / config.TARGET_FPS -
+				(time.perf_counter() - frame_start)))
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		target.on_close()
+
+	return latencies, frames, w.guard.get_iteration_count()
+
+'''
+Compares input latency of the rendering loop between updating the world
+on the GUI thread and on a simulation thread
+'''
+def bench_latency(ghost_counts = (1000, 5000), duration = 3, input_interval = 0.05):
+	import pygame as pg
+	pg.init()
+	screen = pg.Surface((config.SCREEN_W, config.SCREEN_H))
+
+	modes = [("GUI thread", False, 1), ("sim thread", True, 1),
+			 ("sim thread, 4 ghost threads", True, 4)]
+
+	print(f"\nInput latency over {duration} s at {config.TARGET_FPS} FPS, "
+		  f"an input every {input_interval * 1000:.0f} ms \n")
+	print("    ghosts  mode                          median ms  p95 ms   FPS  steps/s")
+	for count in ghost_counts:
+		for (name, threaded, ghost_threads) in modes:
+			settings = {**fixed_length(0), "RENDER_ENABLED": True,
+				"GHOST_COUNT": count, "GHOST_THREADS": ghost_threads,
+				"VIP_STATE": config.VIPState.MOUSE}
+			with config.override(settings):
+				(latencies, frames, steps) = measure_latency(
+						screen, threaded, duration, input_interval)
+
+			print(f"  {count:8}  {name:28} {np.median(latencies) * 1000:10.1f} "
+				  f"{np.percentile(latencies, 95) * 1000:7.1f} "
+				  f"{frames / duration:5.0f} {steps / duration:8.0f}")
+	print()
+
+'''
+Times greedy rollouts of new tables against streamed scenarios of every
+kind, against the vectorized random walk VIP
+'''
+def bench_scenarios(counts = (500, 5000), steps = 200):
+	vip, guard, hostile = create_agents()
+	evaluator = evaluation.PolicyEvaluator(
+			guard.controller.q_table, hostile.controller.q_table)
+
+	print(f"\nGreedy rollouts of {steps} steps, a VIP move every "
+		  f"{config.SCENARIO_PERIOD} steps \n")
+	print("    rollouts  random walk s  scenarios s  scenarios/s")
+	for count in counts:
+		with config.override({"VIP_STATE": config.VIPState.AUTO,
+				"VIP_EPISODE": config.SCENARIO_PERIOD}):
+			start = time.perf_counter()
+			evaluator.rollout(count, steps, seed = 0)
+			walk_time = time.perf_counter() - start
+
+		start = time.perf_counter()
+		scenario_iter = scenarios.generate_scenarios(count)
+		while True:
+			batch = list(itertools.islice(scenario_iter, config.SCENARIO_BATCH))
+			if len(batch) == 0: break
+			evaluator.rollout(len(batch), steps, seed = 0, scenarios = batch)
+		scenario_time = time.perf_counter() - start
+
+		print(f"  {count:10} {walk_time:14.3f} {scenario_time:12.3f} "
+			  f"{count / scenario_time:12.0f}")
+	print()
+
+BENCHMARKS = {
+	"ghosts": bench_ghosts,
+	"imports": bench_imports,
+	"update_modes": bench_update_modes,
+	"sweeping": bench_sweeping,
+	"efficiency": bench_efficiency,
+	"multi": bench_multi,
+	"kernels": bench_kernels,
+	"latency": bench_latency,
+	"scenarios": bench_scenarios,
+}
+
+def main():
+	# benchmark runs are not experiments, keep them out of the results
+	config.RESULTS_FILE = None
+
+	names = sys.argv[1:] or list(BENCHMARKS.keys())
+	for name in names:
+		BENCHMARKS[name]()
+
+if __name__ == "__main__":
+	main()
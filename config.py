@@ -1,4 +1,5 @@
 from enum import IntEnum
+import contextlib
 
 RENDER_ENABLED = True
 
@@ -13,27 +14,122 @@ CELL_H = SCREEN_H / GRID_H
 TARGET_FPS = 60
 STEP_TIME = 0.01
 
+# safety cap on steps per run, 0 runs until converged or forever
 ITERATION_MAX = 2000
 
+# runs may stop early once converged, see utils.ConvergenceMonitor, off
+# by default so runs last ITERATION_MAX steps
+CONVERGE_INTERVAL = 200
+CONVERGE_PATIENCE = 5
+# spread of the rolling guard reward counted as a plateau, for example
+# 1.0, 0 disables
+CONVERGE_REWARD_TOLERANCE = 0
+# mean absolute guard Q change per update counted as converged, for
+# example 0.1, 0 disables
+CONVERGE_Q_CHANGE = 0
+
 GHOST_COUNT = 100
 GHOST_COUNT_INTERVAL = 20
 
 SUFFERING = 0
 
+GUARD_GAMMA = 0.2
+HOSTILE_GAMMA = 0.8
+
 MORTAL_EXPLORATION = 0.1 # unused
 GHOST_EXPLORATION = 1.0
 GHOST_FOLLOW_REWARD = True
 
+# step size of each source's backups to the shared tables, 1 overwrites
+# entries with their targets. Ghosts that choose the worst actions learn
+# off-policy and may be trusted less than ones that follow the reward.
+MAIN_UPDATE_WEIGHT = 1.0
+GHOST_FOLLOW_WEIGHT = 1.0
+GHOST_ANTI_FOLLOW_WEIGHT = 1.0
+
 DELAYED_REWARD = True
 
+# Q table backup used by the main agents and their ghosts
+class UpdateMode(IntEnum):
+	ONE_STEP = 0
+	N_STEP = 1
+	LAMBDA = 2
+
+UPDATE_MODE = UpdateMode.ONE_STEP
+# steps kept per agent for n-step and lambda backups
+TRACE_LENGTH = 4
+# lambda of lambda backups, which are Watkins's Q(lambda) and cut traces
+# at actions that are not greedy
+TRACE_DECAY = 0.8
+
+# backups per step spent by prioritized sweeping, 0 disables it
+SWEEP_BUDGET = 0
+# smallest TD error queued for sweeping
+SWEEP_THRESHOLD = 1e-3
+
+# kernels of ghost steps, NUMBA runs fused compiled steps if Numba is
+# installed and falls back to NUMPY otherwise
+class Backend(IntEnum):
+	NUMPY = 0
+	NUMBA = 1
+
+BACKEND = Backend.NUMPY
+
+# run World.update on a worker thread in the GUI, see simulation.py
+THREADED_UPDATE = False
+# longest a frame waits for the simulation thread to apply new input
+INPUT_WAIT = 0.008
+# threads stepping batches of ghosts, 1 steps them on the updating thread
+GHOST_THREADS = 1
+
 VIP_EPISODE = 100
 
+# steps between moves of a scripted VIP, see scenarios.py
+SCENARIO_PERIOD = 10
+# scenarios evaluated per vectorized rollout
+SCENARIO_BATCH = 500
+
+# map of walls and no-go zones, see gridmap.load_map, None for an open grid
+MAP_FILE = None
+# guards only cover hostiles they can see past walls
+LINE_OF_SIGHT = False
+# cells whose route distances are kept, see gridmap.GridMap.get_distances
+DISTANCE_CACHE_SIZE = 256
+
+# agents per team of a world.MultiWorld
+GUARD_COUNT = 4
+HOSTILE_COUNT = 16
+# cells per side of a spatial index bucket, 0 compares every pair instead
+SPATIAL_BUCKET = 4
+# distance from a hostile within which a guard counts as covering it
+COVER_DST = 2.0
+
 HOSTILE_CLOSEST_DST = 2.5
 HOSTILE_CLOSEST_DST2 = pow(HOSTILE_CLOSEST_DST, 2)
 
 GUARD_Q_FILE = "guard_q_table.dat"
 HOSTILE_Q_FILE = "hostile_q_table.dat"
 
+# greedy policy evaluation of saved tables
+EVAL_ROLLOUTS = 2000
+EVAL_STEPS = 200
+EVAL_WORKERS = 1
+# threat to the VIP above which a step counts as a breach
+EVAL_BREACH_THREAT = 2.0
+
+# file trajectories of new worlds are recorded to, None disables recording
+TRAJECTORY_FILE = None
+# ghosts of each kind recorded per step
+TRAJECTORY_GHOSTS = 0
+
+# SQLite file runs, their config, metrics and fitness are stored in, see
+# results.py, for example "results.db", None disables storing
+RESULTS_FILE = None
+# guard steps between stored metrics
+RESULTS_INTERVAL = 50
+# metric rows written per transaction
+RESULTS_BATCH = 200
+
 GRAPH_REWARDS = True
 MONITOR_AVG_DENSITY = 10
 
@@ -42,8 +138,16 @@ class VIPState(IntEnum):
 	FROZEN = 0
 	AUTO = 1
 	MOUSE = 2
+	# follows the path of a scenarios.Scenario
+	SCRIPTED = 3
+
+class HeatmapState(IntEnum):
+	OFF = 0
+	GUARD_Q = 1
+	THREAT = 2
 
 VIP_STATE = VIPState.FROZEN
+HEATMAP_STATE = HeatmapState.OFF
 RENDER_TEXT_ENABLED = False
 RENDER_GHOSTS_ENABLED = True
 
@@ -64,3 +168,16 @@ def set_suffering(v):
 	SUFFERING = v
 	print(f"Set SUFERING to {v}.")
 
+'''
+Temporarily sets config variables
+
+@param settings dict of variable names to values
+'''
+@contextlib.contextmanager
+def override(settings):
+	saved = {name: globals()[name] for name in settings}
+	globals().update(settings)
+	try:
+		yield
+	finally:
+		globals().update(saved)
@@ -0,0 +1,271 @@
+import config
+import agent
+import ghosts
+import q_learner
+import gridmap
+
+import sys
+import math
+import itertools
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+class PolicyEvaluator:
+
+	'''
+	Runs batches of independent greedy rollouts of a guard against a
+	hostile, none of which write to the tables
+
+	@param guard_table   guard Q table, state (x, y, vip, hostile)
+	@param hostile_table hostile Q table, state (x, y, vip, guard)
+	'''
+	def __init__(self, guard_table, hostile_table):
+		self.guard = q_learner.QController(q_table = guard_table,
+				action_size = (4,), exploration = 0)
+		self.hostile = q_learner.QController(q_table = hostile_table,
+				action_size = (4,), exploration = 0)
+
+	'''
+	@param count number of rollouts
+	@param steps steps per rollout
+	@param seed  seed of the random starts and tie breaking
+	@param scenarios scenarios.Scenario the VIP of each rollout follows,
+	             moving every @config.SCENARIO_PERIOD steps, or None for
+	             the VIP of @config.VIP_STATE
+	@return      (average guard reward, breached) arrays per rollout
+	'''
+	def rollout(self, count, steps, seed = None, scenarios = None):
+		if seed is not None:
+			np.random.seed(seed)
+
+		# random open starts
+		grid_map = gridmap.get_map()
+		(vxs, vys) = grid_map.random_cells(count)
+		(gxs, gys) = grid_map.random_cells(count)
+		(hxs, hys) = grid_map.random_cells(count)
+
+		paths = None
+		if scenarios is not None:
+			if len(scenarios) != count:
+				raise ValueError(f"expected {count} scenarios, "
+						f"got {len(scenarios)}")
+			for s in scenarios:
+				if not grid_map.is_open(s.start):
+					raise ValueError(f"scenario \"{s.name}\" starts on "
+							f"{s.start}, which is not open")
+
+			vxs = np.array([s.start[0] for s in scenarios])
+			vys = np.array([s.start[1] for s in scenarios])
+			# cells of the agents as the paths last saw them
+			cells = [None]
+			paths = [s.get_path(self.get_observer(cells, i))
+					for (i, s) in enumerate(scenarios)]
+
+		# hostiles start outside of the VIP's closest distance
+		bad = ~agent.hostile_cells_allowed((vxs, vys), hxs, hys)
+		while bad.any():
+			(hxs[bad], hys[bad]) = grid_map.random_cells(np.count_nonzero(bad))
+			bad = ~agent.hostile_cells_allowed((vxs, vys), hxs, hys)
+
+		reward_sums = np.zeros(count)
+		breached = np.zeros(count, dtype = bool)
+
+		for step in range(steps):
+			# hostile acts
+			(a,) = self.hostile.get_actions(
+					(hxs, hys, vxs, vys, gxs, gys), count)
+			(hxs, hys) = ghosts.move_cells(hxs, hys, a,
+					lambda xs, ys: agent.hostile_cells_allowed(
+						(vxs, vys), xs, ys))
+
+			# guard acts
+			(a,) = self.guard.get_actions(
+					(gxs, gys, vxs, vys, hxs, hys), count)
+			(gxs, gys) = ghosts.move_cells(gxs, gys, a)
+
+			reward_sums += agent.guard_rewards(
+					(vxs, vys), gxs, gys, hxs, hys)
+			breached |= agent.threat_levels(
+					(vxs, vys), gxs, gys, hxs, hys) > config.EVAL_BREACH_THREAT
+
+			# scripted VIPs take their next move, paths stay once over
+			if paths is not None:
+				if (step + 1) % config.SCENARIO_PERIOD == 0:
+					cells[0] = (gxs, gys, hxs, hys)
+					for (i, path) in enumerate(paths):
+						cell = next(path, None)
+						if cell is not None:
+							(vxs[i], vys[i]) = cell
+
+			# VIP walks randomly every episode
+			elif config.VIP_STATE == config.VIPState.AUTO and \
+					(step + 1) % config.VIP_EPISODE == 0:
+				nxs = np.clip(vxs + np.random.randint(-1, 2, count),
+						0, config.GRID_W - 1)
+				nys = np.clip(vys + np.random.randint(-1, 2, count),
+						0, config.GRID_H - 1)
+				# walls block the VIP
+				moved = grid_map.open[nxs, nys]
+				vxs = np.where(moved, nxs, vxs)
+				vys = np.where(moved, nys, vys)
+
+		return reward_sums / steps, breached
+
+	'''
+	@param cells list holding (gxs, gys, hxs, hys) of the rollouts
+	@return      function returning the (guard, hostile) cells of rollout @i
+	'''
+	def get_observer(self, cells, i):
+		def observe():
+			(gxs, gys, hxs, hys) = cells[0]
+			return (int(gxs[i]), int(gys[i])), (int(hxs[i]), int(hys[i]))
+
+		return observe
+
+'''
+Mean with a normal 95% confidence interval
+'''
+def mean_interval(values):
+	mean = np.mean(values)
+	half = 1.96 * np.std(values, ddof = 1) / math.sqrt(len(values)) \
+			if len(values) > 1 else 0
+	return mean, mean - half, mean + half
+
+'''
+Rate of successes with a Wilson 95% confidence interval
+'''
+def rate_interval(successes, count, z = 1.96):
+	rate = successes / count
+	center = (rate + z * z / (2 * count)) / (1 + z * z / count)
+	half = z * math.sqrt(rate * (1 - rate) / count + z * z / (4 * count * count)) \
+			/ (1 + z * z / count)
+	return rate, center - half, center + half
+
+evaluator = None
+
+def init_worker(guard_file, hostile_file):
+	global evaluator
+	evaluator = PolicyEvaluator(
+			q_learner.open_table(guard_file),
+			q_learner.open_table(hostile_file))
+
+def run_worker(args):
+	return evaluator.rollout(*args)
+
+'''
+Maps @func over @jobs on @pool, taking jobs lazily so at most @window
+run or wait at a time
+
+@return iterator of results in job order
+'''
+def map_lazily(pool, func, jobs, window):
+	futures = collections.deque()
+	for job in jobs:
+		futures.append(pool.submit(func, job))
+		if len(futures) >= window:
+			yield futures.popleft().result()
+
+	while len(futures) > 0:
+		yield futures.popleft().result()
+
+'''
+Evaluates saved guard and hostile tables with greedy rollouts from
+random starts, split across worker processes
+
+@return (average guard reward, breached) arrays per rollout
+'''
+def evaluate_files(guard_file = config.GUARD_Q_FILE,
+		hostile_file = config.HOSTILE_Q_FILE, rollouts = None, steps = None,
+		workers = None, seed = 0):
+	rollouts = config.EVAL_ROLLOUTS if rollouts is None else rollouts
+	steps = config.EVAL_STEPS if steps is None else steps
+	workers = config.EVAL_WORKERS if workers is None else workers
+
+	# convert pickled tables once before the workers map them
+	q_learner.open_table(guard_file)
+	q_learner.open_table(hostile_file)
+
+	chunks = np.array_split(np.arange(rollouts), max(1, workers))
+	jobs = [(len(chunk), steps, seed + i)
+			for (i, chunk) in enumerate(chunks) if len(chunk) > 0]
+
+	if workers <= 1:
+		init_worker(guard_file, hostile_file)
+		results = [run_worker(job) for job in jobs]
+	else:
+		with ProcessPoolExecutor(workers, initializer = init_worker,
+				initargs = (guard_file, hostile_file)) as pool:
+			results = list(pool.map(run_worker, jobs))
+
+	return (np.concatenate([r[0] for r in results]),
+			np.concatenate([r[1] for r in results]))
+
+'''
+Evaluates saved guard and hostile tables with a greedy rollout per
+scenario. Scenarios are read lazily, @batch_size at a time, and every
+batch runs as one vectorized rollout on a worker.
+
+@param scenarios iterable of scenarios.Scenario, may be a lazy stream
+@return          (kind, average guard reward, breached) arrays per scenario
+'''
+def evaluate_scenarios(scenarios, guard_file = config.GUARD_Q_FILE,
+		hostile_file = config.HOSTILE_Q_FILE, steps = None, batch_size = None,
+		workers = None, seed = 0):
+	steps = config.EVAL_STEPS if steps is None else steps
+	batch_size = config.SCENARIO_BATCH if batch_size is None else batch_size
+	workers = config.EVAL_WORKERS if workers is None else workers
+
+	# convert pickled tables once before the workers map them
+	q_learner.open_table(guard_file)
+	q_learner.open_table(hostile_file)
+
+	kinds = []
+	def get_jobs():
+		scenario_iter = iter(scenarios)
+		for i in itertools.count():
+			batch = list(itertools.islice(scenario_iter, batch_size))
+			if len(batch) == 0: return
+
+			kinds.extend(s.kind for s in batch)
+			yield (len(batch), steps, seed + i, batch)
+
+	if workers <= 1:
+		init_worker(guard_file, hostile_file)
+		results = [run_worker(job) for job in get_jobs()]
+	else:
+		with ProcessPoolExecutor(workers, initializer = init_worker,
+				initargs = (guard_file, hostile_file)) as pool:
+			results = list(map_lazily(pool, run_worker, get_jobs(),
+					2 * workers))
+
+	if len(results) == 0:
+		return np.array([]), np.array([]), np.array([], dtype = bool)
+
+	return (np.array(kinds),
+			np.concatenate([r[0] for r in results]),
+			np.concatenate([r[1] for r in results]))
+
+def print_report(rewards, breached):
+	(mean, low, high) = mean_interval(rewards)
+	(rate, rate_low, rate_high) = rate_interval(
+			np.count_nonzero(breached), len(breached))
+	percentiles = np.percentile(rewards, [5, 25, 50, 75, 95])
+
+	print(f"\n\nEvaluation over {len(rewards)} rollouts \n\n"
+		  f"  Guard average reward: \n"
+		  f"      mean:        {mean:.4f} (95% CI {low:.4f} to {high:.4f}) \n"
+		  f"      percentiles: " +
+		  ", ".join(f"p{p} {v:.4f}" for (p, v) in
+			  zip([5, 25, 50, 75, 95], percentiles)) + " \n\n"
+		  f"  VIP breaches: \n"
+		  f"      rate:        {rate:.4f} (95% CI {rate_low:.4f} to {rate_high:.4f}) \n\n\n")
+
+def main():
+	rollouts = int(sys.argv[1]) if len(sys.argv) > 1 else None
+	workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+	print_report(*evaluate_files(rollouts = rollouts, workers = workers))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,221 @@
+import config
+import utils
+import q_learner
+import kernels
+import gridmap
+
+import numpy as np
+
+'''
+Moves cells one step in the cardinal direction of their action with the
+next cell table of the map, cells whose destination is off the grid, a
+wall or not allowed stay put
+
+@param a           cardinal action index array
+@param is_allowed  a function (xs, ys) -> bool array, or None
+@return            new (xs, ys)
+'''
+def move_cells(xs, ys, a, is_allowed = None):
+	(nxs, nys) = gridmap.get_map().get_next_cells(xs, ys, a)
+	if is_allowed is None:
+		return (nxs, nys)
+
+	legal = is_allowed(nxs, nys)
+	return (np.where(legal, nxs, xs), np.where(legal, nys, ys))
+
+class GhostPool:
+
+	'''
+	Struct-of-arrays storage for the ghosts of a main agent. Every ghost
+	shares a single controller linked to the owner's Q table, and only
+	the ghost cells are stored per ghost.
+
+	@param owner      the QAgent whose state, reward and legality are used
+	@param color      render color of the ghosts
+	@param capacity   number of preallocated ghost slots
+	@param controller controller shared by the ghosts, by default a new one
+	                  linked to the owner's
+	'''
+	def __init__(self, owner, color, capacity = 0, controller = None):
+		self.owner = owner
+		self.color = color
+		self.radius = 0.4
+
+		if controller is None:
+			controller = q_learner.QController(
+					linked_controller = owner.controller,
+					exploration = config.GHOST_EXPLORATION,
+					follow_reward = config.GHOST_FOLLOW_REWARD,
+					update_weight = config.GHOST_FOLLOW_WEIGHT,
+					anti_follow_weight = config.GHOST_ANTI_FOLLOW_WEIGHT)
+		self.controller = controller
+		# controllers of batches stepped at the same time, see get_batches
+		self.batch_controllers = []
+
+		self.count = 0
+		self.xs = np.zeros(capacity, dtype = np.int32)
+		self.ys = np.zeros(capacity, dtype = np.int32)
+
+		self.move_timer = utils.Timer(config.STEP_TIME)
+		self.iteration_count = 0
+
+	def __len__(self):
+		return self.count
+
+	def get_capacity(self):
+		return len(self.xs)
+
+	def reserve(self, capacity):
+		if capacity <= self.get_capacity(): return
+
+		xs = np.zeros(capacity, dtype = np.int32)
+		ys = np.zeros(capacity, dtype = np.int32)
+		xs[:self.count] = self.xs[:self.count]
+		ys[:self.count] = self.ys[:self.count]
+		self.xs = xs
+		self.ys = ys
+
+	'''
+	Grows or shrinks the pool, new ghosts are placed on random cells
+
+	@param count new number of ghosts
+	'''
+	def set_count(self, count):
+		count = max(0, count)
+
+		if count > self.count:
+			if count > self.get_capacity():
+				# grow geometrically so repeated resizes stay cheap
+				self.reserve(max(count, 2 * self.get_capacity()))
+
+			# new ghosts start without history
+			self.controller.reset_traces(self.count)
+			(self.xs[self.count:count], self.ys[self.count:count]) = \
+					gridmap.get_map().random_cells(count - self.count)
+
+		self.count = count
+
+	def get_cells(self):
+		return (self.xs[:self.count], self.ys[:self.count])
+
+	'''
+	Writes the backups still pending at the end of a run
+	'''
+	def flush_traces(self):
+		(xs, ys) = self.get_cells()
+		self.controller.flush_traces(self.owner.get_states(xs.copy(), ys.copy()))
+
+	def get_bytes_per_ghost(self):
+		return self.xs.itemsize + self.ys.itemsize
+
+	def get_nbytes(self):
+		return self.xs.nbytes + self.ys.nbytes
+
+	def get_iteration_count(self):
+		return self.iteration_count
+
+	def get_controllers(self):
+		return [self.controller] + self.batch_controllers
+
+	'''
+	Advances the move timer
+
+	@return whether the ghosts are due a step
+	'''
+	def tick(self, deltatime):
+		self.move_timer.update(deltatime)
+		if not self.move_timer.is_finished():
+			return False
+
+		self.move_timer.reset()
+		self.iteration_count += 1
+		return True
+
+	def update(self, deltatime):
+		if self.tick(deltatime):
+			self.step()
+
+	'''
+	Splits the ghosts into up to @count contiguous batches that can step at
+	the same time. Every batch gets its own controller linked to the same
+	table, so update counters are never shared between threads. Traces
+	and sweeping are kept per pool, so only plain one-step backups split.
+
+	@return list of (start, stop, controller)
+	'''
+	def get_batches(self, count):
+		controller = self.controller
+		if controller.sweeper is not None or \
+				controller.update_mode != config.UpdateMode.ONE_STEP:
+			count = 1
+		count = max(1, min(count, self.count))
+
+		while len(self.batch_controllers) < count - 1:
+			self.batch_controllers.append(q_learner.QController(
+					linked_controller = controller))
+		controllers = [controller] + self.batch_controllers[:count - 1]
+		for c in controllers[1:]:
+			c.exploration = controller.exploration
+			c.follow_reward = controller.follow_reward
+			c.update_weight = controller.update_weight
+			c.anti_follow_weight = controller.anti_follow_weight
+
+		bounds = np.linspace(0, self.count, count + 1).astype(int)
+		return [(bounds[i], bounds[i + 1], controllers[i])
+				for i in range(count)]
+
+	'''
+	Moves the ghosts from @start to @stop one step with a shared
+	controller and backs up the resulting trajectories in a single batch
+
+	@param controller controller of the batch, the pool's by default
+	@return           rewards of the ghosts before suffering, or None
+	                  without ghosts
+	'''
+	def step(self, start = 0, stop = None, controller = None):
+		stop = self.count if stop is None else min(stop, self.count)
+		n = stop - start
+		if n <= 0: return None
+		if controller is None:
+			controller = self.controller
+
+		if kernels.get_backend() == config.Backend.NUMBA and kernels.can_fuse(self):
+			return kernels.fused_step(self, start = start, stop = stop,
+					controller = controller)
+
+		xs = self.xs[start:stop]
+		ys = self.ys[start:stop]
+		s = self.owner.get_states(xs.copy(), ys.copy())
+
+		# get actions from controller
+		a = controller.get_actions(s, n)
+
+		# do those actions
+		(xs[:], ys[:]) = move_cells(xs, ys, a[0],
+				self.owner.cells_are_allowed)
+
+		# get new states and rewards
+		s_ = self.owner.get_states(xs, ys)
+		r = self.owner.get_rewards(xs, ys)
+
+		# add suffering factor for data
+		suffered = r
+		if self.owner.can_suffer:
+			suffered = r - (config.SUFFERING - 26)
+
+		controller.update_trajectories(s, a, suffered, s_)
+
+		return r
+
+	'''
+	@param cells (xs, ys) to draw, the current cells by default
+	'''
+	def render(self, screen, cells = None):
+		import pygame as pg
+		rad = int(self.radius * min(config.CELL_W, config.CELL_H))
+		(xs, ys) = self.get_cells() if cells is None else cells
+		# ghosts on the same cell look like one, draw every cell once
+		occupied = np.unique(xs.astype(np.int64) * config.GRID_H + ys)
+		for cell in zip((occupied // config.GRID_H).tolist(),
+				(occupied % config.GRID_H).tolist()):
+			pg.draw.circle(screen, self.color, utils.to_screen(cell), rad)
@@ -0,0 +1,213 @@
+import config
+import utils
+
+import numpy as np
+
+# map file cells
+OPEN = "."
+WALL = "#"
+# open to guards and the VIP, closed to hostiles
+NO_GO = "~"
+
+class GridMap:
+
+	'''
+	Walls and hostile no-go zones of a grid, with moves and legality
+	precomputed as lookup tables. Cells are indexed x * h + y.
+
+	  next_cells[cell, action]      cell reached by the action, the same
+	                                cell when blocked by an edge or wall
+	  hostile_allowed[vip, cell]    whether a hostile may stand on the
+	                                cell with the VIP on @vip
+	  sight[cell, cell]             whether the cells see each other,
+	                                built on first use
+	  distances[cell]               moves from every cell to the cell,
+	                                built on first use per cell
+
+	@param walls   bool array indexed [x, y]
+	@param no_go   bool array indexed [x, y] of cells closed to hostiles
+	'''
+	def __init__(self, walls, no_go = None):
+		(self.w, self.h) = walls.shape
+		self.walls = walls
+		self.no_go = np.zeros_like(walls) if no_go is None else no_go
+		self.open = ~walls
+		self.all_open = bool(self.open.all())
+		self.open_cells = np.flatnonzero(self.open)
+
+		(xs, ys) = self.get_cell_coords(np.arange(self.w * self.h))
+
+		# next cell of every action, blocked moves stay put
+		nxs = xs[:, None] + np.array([d[0] for d in utils.CARDINALS])
+		nys = ys[:, None] + np.array([d[1] for d in utils.CARDINALS])
+		inside = (nxs >= 0) & (nxs < self.w) & (nys >= 0) & (nys < self.h)
+		targets = np.clip(nxs, 0, self.w - 1) * self.h + np.clip(nys, 0, self.h - 1)
+		legal = inside & self.open.reshape(-1)[targets]
+		self.next_cells = np.where(legal, targets,
+				np.arange(self.w * self.h)[:, None]).astype(np.int32)
+
+		# hostiles keep their distance to the VIP and out of no-go zones
+		dst2 = (xs[:, None] - xs[None, :]) ** 2 + (ys[:, None] - ys[None, :]) ** 2
+		self.hostile_allowed = (dst2 > config.HOSTILE_CLOSEST_DST2) & \
+				(self.open & ~self.no_go).reshape(-1)[None, :]
+
+		self.sight = None
+		self.distances = {}
+
+	def get_cells(self, xs, ys):
+		return np.asarray(xs, dtype = np.intp) * self.h + np.asarray(ys, dtype = np.intp)
+
+	def get_cell_coords(self, cells):
+		return cells // self.h, cells % self.h
+
+	def is_open(self, pos):
+		(x, y) = pos
+		return x >= 0 and x < self.w and y >= 0 and y < self.h and \
+			   bool(self.open[int(x), int(y)])
+
+	'''
+	@return cell reached from @pos by action @a
+	'''
+	def get_next_cell(self, pos, a):
+		cell = self.next_cells[int(pos[0]) * self.h + int(pos[1]), a]
+		return (int(cell // self.h), int(cell % self.h))
+
+	'''
+	@param a cardinal action index array
+	@return  (xs, ys) reached by the actions
+	'''
+	def get_next_cells(self, xs, ys, a):
+		return self.get_cell_coords(self.next_cells[self.get_cells(xs, ys), a])
+
+	'''
+	@param vip_pos VIP cell, its coordinates may be arrays
+	'''
+	def get_hostile_allowed(self, vip_pos, xs, ys):
+		return self.hostile_allowed[self.get_cells(*vip_pos), self.get_cells(xs, ys)]
+
+	'''
+	Random open cells, drawn like np.random.randint over the grid when
+	every cell is open
+
+	@return (xs, ys)
+	'''
+	def random_cells(self, count):
+		if self.all_open:
+			return (np.random.randint(0, self.w, count),
+					np.random.randint(0, self.h, count))
+
+		cells = self.open_cells[np.random.randint(0, len(self.open_cells), count)]
+		return self.get_cell_coords(cells)
+
+	'''
+	@return the open cell closest to @pos
+	'''
+	def nearest_open(self, pos):
+		if self.is_open(pos):
+			return pos
+
+		(xs, ys) = self.get_cell_coords(self.open_cells)
+		i = np.argmin((xs - pos[0]) ** 2 + (ys - pos[1]) ** 2)
+		return (int(xs[i]), int(ys[i]))
+
+	'''
+	Breadth first search over the move table from @pos
+
+	@return moves from every cell to @pos, indexed like cells, -1 where
+	        @pos cannot be reached
+	'''
+	def get_distances(self, pos):
+		cell = int(pos[0]) * self.h + int(pos[1])
+		if cell in self.distances:
+			return self.distances[cell]
+
+		distances = np.full(self.w * self.h, -1, dtype = np.int32)
+		distances[cell] = 0
+		frontier = np.array([cell])
+		distance = 0
+		while len(frontier) > 0:
+			distance += 1
+			# moves are symmetric, so the cells next to the frontier reach it
+			cells = np.unique(self.next_cells[frontier])
+			frontier = cells[distances[cells] < 0]
+			distances[frontier] = distance
+
+		# a row per cell searched from, bounded on large maps
+		if len(self.distances) >= config.DISTANCE_CACHE_SIZE:
+			self.distances.clear()
+		self.distances[cell] = distances
+		return distances
+
+	'''
+	Whether guards see hostiles, sampling the segment between the cell
+	centers at quarter cell steps. Every cell sees every other without
+	walls.
+	'''
+	def get_sight(self):
+		if self.sight is not None:
+			return self.sight
+
+		count = self.w * self.h
+		if self.all_open:
+			self.sight = np.ones((count, count), dtype = bool)
+			return self.sight
+
+		(xs, ys) = self.get_cell_coords(np.arange(count))
+		samples = np.linspace(0, 1, 4 * max(self.w, self.h) + 1)
+		self.sight = np.empty((count, count), dtype = bool)
+		for cell in range(count):
+			# sample points of the segments to every cell, [cell, sample]
+			pxs = xs[cell] + (xs - xs[cell])[:, None] * samples
+			pys = ys[cell] + (ys - ys[cell])[:, None] * samples
+			blocked = self.walls[np.rint(pxs).astype(np.intp),
+					np.rint(pys).astype(np.intp)]
+			self.sight[cell] = ~blocked.any(axis = 1)
+
+		return self.sight
+
+'''
+Reads a map of one character per cell, a line per row from the top.
+'.' is open, '#' a wall and '~' open to all but hostiles. Lines starting
+with ';' are comments.
+'''
+def load_map(filename):
+	with open(filename) as fp:
+		rows = [line.rstrip("\n") for line in fp
+				if line.strip() != "" and not line.startswith(";")]
+
+	w = max(len(row) for row in rows)
+	# pad short rows with open cells
+	chars = np.array([list(row.ljust(w, OPEN)) for row in rows]).T
+
+	unknown = set(np.unique(chars)) - {OPEN, WALL, NO_GO}
+	if len(unknown) > 0:
+		raise ValueError(f"Map \"{filename}\" has unknown cells {sorted(unknown)}.")
+
+	return GridMap(chars == WALL, chars == NO_GO)
+
+current_map = None
+current_key = None
+
+'''
+@return the map of the current config, @config.MAP_FILE or an open grid,
+        built again only when the config changes
+'''
+def get_map():
+	global current_map, current_key
+
+	key = (config.MAP_FILE, config.GRID_W, config.GRID_H,
+			config.HOSTILE_CLOSEST_DST2)
+	if key == current_key:
+		return current_map
+
+	if config.MAP_FILE is None:
+		grid_map = GridMap(np.zeros((config.GRID_W, config.GRID_H), dtype = bool))
+	else:
+		grid_map = load_map(config.MAP_FILE)
+		if (grid_map.w, grid_map.h) != (config.GRID_W, config.GRID_H):
+			raise ValueError(f"Map \"{config.MAP_FILE}\" is {grid_map.w} x "
+					f"{grid_map.h} but the grid is {config.GRID_W} x "
+					f"{config.GRID_H}, set GRID_W and GRID_H to match.")
+
+	(current_map, current_key) = (grid_map, key)
+	return current_map
@@ -0,0 +1,206 @@
+import config
+import world
+import utils
+import simulation
+
+import sys
+
+from PyQt5.QtWidgets import QMainWindow, QApplication, QWidget 
+from PyQt5.QtGui import QGridLayout
+from PyQt5.QtCore import QTimer
+
+import pygame as pg
+
+
+class PygameWindow():
+
+	def __init__(self):
+
+		if config.RENDER_ENABLED:
+			pg.init()
+			pg.display.set_caption("Bodyguarding")
+			self.screen = pg.display.set_mode(
+				(config.SCREEN_W, config.SCREEN_H), pg.RESIZABLE)
+
+			self.clock = pg.time.Clock()
+			self.clock.tick()
+
+		self.deltatime = 0
+		self.world = None
+
+	def run_world(self, world):
+		if config.THREADED_UPDATE:
+			world = simulation.SimulationThread(world)
+		self.world = world
+
+	def on_resize(self, w, h):
+
+		config.SCREEN_W = w
+		config.SCREEN_H = h
+		config.CELL_W = config.SCREEN_W / config.GRID_W
+		config.CELL_H = config.SCREEN_H / config.GRID_H
+		print(f"{w} x {h}")
+
+
+	def update_no_render(self):
+		world_running = not self.world.update(10)
+
+		if not world_running:
+			self.world.on_close()
+			self.world = None
+
+		return True, world_running
+
+	def update(self):
+		if self.world is None: return True, False
+
+		if not config.RENDER_ENABLED:
+			return self.update_no_render()
+
+		running = True
+		for event in pg.event.get():
+			if event.type == pg.QUIT:
+				running = False
+
+			if event.type == pg.VIDEORESIZE:
+				# resize window
+				screen = pg.display.set_mode(
+					(event.w, event.h), pg.RESIZABLE)
+				self.on_resize(event.w, event.h)
+
+			if event.type == pg.MOUSEMOTION:
+				self.world.on_mouse_move(pg.mouse.get_pos())
+
+			if event.type == pg.KEYUP:
+				if event.key == pg.K_ESCAPE:
+					running = False
+
+				num = event.key - pg.K_0
+				if num >= 0 and num <= 9:
+					self.world.on_number_pressed(num)
+
+				self.world.on_key_pressed(event.key)
+
+		# update world
+		world_running = not self.world.update(self.deltatime)
+		# clear canvas
+		self.screen.fill((255, 255, 255))
+		# render world
+		self.world.render(self.screen)
+
+		pg.display.flip()
+
+		self.deltatime = self.clock.tick(config.TARGET_FPS) / 1000
+
+		if not (running and world_running):
+			self.world.on_close()
+			self.world = None
+
+		return running, world_running
+
+class MainWindow(QMainWindow):
+
+	def __init__(self, parent = None):
+		super().__init__()
+
+		self.title = "Graphs and Stuff"
+		self.width = 1200
+		self.height = 900
+
+		self.setWindowTitle(self.title)
+		self.setGeometry(0, 0, self.width, self.height)
+
+		self.layout = QGridLayout()
+		self.layout.setContentsMargins(10, 10, 10, 10)
+		self.layout_widget = QWidget()
+		self.layout_widget.setLayout(self.layout)
+		self.setCentralWidget(self.layout_widget)
+
+		self.rewards_graph = utils.LiveGraph(
+				title = "Guard vs. Hostile", 
+				subgraph_count = 2, 
+				sample_efficiency = 0.05,
+				parent = self)
+		self.suffer_graph = utils.LiveGraph(
+				"Performance by Suffering", 1, self)
+		self.ghost_graph = utils.LiveGraph(
+				"Performance by Ghosting", 1, self)
+		self.exploration_graph = utils.LiveGraph(
+				"Performance by Ghost Exploration", 1, self)
+
+		self.layout.addWidget(self.rewards_graph.widget, 0, 0)
+		self.layout.addWidget(self.exploration_graph.widget, 0, 1)
+		self.layout.addWidget(self.suffer_graph.widget, 1, 0)
+		self.layout.addWidget(self.ghost_graph.widget, 1, 1)
+
+		# create testing chain
+		self.tester = world.WorldTesterChain([
+			world.WorldTester(config.set_suffering,
+					lambda p, r: self.suffer_graph.add_point(0, p, r),
+					0, 2, 20, config.SUFFERING),
+			world.WorldTester(config.set_ghost_exploration,
+					lambda p, r: self.exploration_graph.add_point(0, p, r),
+					0, 0.1, 1, config.GHOST_EXPLORATION),
+			world.WorldTester(config.set_ghost_count, 
+					lambda p, r: self.ghost_graph.add_point(0, p, r),
+					0, 20, 200, config.GHOST_COUNT)
+			])
+
+		# create pygame window
+		self.pg_window = PygameWindow()
+
+		#self.pg_window.run_world(self.tester.next_world(self))
+		self.pg_window.run_world(world.World(self))
+		
+		self.show()
+
+		self.is_closed = False
+
+		# setup pygame update loop
+		self.timer = QTimer()
+		self.timer.timeout.connect(self.update_pygame)
+		self.timer.start(0)
+
+
+	def update_pygame(self):
+		pg_is_running, world_is_running = self.pg_window.update()
+		
+		
+		if not (pg_is_running and world_is_running):
+			
+			if pg_is_running:
+				world = self.tester.next_world(self)
+				if world is not None:
+					self.pg_window.run_world(world)
+					return
+
+			
+			self.close()
+
+	def close(self):
+		if not self.is_closed: self.on_close()
+		self.is_closed = True
+		super().close()
+
+	def on_close(self):
+		# runs are in the results store, see results.py
+		if config.RESULTS_FILE is not None: return
+
+		# dump graph data
+		self.rewards_graph.dump("reward.gph")
+		self.suffer_graph.dump("suffer.gph")
+		self.ghost_graph.dump("ghost.gph")
+		self.exploration_graph.dump("exploration.gph")
+
+def main():
+
+	# create window 
+	app = QApplication(sys.argv)
+	window = MainWindow()
+	# run the app
+	app.exec_()
+
+	window.close()
+
+if __name__ == "__main__":
+	main()
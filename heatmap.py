@@ -0,0 +1,179 @@
+import config
+import agent
+import utils
+
+import os.path
+import zlib
+import struct
+import numpy as np
+
+'''
+Guard values over every guard cell for the current VIP and hostile
+
+@param qs action values of every cell, read from the world by default
+@return   (max Q, greedy action) arrays indexed [x, y]
+'''
+def guard_q_field(world, qs = None):
+	if qs is None:
+		qs = world.guard.get_superpos_q_grid()
+	return qs.max(axis = -1), qs.argmax(axis = -1)
+
+'''
+Threat to the VIP for every guard cell with the current VIP and hostile,
+and for every hostile cell with the current VIP and guard
+
+@param cells (vip, guard, hostile) cells, read from the world by default
+@return      (threat by guard cell, threat by hostile cell) indexed [x, y]
+'''
+def threat_fields(world, cells = None):
+	if cells is None:
+		cells = (world.vip.get_int_pos(), world.guard.get_int_pos(),
+				world.hostile.get_int_pos())
+	(xs, ys) = np.mgrid[0:config.GRID_W, 0:config.GRID_H]
+	(vip, (gx, gy), (hx, hy)) = cells
+
+	return (agent.threat_levels(vip, xs, ys, hx, hy),
+			agent.threat_levels(vip, gx, gy, xs, ys))
+
+'''
+Maps values to colors, blue for negative through white to red for
+positive, scaled by the largest magnitude
+
+@return uint8 array of shape values.shape + (3,)
+'''
+def to_colors(values):
+	scale = np.abs(values).max()
+	alpha = values / scale if scale > 0 else np.zeros_like(values)
+
+	rgb = np.empty(values.shape + (3,))
+	rgb[..., 0] = np.where(alpha < 0, 1 + alpha, 1)
+	rgb[..., 1] = 1 - np.abs(alpha)
+	rgb[..., 2] = np.where(alpha > 0, 1 - alpha, 1)
+	return (rgb * 255).astype(np.uint8)
+
+'''
+Writes an RGB array indexed [x, y] as a PNG without needing pygame
+'''
+def write_png(filename, rgb):
+	(w, h) = rgb.shape[:2]
+	rows = np.ascontiguousarray(rgb.transpose(1, 0, 2))
+	# filter type 0 byte in front of every row
+	raw = b"".join(b"\x00" + row.tobytes() for row in rows)
+
+	def chunk(kind, data):
+		return struct.pack(">I", len(data)) + kind + data + \
+			   struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+	with open(filename, "wb") as fp:
+		fp.write(b"\x89PNG\r\n\x1a\n" +
+				chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)) +
+				chunk(b"IDAT", zlib.compress(raw)) +
+				chunk(b"IEND", b""))
+
+class HeatmapRenderer:
+
+	'''
+	Draws the guard's max Q with its greedy actions, or the threat by
+	guard cell, under the world. The heatmap is built at grid resolution
+	into a cached surface, which is rebuilt only when the VIP or hostile
+	moves, every @refresh_steps guard steps, or when the screen resizes.
+	'''
+	def __init__(self, refresh_steps = 10):
+		self.refresh_steps = refresh_steps
+		self.surface = None
+		self.key = None
+
+	def get_key(self, snapshot):
+		(vip, guard, hostile) = snapshot.cells
+		return (config.HEATMAP_STATE,
+				config.SCREEN_W, config.SCREEN_H,
+				vip, hostile,
+				guard if config.HEATMAP_STATE == config.HeatmapState.THREAT else None,
+				snapshot.step // self.refresh_steps)
+
+	def build(self, snapshot):
+		import pygame as pg
+
+		if config.HEATMAP_STATE == config.HeatmapState.GUARD_Q:
+			(values, actions) = guard_q_field(None, snapshot.guard_qs)
+		else:
+			(values, _) = threat_fields(None, snapshot.cells)
+			actions = None
+
+		grid = pg.surfarray.make_surface(to_colors(values))
+		surface = pg.transform.scale(grid, (config.SCREEN_W, config.SCREEN_H))
+
+		if actions is not None:
+			# draw greedy actions as short lines towards the next cell
+			length = 0.3
+			for (x, y) in np.ndindex(actions.shape):
+				(dx, dy) = utils.CARDINALS[actions[x, y]]
+				pg.draw.line(surface, (60, 60, 60),
+						utils.to_screen((x, y)),
+						utils.to_screen((x + dx * length, y + dy * length)), 2)
+
+		return surface
+
+	'''
+	@param snapshot world.Snapshot to draw, it only has the guard's
+	                action values while the Q heatmap is shown
+	'''
+	def render(self, screen, snapshot):
+		if config.HEATMAP_STATE == config.HeatmapState.OFF: return
+		if config.HEATMAP_STATE == config.HeatmapState.GUARD_Q and \
+				snapshot.guard_qs is None: return
+
+		key = self.get_key(snapshot)
+		if key != self.key:
+			self.surface = self.build(snapshot)
+			self.key = key
+
+		screen.blit(self.surface, (0, 0))
+
+class HeatmapRecorder:
+
+	'''
+	Records heatmap frames of a world into preallocated arrays for offline
+	analysis
+
+	@param capacity most frames kept
+	'''
+	def __init__(self, capacity):
+		shape = (capacity, config.GRID_W, config.GRID_H)
+		self.max_q = np.zeros(shape)
+		self.policy = np.zeros(shape, dtype = np.uint8)
+		self.guard_threat = np.zeros(shape)
+		self.hostile_threat = np.zeros(shape)
+		self.steps = np.zeros(capacity, dtype = np.int64)
+		self.count = 0
+
+	def record(self, world):
+		if self.count >= len(self.steps): return False
+
+		i = self.count
+		(self.max_q[i], self.policy[i]) = guard_q_field(world)
+		(self.guard_threat[i], self.hostile_threat[i]) = threat_fields(world)
+		self.steps[i] = world.guard.get_iteration_count()
+		self.count += 1
+		return True
+
+	def save_npz(self, filename):
+		n = self.count
+		np.savez_compressed(filename,
+				steps = self.steps[:n],
+				max_q = self.max_q[:n],
+				policy = self.policy[:n],
+				guard_threat = self.guard_threat[:n],
+				hostile_threat = self.hostile_threat[:n])
+
+	'''
+	Writes one PNG per frame of a recorded field into @directory, each
+	grid cell @scale pixels wide
+	'''
+	def save_pngs(self, directory, field = "max_q", scale = 16):
+		frames = getattr(self, field)[:self.count]
+		for (i, frame) in enumerate(frames):
+			rgb = to_colors(frame.astype(float))
+			rgb = rgb.repeat(scale, axis = 0).repeat(scale, axis = 1)
+			write_png(os.path.join(directory,
+					f"{field}_{self.steps[i]:07}.png"), rgb)
@@ -0,0 +1,269 @@
+import config
+import gridmap
+
+import warnings
+import numpy as np
+
+# Numba module once imported by get_numba, False before the first try
+numba = False
+
+# kinds of agents with a fused step
+GUARD = 0
+HOSTILE = 1
+
+'''
+Moves every agent of a ghost pool one step and backs up the one-step
+trajectories, as act + move + reward + update in a single pass. Random
+draws are passed in so every backend makes the same choices.
+
+Runs as plain Python, or compiled when Numba is available. All backups
+are computed before any are written, like QController.update_trajectories.
+
+@param q         Q table viewed as (states, actions)
+@param xs, ys    agent cells, moved in place
+@param vx, vy    VIP cell
+@param ox, oy    cell of the other agent in the state
+@param kind      GUARD or HOSTILE
+@param noise     (agents, actions) tie breaking noise
+@param explore   whether each agent explores
+@param explore_a action of each exploring agent
+@param next_cells, hostile_allowed, sight
+                 tables of a gridmap.GridMap, @sight is None without line
+                 of sight
+@param suffering offset subtracted from backed up rewards
+@param weight    step size of the backups, see QController.weigh
+@param r         rewards before suffering, written
+@return          sum of absolute changes written to @q
+'''
+def step_kernel(q, xs, ys, vx, vy, ox, oy, kind, noise, explore, explore_a,
+		next_cells, hostile_allowed, sight, gamma, follow, suffering,
+		weight, grid_w, grid_h, r):
+	n = len(xs)
+	action_count = q.shape[1]
+	sas = np.empty(n, dtype = np.int64)
+	values = np.empty(n)
+	change = 0.0
+
+	for i in range(n):
+		s = ((((xs[i] * grid_h + ys[i]) * grid_w + vx) * grid_h + vy) * \
+				grid_w + ox) * grid_h + oy
+
+		# act, ties are broken by the highest noise
+		a = explore_a[i]
+		if not explore[i]:
+			target = q[s, 0]
+			for k in range(1, action_count):
+				if follow and q[s, k] > target or \
+				   not follow and q[s, k] < target:
+					target = q[s, k]
+			best_noise = -2.0
+			for k in range(action_count):
+				if q[s, k] == target and noise[i, k] > best_noise:
+					best_noise = noise[i, k]
+					a = k
+
+		# move
+		cell = next_cells[xs[i] * grid_h + ys[i], a]
+		if kind == GUARD or hostile_allowed[vx * grid_h + vy, cell]:
+			xs[i] = cell // grid_h
+			ys[i] = cell % grid_h
+
+		# reward, see agent.threat_levels
+		if kind == GUARD:
+			(gx, gy, hx, hy) = (xs[i], ys[i], ox, oy)
+		else:
+			(gx, gy, hx, hy) = (ox, oy, xs[i], ys[i])
+		(tx, ty, gvx, gvy) = (hx - vx, hy - vy, gx - vx, gy - vy)
+		tv2 = float(tx * tx + ty * ty)
+		gv2 = float(gvx * gvx + gvy * gvy)
+
+		threat = 0.0
+		if tv2 != 0:
+			threat = 70 * np.exp(-np.sqrt(tv2))
+			if gv2 != 0 and gv2 < tv2 and \
+			   (sight is None or sight[gx * grid_h + gy, hx * grid_h + hy]):
+				threat -= 10 * max(float(tx * gvx + ty * gvy), 0.0) / \
+						np.sqrt(tv2 * gv2)
+
+		if kind == GUARD:
+			r[i] = -1 - threat
+			if gv2 > 4 or gv2 <= 0:
+				r[i] -= 10
+		else:
+			r[i] = -1 + threat
+
+		# back up
+		s_ = ((((xs[i] * grid_h + ys[i]) * grid_w + vx) * grid_h + vy) * \
+				grid_w + ox) * grid_h + oy
+		v_ = q[s_, 0]
+		for k in range(1, action_count):
+			v_ = max(v_, q[s_, k])
+
+		sas[i] = s * action_count + a
+		values[i] = r[i] - suffering + gamma * v_
+		if weight != 1:
+			values[i] = q[s, a] + weight * (values[i] - q[s, a])
+		change += abs(values[i] - q[s, a])
+
+	q_flat = q.reshape(-1)
+	for i in range(n):
+		q_flat[sas[i]] = values[i]
+
+	return change
+
+compiled_kernel = None
+# whether the missing Numba fallback was warned about
+warned = False
+
+'''
+Imports Numba on first use only, as it takes far longer to import than
+the rest of the core
+
+@return the Numba module, or None if it is not installed
+'''
+def get_numba():
+	global numba
+	if numba is False:
+		try:
+			import numba as module
+		except ImportError:
+			module = None
+		numba = module
+
+	return numba
+
+'''
+@return the configured backend, or NumPy when Numba is configured but not
+        installed, leaving the config as is
+'''
+def get_backend():
+	global warned
+	if config.BACKEND == config.Backend.NUMBA and get_numba() is None:
+		if not warned:
+			warned = True
+			warnings.warn("Numba is not installed, falling back to the "
+					"NumPy backend.", RuntimeWarning, stacklevel = 2)
+		return config.Backend.NUMPY
+
+	return config.BACKEND
+
+'''
+@return the step kernel compiled with Numba, compiling on first use. It
+        releases the GIL, so batches can step on several threads.
+'''
+def get_compiled_kernel():
+	global compiled_kernel
+	if compiled_kernel is None:
+		compiled_kernel = get_numba().njit(cache = True, nogil = True)(step_kernel)
+
+	return compiled_kernel
+
+'''
+@return whether @pool can step with the fused kernel: its owner has a
+        fused kind and its backups are plain one-step ones
+'''
+def can_fuse(pool):
+	controller = pool.controller
+	return getattr(pool.owner, "step_kind", None) is not None and \
+		   controller.sweeper is None and \
+		   controller.update_mode == config.UpdateMode.ONE_STEP and \
+		   len(controller.action_size) == 1
+
+'''
+Steps every ghost of @pool with the fused kernel, drawing random numbers
+in the same order as QController.get_actions
+
+@param kernel     kernel to run, the compiled one by default
+@param start      first ghost to step
+@param stop       ghost after the last to step, the pool's count by default
+@param controller controller of the ghosts, the pool's by default
+@return           rewards of the ghosts before suffering
+'''
+def fused_step(pool, kernel = None, start = 0, stop = None, controller = None):
+	if kernel is None:
+		kernel = get_compiled_kernel()
+
+	stop = pool.count if stop is None else stop
+	n = stop - start
+	if controller is None:
+		controller = pool.controller
+	owner = pool.owner
+	action_count = controller.action_size[0]
+
+	noise = np.random.random((n, action_count))
+	explore = np.random.random(n) <= controller.exploration
+	explore_a = np.zeros(n, dtype = np.int64)
+	explore_a[explore] = np.random.randint(0, action_count,
+			np.count_nonzero(explore))
+
+	q = controller.q_table.reshape(-1, action_count)
+	xs = pool.xs[start:stop]
+	ys = pool.ys[start:stop]
+	(vx, vy) = owner.vip.get_int_pos()
+	(ox, oy) = owner.get_other_pos()
+	r = np.empty(n)
+
+	grid_map = gridmap.get_map()
+	change = kernel(q, xs, ys, vx, vy, ox, oy, owner.step_kind,
+			noise, explore, explore_a, grid_map.next_cells,
+			grid_map.hostile_allowed,
+			grid_map.get_sight() if config.LINE_OF_SIGHT else None,
+			controller.gamma, controller.follow_reward,
+			config.SUFFERING - 26 if owner.can_suffer else 0,
+			controller.get_update_weight(), config.GRID_W, config.GRID_H, r)
+
+	controller.update_count += n
+	controller.change_sum += change
+	return r
+
+'''
+Runs @steps steps of @pool through the reference path and the fused
+kernel from the same tables, cells and random seed
+
+@param kernel kernel to check, the compiled one by default
+@return       largest differences as a dict of cells, rewards, table and
+              change sum
+'''
+def check_equivalence(pool, kernel = None, steps = 20, seed = 0):
+	controller = pool.controller
+	start = (controller.q_table.copy(), pool.xs.copy(), pool.ys.copy(),
+			controller.change_sum)
+
+	runs = []
+	for fused in (False, True):
+		controller.q_table[...] = start[0]
+		pool.xs[:] = start[1]
+		pool.ys[:] = start[2]
+		controller.change_sum = start[3]
+		np.random.seed(seed)
+
+		rewards = []
+		for _ in range(steps):
+			if fused:
+				rewards.append(fused_step(pool, kernel))
+			else:
+				with config.override({"BACKEND": config.Backend.NUMPY}):
+					rewards.append(pool.step())
+
+		cells = np.concatenate(pool.get_cells())
+		runs.append((cells, np.concatenate(rewards),
+				controller.q_table.copy(), controller.change_sum))
+
+	(reference, fused) = runs
+	return {
+		"cells": int(np.abs(reference[0] - fused[0]).max()),
+		"rewards": float(np.abs(reference[1] - fused[1]).max()),
+		"table": float(np.abs(reference[2] - fused[2]).max()),
+		"change_sum": float(abs(reference[3] - fused[3])),
+	}
+
+'''
+@param diff      largest differences returned by check_equivalence
+@param tolerance largest difference of rewards, table and change sum
+                 allowed for float rounding
+@return          whether the kernel matched the reference path: the same
+                 cells, so the same actions, and values within tolerance
+'''
+def is_equivalent(diff, tolerance = 1e-6):
+	return diff["cells"] == 0 and \
+		   all(diff[k] <= tolerance for k in ("rewards", "table", "change_sum"))
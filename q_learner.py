@@ -1,21 +1,228 @@
+from config import UpdateMode
+
+import heapq
+import os.path
 import pickle
 import random
 import numpy as np
 
+class TraceBuffer:
+
+	'''
+	Bounded history of the most recent (s, a, r) of a batch of agents that
+	step together. Row i holds agent i, oldest entry first.
+
+	@param length number of entries kept per agent
+	'''
+	def __init__(self, length):
+		self.length = length
+		# flat Q table indices of (s, a)
+		self.indices = np.zeros((0, length), dtype = np.intp)
+		self.rewards = np.zeros((0, length))
+		self.sizes = np.zeros(0, dtype = np.intp)
+
+	def reserve(self, count):
+		if count <= len(self.sizes): return
+
+		count = max(count, 2 * len(self.sizes))
+		indices = np.zeros((count, self.length), dtype = np.intp)
+		rewards = np.zeros((count, self.length))
+		sizes = np.zeros(count, dtype = np.intp)
+		indices[:len(self.sizes)] = self.indices
+		rewards[:len(self.sizes)] = self.rewards
+		sizes[:len(self.sizes)] = self.sizes
+		self.indices = indices
+		self.rewards = rewards
+		self.sizes = sizes
+
+	'''
+	Forgets the history of agents from index @start on
+	'''
+	def reset(self, start = 0):
+		self.sizes[start:] = 0
+
+	'''
+	Forgets the history of the agents where @mask is set
+	'''
+	def cut(self, mask):
+		self.reserve(len(mask))
+		self.sizes[:len(mask)][mask] = 0
+
+	def push(self, indices, rewards):
+		count = len(indices)
+		self.reserve(count)
+
+		self.indices[:count, :-1] = self.indices[:count, 1:]
+		self.indices[:count, -1] = indices
+		self.rewards[:count, :-1] = self.rewards[:count, 1:]
+		self.rewards[:count, -1] = rewards
+		self.sizes[:count] = np.minimum(self.sizes[:count] + 1, self.length)
+
+	'''
+	@return mask of shape (count, length) of entries holding history
+	'''
+	def get_valid(self, count):
+		ages = np.arange(self.length - 1, -1, -1)
+		return ages[None, :] < self.sizes[:count, None]
+
+class PrioritizedSweeper:
+
+	'''
+	Schedules one-step backups of a Q table by TD error. Observed
+	transitions are kept in a model and queued by the size of their error,
+	and @sweep spends a fixed budget of backups on the largest errors,
+	queueing the predecessors of every updated state.
+
+	@param q_table     table to update
+	@param action_size shape of the action dimensions of the table
+	@param gamma       discount of the backups
+	@param budget      backups per call to @sweep
+	@param threshold   smallest TD error worth queueing
+	'''
+	def __init__(self, q_table, action_size, gamma, budget, threshold):
+		self.q_table = q_table
+		self.state_shape = q_table.shape[:-len(action_size)]
+		self.gamma = gamma
+		self.budget = budget
+		self.threshold = threshold
+
+		# (state, action) rows of the flat table
+		self.q_flat = q_table.reshape(-1)
+		self.action_count = int(np.prod(action_size))
+		self.q_states = self.q_flat.reshape(-1, self.action_count)
+
+		# last observed reward and next state per (s, a)
+		self.model_r = np.zeros(self.q_flat.size)
+		self.model_next = np.full(self.q_flat.size, -1, dtype = np.intp)
+		# (s, a) observed to lead into each state
+		self.predecessors = {}
+
+		self.heap = []
+		self.queued = {}
+		self.update_count = 0
+		# sum of absolute changes written to the table
+		self.change_sum = 0
+
+	def get_queue_size(self):
+		return len(self.queued)
+
+	def queue(self, sa, priority):
+		if priority > self.queued.get(sa, 0):
+			self.queued[sa] = priority
+			heapq.heappush(self.heap, (-priority, sa))
+
+	def get_errors(self, sa):
+		v_ = self.q_states[self.model_next[sa]].max(axis = 1)
+		return np.abs(self.model_r[sa] + self.gamma * v_ - self.q_flat[sa])
+
+	"""
+	Records a batch of transitions and queues them by TD error
+
+	@param s  state tuple of index arrays
+	@param a  action tuple of index arrays
+	@param r  reward array
+	@param s_ new state tuple of index arrays
+	"""
+	def observe(self, s, a, r, s_):
+		sa = np.ravel_multi_index(s + a, self.q_table.shape)
+		s_ = np.ravel_multi_index(s_, self.state_shape)
+
+		new = self.model_next[sa] != s_
+		self.model_r[sa] = r
+		self.model_next[sa] = s_
+		for sa_i, s_i in zip(sa[new].tolist(), s_[new].tolist()):
+			self.predecessors.setdefault(s_i, set()).add(sa_i)
+
+		errors = self.get_errors(sa)
+		keep = errors > self.threshold
+		for sa_i, e in zip(sa[keep].tolist(), errors[keep].tolist()):
+			self.queue(sa_i, e)
+
+	"""
+	Backs up the queued (s, a) with the largest TD errors
+
+	@return number of backups done
+	"""
+	def sweep(self):
+		updates = 0
+		while updates < self.budget and len(self.heap) > 0:
+			(priority, sa) = heapq.heappop(self.heap)
+			if self.queued.get(sa) != -priority:
+				# stale entry, a larger error was queued since
+				continue
+			del self.queued[sa]
+
+			value = self.model_r[sa] + \
+					self.gamma * self.q_states[self.model_next[sa]].max()
+			self.change_sum += abs(value - self.q_flat[sa])
+			self.q_flat[sa] = value
+			updates += 1
+
+			# queue predecessors whose error changed
+			s = sa // self.action_count
+			preds = self.predecessors.get(s)
+			if preds is None: continue
+
+			preds = np.fromiter(preds, dtype = np.intp, count = len(preds))
+			preds = preds[self.model_next[preds] == s]
+			errors = self.get_errors(preds)
+			keep = errors > self.threshold
+			for sa_i, e in zip(preds[keep].tolist(), errors[keep].tolist()):
+				self.queue(sa_i, e)
+
+		self.update_count += updates
+		return updates
+
 class QController():
 	gamma = 0.1
 	exploration = 0.1
 
 
+	'''
+	@param update_mode  UpdateMode of the backups, linked controllers
+	                    default to the mode of the linked controller
+	@param trace_length steps kept per agent for n-step and lambda backups
+	@param trace_decay  lambda of lambda backups
+	@param sweep_budget backups per step of prioritized sweeping, 0 writes
+	                    observed trajectories directly, linked controllers
+	                    share the sweeper of the linked controller
+	@param sweep_threshold smallest TD error queued for sweeping
+	@param q_table      existing table to use as is, e.g. a read-only one,
+	                    instead of a loaded or new one
+	@param update_weight step size of direct backups towards their targets,
+	                    1 writes the targets. Not inherited from a linked
+	                    controller, so every source of updates to a table
+	                    is weighted on its own.
+	@param anti_follow_weight step size while choosing the worst actions,
+	                    the update weight by default
+	'''
 	def __init__(self, state_size = 0, action_size = 0, linked_controller = None, 
 			load_file = None, gamma = None, exploration = None, 
-			follow_reward = True):
+			follow_reward = True, update_mode = None, trace_length = None,
+			trace_decay = None, sweep_budget = 0, sweep_threshold = 1e-3,
+			q_table = None, update_weight = 1.0, anti_follow_weight = None):
 		self.gamma = gamma
 		self.exploration = exploration
 		self.follow_reward = follow_reward
 		self.state_size = state_size
 		self.action_size = action_size
-		if load_file is not None:
+		self.update_mode = update_mode
+		self.trace_length = trace_length
+		self.trace_decay = trace_decay
+		self.update_weight = update_weight
+		self.anti_follow_weight = update_weight if anti_follow_weight is None \
+				else anti_follow_weight
+		self.sweeper = None
+		# whether this controller owns the sweeper and runs its sweeps
+		self.sweeps = False
+		self.update_count = 0
+		# sum of absolute changes written to the table
+		self.change_sum = 0
+		if q_table is not None:
+			# use the given table
+			self.q_table = q_table
+
+		elif load_file is not None:
 			# load table from file
 			self.load(load_file)
 
@@ -25,7 +232,11 @@ class QController():
 			self.action_size = linked_controller.action_size
 			if gamma is None: self.gamma = linked_controller.gamma
 			if exploration is None: self.exploration = linked_controller.exploration
+			if update_mode is None: self.update_mode = linked_controller.update_mode
+			if trace_length is None: self.trace_length = linked_controller.trace_length
+			if trace_decay is None: self.trace_decay = linked_controller.trace_decay
 			self.q_table = linked_controller.q_table
+			self.sweeper = linked_controller.sweeper
 
 		else:
 			# create Q table
@@ -35,6 +246,19 @@ class QController():
 			self.gamma = 0.1
 		if self.exploration is None:
 			self.exploration = 0.1
+		if self.update_mode is None:
+			self.update_mode = UpdateMode.ONE_STEP
+		if self.trace_length is None:
+			self.trace_length = 4
+		if self.trace_decay is None:
+			self.trace_decay = 0.8
+
+		self.trace = TraceBuffer(self.trace_length)
+
+		if self.sweeper is None and sweep_budget > 0:
+			self.sweeper = PrioritizedSweeper(self.q_table, self.action_size,
+					self.gamma, sweep_budget, sweep_threshold)
+			self.sweeps = True
 
 
 
@@ -61,6 +285,50 @@ class QController():
 			a = [random.randint(0, b - 1) for b in self.action_size]
 			return tuple(a)
 
+	"""
+	Computes actions for a batch of states with the e-greedy algorithm
+
+	@param s     state tuple whose entries are index arrays of equal length
+	@param count number of states in the batch
+	@return      action tuple whose entries are index arrays
+	"""
+	def get_actions(self, s, count):
+		qs = self.q_table[s].reshape(count, -1)
+
+		if self.follow_reward:
+			# choose best action
+			target = qs.max(axis = 1, keepdims = True)
+		else:
+			# choose worst action
+			target = qs.min(axis = 1, keepdims = True)
+
+		# break ties randomly by ranking candidates with noise
+		noise = np.random.random(qs.shape)
+		a = np.argmax(np.where(qs == target, noise, -1), axis = 1)
+
+		# choose random actions where exploring
+		explore = np.random.random(count) <= self.exploration
+		a[explore] = np.random.randint(0, qs.shape[1], np.count_nonzero(explore))
+
+		return np.unravel_index(a, self.action_size)
+
+	'''
+	@return step size of backups for the current action choice, sweeps are
+	        not weighted
+	'''
+	def get_update_weight(self):
+		return self.update_weight if self.follow_reward else self.anti_follow_weight
+
+	'''
+	@return @old moved towards @targets by the update weight
+	'''
+	def weigh(self, targets, old):
+		weight = self.get_update_weight()
+		if weight == 1:
+			return targets
+
+		return old + weight * (targets - old)
+
 	"""
 	Updates Q table with trajectory
 
@@ -70,7 +338,158 @@ class QController():
 	@param s_ new state after doing action "a" in state "s"
 	"""
 	def update_trajectory(self, s, a, r, s_):
-		self.q_table[s + a] = r + self.gamma * np.max(self.q_table[s_])
+		if self.sweeper is not None:
+			self.sweeper.observe(*to_batch(s, a, r, s_))
+			if self.sweeps:
+				self.sweeper.sweep()
+			return
+
+		if self.update_mode != UpdateMode.ONE_STEP:
+			self.update_trajectories(*to_batch(s, a, r, s_))
+			return
+
+		self.update_count += 1
+		value = self.weigh(r + self.gamma * np.max(self.q_table[s_]),
+				self.q_table[s + a])
+		self.change_sum += abs(value - self.q_table[s + a])
+		self.q_table[s + a] = value
+
+	"""
+	Updates Q table with a batch of trajectories, all backups are computed
+	before any are written
+
+	@param s  state tuple of index arrays
+	@param a  action tuple of index arrays
+	@param r  reward array
+	@param s_ new state tuple of index arrays
+	"""
+	def update_trajectories(self, s, a, r, s_):
+		count = len(r)
+		if self.sweeper is not None:
+			self.sweeper.observe(s, a, r, s_)
+			if self.sweeps:
+				self.sweeper.sweep()
+			return
+
+		self.update_count += count
+		qs_ = self.q_table[s_].reshape(count, -1)
+		v_ = qs_.max(axis = 1)
+
+		if self.update_mode == UpdateMode.N_STEP:
+			self.backup_n_step(s + a, r, v_)
+		elif self.update_mode == UpdateMode.LAMBDA:
+			self.backup_lambda(s + a, r, v_)
+		else:
+			values = self.weigh(r + self.gamma * v_, self.q_table[s + a])
+			self.change_sum += np.abs(values - self.q_table[s + a]).sum()
+			self.q_table[s + a] = values
+
+	"""
+	Pushes the trajectories onto the trace and writes the discounted
+	return of the oldest step of every full trace
+
+	@param sa state-action tuple of index arrays
+	@param r  reward array
+	@param v_ value of the new states, or None if they are terminal
+	"""
+	def backup_n_step(self, sa, r, v_):
+		count = len(r)
+		q_flat = self.q_table.reshape(-1)
+		self.trace.push(np.ravel_multi_index(sa, self.q_table.shape), r)
+
+		n = self.trace.length
+		indices = self.trace.indices[:count]
+		rewards = self.trace.rewards[:count]
+		valid = self.trace.get_valid(count)
+
+		if v_ is None:
+			# flush every step of the trace without bootstrapping
+			discounts = np.triu(self.gamma ** (
+					np.arange(n)[None, :] - np.arange(n)[:, None]))
+			returns = (rewards * valid) @ discounts.T
+			values = self.weigh(returns[valid], q_flat[indices[valid]])
+			self.change_sum += np.abs(values - q_flat[indices[valid]]).sum()
+			q_flat[indices[valid]] = values
+			self.trace.reset()
+			return
+
+		full = self.trace.sizes[:count] == n
+		returns = self.weigh(rewards[full] @ (self.gamma ** np.arange(n)) + \
+				self.gamma ** n * v_[full], q_flat[indices[full, 0]])
+		self.change_sum += np.abs(returns - q_flat[indices[full, 0]]).sum()
+		q_flat[indices[full, 0]] = returns
+
+	"""
+	Watkins's Q(lambda): moves every (s, a) of the trace towards the TD
+	error of the newest step, weighted by (gamma * lambda) ^ age. Backups
+	follow the greedy policy, so a trace is cut before any action that is
+	not greedy, such as exploration or the worst actions of anti-follow
+	ghosts.
+
+	@param sa state-action tuple of index arrays
+	@param r  reward array
+	@param v_ value of the new states, or None if they are terminal
+	"""
+	def backup_lambda(self, sa, r, v_):
+		count = len(r)
+		q_flat = self.q_table.reshape(-1)
+		sa = np.ravel_multi_index(sa, self.q_table.shape)
+
+		target = r if v_ is None else r + self.gamma * v_
+		delta = target - q_flat[sa]
+
+		action_count = int(np.prod(self.action_size))
+		qs = q_flat.reshape(-1, action_count)[sa // action_count]
+		self.trace.cut(q_flat[sa] < qs.max(axis = 1))
+		self.trace.push(sa, r)
+
+		ages = np.arange(self.trace.length - 1, -1, -1)
+		weights = np.where(self.trace.get_valid(count),
+				(self.gamma * self.trace_decay) ** ages, 0) * \
+				self.get_update_weight()
+		changes = weights * delta[:, None]
+		self.change_sum += np.abs(changes).sum()
+		np.add.at(q_flat, self.trace.indices[:count].ravel(), changes.ravel())
+
+		if v_ is None:
+			self.trace.reset()
+
+	'''
+	Forgets the traces of batch agents from index @start on
+	'''
+	def reset_traces(self, start = 0):
+		self.trace.reset(start)
+
+	"""
+	Backs up the steps of the traces still waiting for n-step returns,
+	with the returns cut short at the agents' current states, and forgets
+	the traces. Called when runs end, as the task never terminates.
+	Lambda backups are never pending.
+
+	@param s_ current state tuple of index arrays of the batch agents
+	"""
+	def flush_traces(self, s_):
+		count = len(s_[0])
+		if self.update_mode == UpdateMode.N_STEP and count > 0 and \
+				len(self.trace.sizes) >= count:
+			n = self.trace.length
+			q_flat = self.q_table.reshape(-1)
+			indices = self.trace.indices[:count]
+			valid = self.trace.get_valid(count)
+			# the oldest step of a full trace was backed up already
+			pending = valid.copy()
+			pending[self.trace.sizes[:count] == n, 0] = False
+
+			v_ = self.q_table[s_].reshape(count, -1).max(axis = 1)
+			discounts = np.triu(self.gamma ** (
+					np.arange(n)[None, :] - np.arange(n)[:, None]))
+			returns = (self.trace.rewards[:count] * valid) @ discounts.T + \
+					self.gamma ** (n - np.arange(n))[None, :] * v_[:, None]
+			values = self.weigh(returns[pending], q_flat[indices[pending]])
+			self.change_sum += np.abs(values - q_flat[indices[pending]]).sum()
+			q_flat[indices[pending]] = values
+
+		self.trace.reset()
 
 	"""
 	Updates Q table with a terminal value
@@ -80,7 +499,17 @@ class QController():
 	@param r reward for doing action "a" in state "s"
 	"""
 	def terminate_trajectory(self, s, a, r):
-		self.q_table[s + a] = r
+		self.update_count += 1
+		if self.update_mode == UpdateMode.N_STEP:
+			(s, a, r, _) = to_batch(s, a, r, s)
+			self.backup_n_step(s + a, r, None)
+		elif self.update_mode == UpdateMode.LAMBDA:
+			(s, a, r, _) = to_batch(s, a, r, s)
+			self.backup_lambda(s + a, r, None)
+		else:
+			value = self.weigh(r, self.q_table[s + a])
+			self.change_sum += abs(value - self.q_table[s + a])
+			self.q_table[s + a] = value
 
 	def get_action_qs(self, s):
 		return self.q_table[s]
@@ -88,10 +517,47 @@ class QController():
 	def dump(self, filename):
 		print(f"Dumping Q table to \"{filename}\"...")
 		with open(filename, "wb") as fp:
-			pickle.dump(self.q_table, fp)
+			np.save(fp, self.q_table)
 
 	def load(self, filename):
 		print(f"Loading Q table from \"{filename}\"...")
+		if is_npy_table(filename):
+			self.q_table = np.load(filename)
+		else:
+			with open(filename, "rb") as fp:
+				self.q_table = pickle.load(fp)
+
+'''
+@return whether @filename holds a table in .npy format rather than a
+        pickle, as tables were saved before
+'''
+def is_npy_table(filename):
+	with open(filename, "rb") as fp:
+		return fp.read(6) == b"\x93NUMPY"
+
+'''
+Opens a saved Q table read-only and memory mapped, so it is paged in as
+it is read and shared between processes. Tables pickled by older
+versions are converted once to a .npy file next to them.
+'''
+def open_table(filename):
+	if is_npy_table(filename):
+		return np.load(filename, mmap_mode = "r")
+
+	cache = filename + ".npy"
+	if not os.path.isfile(cache) or \
+			os.path.getmtime(cache) < os.path.getmtime(filename):
+		print(f"Converting Q table \"{filename}\" to \"{cache}\"...")
 		with open(filename, "rb") as fp:
-			self.q_table = pickle.load(fp)
+			np.save(cache, pickle.load(fp))
+
+	return np.load(cache, mmap_mode = "r")
 
+'''
+Converts a single trajectory to a batch of one
+'''
+def to_batch(s, a, r, s_):
+	return (tuple(np.array([v]) for v in s),
+			tuple(np.array([v]) for v in a),
+			np.array([r], dtype = float),
+			tuple(np.array([v]) for v in s_))
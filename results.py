@@ -0,0 +1,335 @@
+import config
+
+import sys
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+	id INTEGER PRIMARY KEY,
+	kind TEXT NOT NULL,
+	started REAL NOT NULL,
+	finished REAL,
+	fitness REAL,
+	iterations INTEGER,
+	stop_reason TEXT,
+	stats TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_fitness ON runs (fitness);
+
+CREATE TABLE IF NOT EXISTS run_config (
+	run_id INTEGER NOT NULL REFERENCES runs (id),
+	name TEXT NOT NULL,
+	value,
+	PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS run_config_value ON run_config (name, value, run_id);
+
+CREATE TABLE IF NOT EXISTS metrics (
+	run_id INTEGER NOT NULL REFERENCES runs (id),
+	name TEXT NOT NULL,
+	step INTEGER NOT NULL,
+	value REAL,
+	PRIMARY KEY (run_id, name, step)
+) WITHOUT ROWID;
+"""
+
+'''
+@return every scalar config variable, enums and bools as ints
+'''
+def get_config_snapshot():
+	snapshot = {}
+	for (name, value) in vars(config).items():
+		if not name.isupper(): continue
+
+		if isinstance(value, (bool, int)):
+			snapshot[name] = int(value)
+		elif isinstance(value, (float, str)) or value is None:
+			snapshot[name] = value
+
+	return snapshot
+
+class ResultStore:
+
+	'''
+	Runs, their config snapshots, downsampled metrics and final fitness
+	in an SQLite file. Config values are indexed by name and value, so
+	runs are found by parameter without reading any other run.
+
+	The connection may be shared by the threads of a process, which take
+	turns writing. Processes each open their own store and wait on each
+	other's transactions.
+
+	@param filename SQLite file, created if missing
+	'''
+	def __init__(self, filename):
+		self.filename = filename
+		self.connection = sqlite3.connect(filename, timeout = 30,
+				check_same_thread = False)
+		self.lock = threading.Lock()
+
+		with self.lock, self.connection:
+			# readers do not block the writer of another process
+			self.connection.execute("PRAGMA journal_mode = WAL")
+			self.connection.execute("PRAGMA synchronous = NORMAL")
+			self.connection.executescript(SCHEMA)
+
+	'''
+	@param kind     type of world of the run
+	@param snapshot dict of config names to values
+	@return         id of the new run
+	'''
+	def start_run(self, kind, snapshot):
+		with self.lock, self.connection:
+			cursor = self.connection.execute(
+					"INSERT INTO runs (kind, started) VALUES (?, ?)",
+					(kind, time.time()))
+			run_id = cursor.lastrowid
+			self.connection.executemany(
+					"INSERT INTO run_config VALUES (?, ?, ?)",
+					[(run_id, name, value) for (name, value) in snapshot.items()])
+
+		return run_id
+
+	'''
+	Writes metric rows in a single transaction
+
+	@param rows (run id, name, step, value) tuples
+	'''
+	def add_metrics(self, rows):
+		with self.lock, self.connection:
+			self.connection.executemany(
+					"INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?)", rows)
+
+	'''
+	@param stats dict of final statistics, see World.get_stats
+	'''
+	def finish_run(self, run_id, fitness, stats):
+		with self.lock, self.connection:
+			self.connection.execute(
+					"UPDATE runs SET finished = ?, fitness = ?, iterations = ?, "
+					"stop_reason = ?, stats = ? WHERE id = ?",
+					(time.time(), fitness, stats.get("iterations"),
+					 stats.get("stop_reason"), json.dumps(stats), run_id))
+
+	'''
+	@param filters dict of config names to values the runs were started with
+	@return        SQL selecting the ids of matching runs, and its parameters
+	'''
+	def get_filter_query(self, filters):
+		if not filters:
+			return "SELECT id FROM runs", []
+
+		query = " INTERSECT ".join(
+				["SELECT run_id FROM run_config WHERE name = ? AND value IS ?"] *
+				len(filters))
+		params = [p for item in filters.items() for p in item]
+		return query, params
+
+	'''
+	@param filters dict of config names to values the runs were started with
+	@param limit   largest number of runs returned
+	@return        (id, kind, fitness, iterations, stop reason) of finished
+	               matching runs, fittest first
+	'''
+	def find_runs(self, filters = None, limit = None):
+		(query, params) = self.get_filter_query(filters)
+		sql = "SELECT id, kind, fitness, iterations, stop_reason FROM runs " \
+			  f"WHERE finished IS NOT NULL AND id IN ({query}) " \
+			  "ORDER BY fitness DESC"
+		if limit is not None:
+			sql += " LIMIT ?"
+			params.append(limit)
+
+		with self.lock:
+			return self.connection.execute(sql, params).fetchall()
+
+	'''
+	@param name    config variable to group by
+	@param filters dict of config names to values the runs were started with
+	@return        (value, runs, mean fitness, best fitness) per value of
+	               @name among finished matching runs
+	'''
+	def fitness_by(self, name, filters = None):
+		(query, params) = self.get_filter_query(filters)
+		sql = "SELECT c.value, COUNT(*), AVG(r.fitness), MAX(r.fitness) " \
+			  "FROM run_config c JOIN runs r ON r.id = c.run_id " \
+			  f"WHERE c.name = ? AND r.finished IS NOT NULL AND r.id IN ({query}) " \
+			  "GROUP BY c.value ORDER BY c.value"
+
+		with self.lock:
+			return self.connection.execute(sql, [name] + params).fetchall()
+
+	def get_config(self, run_id):
+		with self.lock:
+			return dict(self.connection.execute(
+					"SELECT name, value FROM run_config WHERE run_id = ?",
+					(run_id,)).fetchall())
+
+	'''
+	@return (steps, values) arrays of metric @name of a run
+	'''
+	def get_metric(self, run_id, name):
+		with self.lock:
+			rows = self.connection.execute(
+					"SELECT step, value FROM metrics WHERE run_id = ? AND name = ? "
+					"ORDER BY step", (run_id, name)).fetchall()
+
+		rows = np.array(rows, dtype = float).reshape(-1, 2)
+		return rows[:, 0].astype(int), rows[:, 1]
+
+	def get_metric_names(self, run_id):
+		with self.lock:
+			return [name for (name,) in self.connection.execute(
+					"SELECT DISTINCT name FROM metrics WHERE run_id = ?",
+					(run_id,))]
+
+	def close(self):
+		with self.lock:
+			self.connection.close()
+
+stores = {}
+
+'''
+@return the store of @filename, opened once per process
+'''
+def get_store(filename = None):
+	filename = config.RESULTS_FILE if filename is None else filename
+	if filename not in stores:
+		stores[filename] = ResultStore(filename)
+
+	return stores[filename]
+
+class RunRecorder:
+
+	'''
+	Records a world's run to a result store: its config on creation,
+	metrics every @interval guard steps, and fitness and statistics once
+	finished. Metric rows are buffered and written @batch_size at a time.
+
+	@param store      the ResultStore to write to
+	@param kind       type of world of the run
+	@param interval   guard steps between recorded metrics
+	@param batch_size metric rows buffered between transactions
+	'''
+	def __init__(self, store, kind, interval = None, batch_size = None):
+		self.store = store
+		self.interval = config.RESULTS_INTERVAL if interval is None else interval
+		self.batch_size = config.RESULTS_BATCH if batch_size is None else batch_size
+		self.run_id = store.start_run(kind, get_config_snapshot())
+
+		self.rows = []
+		self.last_step = 0
+		# guard Q change and updates at the last recorded step
+		self.last_change = (0, 0)
+		self.finished = False
+
+	'''
+	Records the metrics of @world if its guard reached a multiple of the
+	interval, and finishes the run once the world has finished
+
+	@param step     guard steps so far
+	@param finished whether the world has finished
+	'''
+	def record(self, world, step, finished = False):
+		if finished:
+			self.finish(world)
+			return
+
+		if step == self.last_step or step % self.interval != 0: return
+		self.last_step = step
+
+		# mean absolute guard Q change per update since the last record
+		(change, count) = world.get_guard_q_change()
+		(last_change, last_count) = self.last_change
+		self.last_change = (change, count)
+
+		metrics = world.get_metrics()
+		metrics["q_change"] = (change - last_change) / max(1, count - last_count)
+		self.rows += [(self.run_id, name, step, float(value))
+				for (name, value) in metrics.items()]
+
+		if len(self.rows) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		if len(self.rows) > 0:
+			self.store.add_metrics(self.rows)
+			self.rows = []
+
+	'''
+	Writes the remaining metrics and the fitness and statistics of
+	@world, once per run
+	'''
+	def finish(self, world):
+		if self.finished: return
+		self.finished = True
+
+		self.flush()
+		self.store.finish_run(self.run_id, world.get_fitness(),
+				world.get_stats())
+
+'''
+@return config filters parsed from NAME=VALUE arguments, values as JSON
+        where they parse and strings otherwise
+'''
+def parse_filters(args):
+	filters = {}
+	for arg in args:
+		(name, value) = arg.split("=", 1)
+		try:
+			value = json.loads(value)
+		except ValueError:
+			pass
+		filters[name] = int(value) if isinstance(value, bool) else value
+
+	return filters
+
+def main():
+	usage = "usage: results.py runs [NAME=VALUE...] | " \
+			"by <NAME> [NAME=VALUE...] | show <run id>"
+	if len(sys.argv) < 2:
+		print(usage)
+		return
+	if config.RESULTS_FILE is None:
+		print("No results store, set RESULTS_FILE in config.py.")
+		return
+
+	store = get_store()
+	(command, args) = (sys.argv[1], sys.argv[2:])
+	if command == "runs":
+		runs = store.find_runs(parse_filters(args), limit = 50)
+		print("\n      run  kind            fitness  iterations  stop reason")
+		for (run_id, kind, fitness, iterations, stop_reason) in runs:
+			print(f"  {run_id:7}  {kind:12} {fitness:10.3f} {iterations:11}"
+				  f"  {stop_reason}")
+		print()
+
+	elif command == "by" and len(args) > 0:
+		groups = store.fitness_by(args[0], parse_filters(args[1:]))
+		print(f"\nFitness by {args[0]} \n")
+		print("      value      runs        mean        best")
+		for (value, count, mean, best) in groups:
+			print(f"  {str(value):>9} {count:9} {mean:11.3f} {best:11.3f}")
+		print()
+
+	elif command == "show" and len(args) > 0:
+		run_id = int(args[0])
+		print(f"\nRun {run_id} \n")
+		for (name, value) in sorted(store.get_config(run_id).items()):
+			print(f"  {name:28} {value}")
+		for name in store.get_metric_names(run_id):
+			(steps, values) = store.get_metric(run_id, name)
+			print(f"\n  {name} over {len(steps)} points: "
+				  f"first {values[0]:.3f}, last {values[-1]:.3f}, "
+				  f"mean {values.mean():.3f}")
+		print()
+
+	else:
+		print(usage)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,270 @@
+import config
+import gridmap
+
+import sys
+import itertools
+import numpy as np
+
+# kinds of scenarios, see Scenario.get_path
+KINDS = ("path", "patrol", "random", "chase", "evade")
+
+# VIP moves, diagonals first
+MOVES = ((1, 1), (1, -1), (-1, 1), (-1, -1), (1, 0), (-1, 0), (0, 1), (0, -1))
+
+'''
+@return the open cells one VIP move from @pos
+'''
+def get_moves(pos):
+	grid_map = gridmap.get_map()
+	cells = [(pos[0] + dx, pos[1] + dy) for (dx, dy) in MOVES]
+	return [cell for cell in cells if grid_map.is_open(cell)]
+
+'''
+@return the open cell one VIP move from @pos along a shortest route to
+        @target, or @pos if there or @target cannot be reached
+'''
+def step_toward(pos, target):
+	grid_map = gridmap.get_map()
+	distances = grid_map.get_distances(target)
+	best = pos
+	best_distance = distances[grid_map.get_cells(*pos)]
+	if best_distance < 0: return pos
+
+	for cell in get_moves(pos):
+		distance = distances[grid_map.get_cells(*cell)]
+		if distance < best_distance:
+			(best, best_distance) = (cell, distance)
+
+	return best
+
+'''
+@return the open cell one VIP move from @pos towards the cell furthest
+        from @threat by route, the nearest of those to @pos, so pockets
+        are left when better hideouts exist
+'''
+def step_away(pos, threat):
+	grid_map = gridmap.get_map()
+	distances = grid_map.get_distances(threat)
+	hideouts = np.flatnonzero(distances == distances.max())
+	(xs, ys) = grid_map.get_cell_coords(hideouts)
+	i = np.argmin((xs - pos[0]) ** 2 + (ys - pos[1]) ** 2)
+	return step_toward(pos, (int(xs[i]), int(ys[i])))
+
+'''
+Walks one cell per move through @waypoints in turn
+
+@param waypoints iterable of cells, may be endless
+'''
+def walk(start, waypoints):
+	pos = start
+	for target in waypoints:
+		moved = False
+		while pos != target:
+			cell = step_toward(pos, target)
+			# the waypoint cannot be reached, give up on it
+			if cell == pos: break
+			pos = cell
+			moved = True
+			yield pos
+
+		# wait a move at waypoints reached already or unreachable, so
+		# loops always yield
+		if not moved:
+			yield pos
+
+'''
+Walks randomly like the AUTO VIP, endlessly
+'''
+def random_walk(start, seed):
+	rng = np.random.default_rng(seed)
+	grid_map = gridmap.get_map()
+	pos = start
+	while True:
+		(dx, dy) = rng.integers(-1, 2, 2)
+		cell = (int(np.clip(pos[0] + dx, 0, grid_map.w - 1)),
+				int(np.clip(pos[1] + dy, 0, grid_map.h - 1)))
+		if grid_map.is_open(cell):
+			pos = cell
+		yield pos
+
+'''
+Adversarial walks reading the agents with @observe on every move, either
+towards the hostile or away from the guard, routing around walls
+
+@param observe function returning the (guard, hostile) cells
+@param toward  whether to walk towards the hostile rather than away from
+               the guard
+'''
+def adversarial_walk(start, observe, toward):
+	pos = start
+	while True:
+		(guard, hostile) = observe()
+		pos = step_toward(pos, hostile) if toward else step_away(pos, guard)
+		yield pos
+
+class Scenario:
+
+	'''
+	A scripted VIP path. Only its description is stored, so scenarios are
+	cheap to stream and can be sent to worker processes; the path itself
+	is generated lazily one move at a time.
+
+	  path      walks through the waypoints once and stays at the last
+	  patrol    loops through the waypoints
+	  random    walks randomly, seeded by @seed
+	  chase     walks towards the hostile
+	  evade     walks away from the guard
+
+	@param name      name of the scenario
+	@param kind      one of KINDS
+	@param start     starting cell of the VIP
+	@param waypoints cells visited by paths and patrols
+	@param seed      seed of random walks
+	'''
+	def __init__(self, name, kind, start, waypoints = (), seed = 0):
+		if kind not in KINDS:
+			raise ValueError(f"Unknown scenario kind \"{kind}\", "
+					f"expected one of {', '.join(KINDS)}.")
+
+		self.name = name
+		self.kind = kind
+		self.start = tuple(start)
+		self.waypoints = [tuple(w) for w in waypoints]
+		self.seed = seed
+
+	'''
+	@param observe function returning the current (guard, hostile) cells,
+	               read by adversarial paths
+	@return        iterator of the VIP's following cells
+	'''
+	def get_path(self, observe = None):
+		if self.kind == "path":
+			return walk(self.start, self.waypoints)
+		elif self.kind == "patrol":
+			return walk(self.start, itertools.cycle(self.waypoints or [self.start]))
+		elif self.kind == "random":
+			return random_walk(self.start, self.seed)
+
+		return adversarial_walk(self.start, observe, self.kind == "chase")
+
+'''
+Reads scenarios from a file one line at a time, as they are needed. Each
+line holds a name, a kind and cells as x,y: the start followed by any
+waypoints. Lines starting with ';' are comments.
+
+	lap    patrol  1,1  8,1  8,8  1,8
+	bait   chase   5,5
+'''
+def load_scenarios(filename):
+	grid_map = gridmap.get_map()
+	with open(filename) as fp:
+		for (number, line) in enumerate(fp, 1):
+			words = line.split()
+			if len(words) == 0 or line.startswith(";"): continue
+
+			where = f"\"{filename}\" line {number}"
+			if len(words) < 3:
+				raise ValueError(f"{where}: expected a name, a kind and a "
+						"start cell.")
+
+			cells = []
+			for word in words[2:]:
+				try:
+					(x, y) = (int(v) for v in word.split(","))
+				except ValueError:
+					raise ValueError(f"{where}: expected a cell as x,y, "
+							f"got \"{word}\".")
+				if not grid_map.is_open((x, y)):
+					raise ValueError(f"{where}: cell {x},{y} is a wall or "
+							f"outside the {grid_map.w} x {grid_map.h} map.")
+				cells.append((x, y))
+
+			try:
+				scenario = Scenario(words[0], words[1], cells[0], cells[1:],
+						seed = number)
+			except ValueError as e:
+				raise ValueError(f"{where}: {e}")
+			yield scenario
+
+'''
+Generates random scenarios lazily, of every kind in @kinds in turn
+
+@param count number of scenarios, endless if None
+@return      iterator of Scenario
+'''
+def generate_scenarios(count = None, seed = 0, kinds = KINDS):
+	rng = np.random.default_rng(seed)
+	grid_map = gridmap.get_map()
+
+	def random_cell():
+		cell = grid_map.open_cells[rng.integers(len(grid_map.open_cells))]
+		return tuple(int(v) for v in grid_map.get_cell_coords(cell))
+
+	indices = itertools.count() if count is None else range(count)
+	for i in indices:
+		kind = kinds[i % len(kinds)]
+		waypoints = [random_cell() for _ in range(rng.integers(2, 5))] \
+				if kind in ("path", "patrol") else []
+		yield Scenario(f"{kind}_{i}", kind, random_cell(), waypoints,
+				seed = int(rng.integers(1 << 31)))
+
+'''
+Trains a headless world per scenario, with the VIP scripted by it, one
+world after another as scenarios are read
+
+@param steps       steps per world
+@param world_class World or a subclass such as MultiWorld
+@param tables      (guard, hostile) Q tables every world starts from, or
+                   None for new ones. Each world trains its own copy, so
+                   the tables are left as they are.
+@return            iterator of (scenario, fitness)
+'''
+def run_worlds(scenarios, steps, world_class = None, tables = None):
+	import world
+
+	world_class = world.World if world_class is None else world_class
+	for scenario in scenarios:
+		with config.override({"RENDER_ENABLED": False, "ITERATION_MAX": steps,
+				"VIP_STATE": config.VIPState.SCRIPTED}):
+			w = world_class(tables = None if tables is None else
+					tuple(np.copy(table) for table in tables))
+			w.set_scenario(scenario)
+			while not w.update(config.STEP_TIME): pass
+
+			yield scenario, w.get_fitness()
+
+'''
+@param source scenario file, or generate:<count> for random scenarios
+'''
+def open_scenarios(source):
+	if source.startswith("generate:"):
+		return generate_scenarios(int(source.split(":", 1)[1]))
+
+	return load_scenarios(source)
+
+def main():
+	import evaluation
+
+	if len(sys.argv) < 2:
+		print("usage: scenarios.py <scenario file | generate:<count>> "
+			  "[steps] [workers]")
+		return
+
+	steps = int(sys.argv[2]) if len(sys.argv) > 2 else None
+	workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+	(kinds, rewards, breached) = evaluation.evaluate_scenarios(
+			open_scenarios(sys.argv[1]), steps = steps, workers = workers)
+	evaluation.print_report(rewards, breached)
+
+	print("  By kind: \n")
+	for kind in KINDS:
+		mask = kinds == kind
+		if not mask.any(): continue
+		print(f"      {kind:8} {np.count_nonzero(mask):8} scenarios, "
+			  f"reward {rewards[mask].mean():8.4f}, "
+			  f"breach rate {breached[mask].mean():.4f}")
+	print()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,165 @@
+import config
+import world
+
+import sys
+import math
+import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# values tried for each config variable
+SEARCH_SPACE = {
+	"GHOST_COUNT": [0, 20, 50, 100, 200],
+	"GHOST_EXPLORATION": [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+	"SUFFERING": [0, 5, 10, 15, 20],
+	"GHOST_FOLLOW_REWARD": [True, False],
+	"GUARD_GAMMA": [0.1, 0.2, 0.4, 0.6, 0.8],
+	"HOSTILE_GAMMA": [0.2, 0.4, 0.6, 0.8],
+}
+
+'''
+Trains a headless world with the given config for a number of steps
+
+@param job (settings, steps, seed)
+@return    the world's fitness
+'''
+def run_candidate(job):
+	(settings, steps, seed) = job
+	random.seed(seed)
+	np.random.seed(seed)
+
+	# every candidate of a rung trains for all of its steps
+	with config.override({**settings,
+			"RENDER_ENABLED": False, "ITERATION_MAX": steps,
+			"CONVERGE_REWARD_TOLERANCE": 0, "CONVERGE_Q_CHANGE": 0}):
+		w = world.World()
+		while not w.update(config.STEP_TIME): pass
+
+		return w.get_fitness()
+
+def sample_candidates(count, space = SEARCH_SPACE, rng = random):
+	return [{name: rng.choice(values) for (name, values) in space.items()}
+			for _ in range(count)]
+
+class HalvingSearch:
+
+	'''
+	Successive halving and Hyperband over config settings. Every rung
+	trains each surviving candidate from scratch for the rung's steps,
+	then keeps the best 1 / @eta of them by fitness. Worker processes are
+	started once and kept until the search is closed.
+
+	@param workers processes training candidates, 1 trains in process
+	@param eta     fraction of candidates dropped per rung is 1 - 1 / eta
+	'''
+	def __init__(self, workers = 1, eta = 3, seed = 0):
+		self.workers = workers
+		self.eta = eta
+		self.seed = seed
+		# rows of (bracket, rung, steps, candidate index, settings, fitness)
+		self.results = []
+		self.pool = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def close(self):
+		if self.pool is not None:
+			self.pool.shutdown()
+			self.pool = None
+
+	def evaluate(self, candidates, steps):
+		jobs = [(settings, steps, self.seed + i)
+				for (i, settings) in candidates]
+
+		if self.workers <= 1:
+			return [run_candidate(job) for job in jobs]
+
+		if self.pool is None:
+			self.pool = ProcessPoolExecutor(self.workers)
+		return list(self.pool.map(run_candidate, jobs))
+
+	'''
+	@param candidates list of settings dicts
+	@param min_steps  steps of the first rung
+	@param max_steps  steps of the last rung
+	@return           (settings, fitness) of the best candidate
+	'''
+	def successive_halving(self, candidates, min_steps, max_steps, bracket = 0):
+		survivors = list(enumerate(candidates))
+		steps = min_steps
+		rung = 0
+
+		while True:
+			fitnesses = self.evaluate(survivors, steps)
+			for ((i, settings), fitness) in zip(survivors, fitnesses):
+				self.results.append((bracket, rung, steps, i, settings, fitness))
+
+			ranked = sorted(zip(fitnesses, range(len(survivors))), reverse = True)
+			if steps >= max_steps or len(survivors) <= 1:
+				(fitness, best) = ranked[0]
+				return survivors[best][1], fitness
+
+			keep = max(1, len(survivors) // self.eta)
+			survivors = [survivors[j] for (_, j) in ranked[:keep]]
+			steps = min(max_steps, steps * self.eta)
+			rung += 1
+
+	'''
+	Runs successive halving brackets trading candidate count for steps,
+	from many short runs to a few full length ones
+
+	@param max_steps steps of the longest runs
+	@param min_steps steps of the shortest runs
+	@return          (settings, fitness) of the best candidate
+	'''
+	def hyperband(self, max_steps, min_steps = 50, space = SEARCH_SPACE):
+		rng = random.Random(self.seed)
+		s_max = int(math.log(max_steps / min_steps, self.eta))
+
+		best = (None, -math.inf)
+		for s in range(s_max, -1, -1):
+			count = int(math.ceil((s_max + 1) / (s + 1) * self.eta ** s))
+			steps = max(min_steps, int(max_steps * self.eta ** -s))
+
+			candidates = sample_candidates(count, space, rng)
+			result = self.successive_halving(candidates, steps, max_steps,
+					bracket = s)
+			if result[1] > best[1]:
+				best = result
+
+		return best
+
+	def get_total_steps(self):
+		return sum(row[2] for row in self.results)
+
+	def print_results(self, top = 20):
+		names = list(SEARCH_SPACE.keys())
+		rows = sorted(self.results, key = lambda row: (row[2], row[5]),
+				reverse = True)[:top]
+
+		print(f"\n\nSearch results ({len(self.results)} runs, "
+			  f"{self.get_total_steps()} steps) \n")
+		print("  bracket rung  steps  " +
+			  "  ".join(f"{name:>19}" for name in names) + "     fitness")
+		for (bracket, rung, steps, _, settings, fitness) in rows:
+			print(f"  {bracket:7} {rung:4} {steps:6}  " +
+				  "  ".join(f"{str(settings[name]):>19}" for name in names) +
+				  f"  {fitness:10.4f}")
+		print("\n")
+
+def main():
+	max_steps = int(sys.argv[1]) if len(sys.argv) > 1 else config.ITERATION_MAX
+	workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+	with HalvingSearch(workers = workers) as search:
+		(settings, fitness) = search.hyperband(max_steps)
+	search.print_results()
+
+	print(f"Best settings: {settings} with fitness {fitness}")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,310 @@
+import config
+import world
+
+import sys
+import math
+import json
+import asyncio
+import itertools
+
+# settings a run may override, by API name
+RUN_SETTINGS = {
+	"ghost_count": "GHOST_COUNT",
+	"ghost_exploration": "GHOST_EXPLORATION",
+	"ghost_follow_reward": "GHOST_FOLLOW_REWARD",
+	"suffering": "SUFFERING",
+	"vip_state": "VIP_STATE",
+	"iteration_max": "ITERATION_MAX",
+}
+
+'''
+@return @value of setting @key checked and converted to its config type
+@raise  ValueError if it has the wrong type or is out of range
+'''
+def parse_setting(key, value):
+	# bools are ints to Python but not settings
+	is_int = isinstance(value, int) and not isinstance(value, bool)
+	is_number = is_int or isinstance(value, float)
+
+	if key in ("ghost_count", "iteration_max"):
+		if not is_int or value < 0:
+			raise ValueError(f"{key} must be an integer of at least 0")
+	elif key == "ghost_exploration":
+		if not is_number or not 0 <= value <= 1:
+			raise ValueError(f"{key} must be a number from 0 to 1")
+		value = float(value)
+	elif key == "suffering":
+		if not is_number or not math.isfinite(value):
+			raise ValueError(f"{key} must be a number")
+	elif key == "ghost_follow_reward":
+		if not isinstance(value, bool):
+			raise ValueError(f"{key} must be true or false")
+	elif key == "vip_state":
+		names = ", ".join(s.name.lower() for s in config.VIPState)
+		try:
+			if isinstance(value, str):
+				value = config.VIPState[value.upper()]
+			elif is_int:
+				value = config.VIPState(value)
+			else:
+				raise ValueError()
+		except (KeyError, ValueError):
+			raise ValueError(f"unknown VIP state \"{value}\", expected one "
+					f"of {names}")
+
+	return value
+
+class Run:
+
+	'''
+	A headless world stepped in batches by the simulation host. Config is
+	global, so the run's settings are swapped into config around every
+	batch, which is safe since batches never interleave.
+
+	@param run_id     id of the run
+	@param settings   dict of API setting names to values
+	@param batch_size world steps per batch
+	'''
+	def __init__(self, run_id, settings, batch_size):
+		self.run_id = run_id
+		self.settings = {}
+		self.batch_size = batch_size
+		self.status = "running"
+		self.metrics = []
+		self.task = None
+		self.world = None
+		# message of the exception that failed the run
+		self.error = None
+
+		self.set_settings(settings)
+		with self.apply_config():
+			self.world = world.World()
+
+	def apply_config(self):
+		settings = {RUN_SETTINGS[key]: value
+				for (key, value) in self.settings.items()}
+		settings["RENDER_ENABLED"] = False
+		# ghost count changes are written back to config by the world
+		settings.setdefault("GHOST_COUNT", config.GHOST_COUNT)
+		return config.override(settings)
+
+	'''
+	@return the settings parsed, vip_state as a VIPState
+	@raise  ValueError on unknown settings or values of the wrong type or
+	        out of range, before any is applied
+	'''
+	def parse_settings(self, settings):
+		if not isinstance(settings, dict):
+			raise ValueError("settings must be a JSON object")
+
+		parsed = {}
+		for (key, value) in settings.items():
+			if key not in RUN_SETTINGS:
+				raise ValueError(f"unknown setting \"{key}\"")
+			parsed[key] = parse_setting(key, value)
+
+		return parsed
+
+	def set_settings(self, settings):
+		settings = self.parse_settings(settings)
+
+		# apply live changes to the world, then keep the settings
+		if self.world is not None:
+			with self.apply_config():
+				for (key, value) in settings.items():
+					if key == "ghost_count":
+						self.world.set_ghost_count(value)
+					elif key == "ghost_exploration":
+						self.world.set_ghost_exploration(value)
+					elif key == "ghost_follow_reward":
+						self.world.set_ghost_follow_reward(value)
+					elif key == "iteration_max":
+						self.world.convergence.max_steps = value
+
+		self.settings.update(settings)
+
+	def step_batch(self):
+		with self.apply_config():
+			finished = False
+			for _ in range(self.batch_size):
+				finished = self.world.update(config.STEP_TIME)
+				if finished: break
+
+		self.metrics.append(self.get_point())
+		return finished
+
+	def get_point(self):
+		return {
+			"step": self.world.guard.get_iteration_count(),
+			"guard": self.world.guard.get_average_reward(),
+			"hostile": self.world.hostile.get_average_reward(),
+		}
+
+	def get_info(self):
+		return {
+			"id": self.run_id,
+			"status": self.status,
+			"settings": {key: (value.name if key == "vip_state" else value)
+					for (key, value) in self.settings.items()},
+			"fitness": self.world.get_fitness(),
+			"stop_reason": self.world.convergence.get_stop_reason(),
+			"error": self.error,
+			**self.get_point(),
+		}
+
+	async def run(self):
+		try:
+			while self.status == "running":
+				if self.step_batch():
+					self.status = "finished"
+				# let the API and other runs in
+				await asyncio.sleep(0)
+		except asyncio.CancelledError:
+			self.status = "stopped"
+		except Exception as e:
+			# ends the run's streams, the error is reported by get_info
+			self.status = "failed"
+			self.error = f"{type(e).__name__}: {e}"
+
+class SimulationHost:
+
+	'''
+	Steps any number of runs in the background of an asyncio loop and
+	serves a small local JSON over HTTP control API:
+
+		GET  /runs                 list runs
+		POST /runs                 start a run, body is its settings
+		GET  /runs/<id>            run info
+		POST /runs/<id>/settings   change settings of a live run
+		POST /runs/<id>/stop       stop a run
+		GET  /runs/<id>/metrics    reward points, "?since=<n>" skips n
+		GET  /runs/<id>/stream     reward points as newline delimited JSON
+		                           until the run ends
+
+	@param batch_size world steps per batch of a run
+	'''
+	def __init__(self, batch_size = 50):
+		self.batch_size = batch_size
+		self.runs = {}
+		self.ids = itertools.count()
+
+	def start_run(self, settings):
+		run = Run(next(self.ids), settings, self.batch_size)
+		run.task = asyncio.get_running_loop().create_task(run.run())
+		self.runs[run.run_id] = run
+		return run
+
+	def stop_run(self, run):
+		if run.status == "running":
+			run.status = "stopped"
+			run.task.cancel()
+
+	def get_run(self, run_id):
+		try:
+			return self.runs[int(run_id)]
+		except (ValueError, KeyError):
+			raise LookupError(f"no run \"{run_id}\"")
+
+	'''
+	@return (status, response body) of an API request
+	'''
+	def handle(self, method, path, query, body):
+		parts = [p for p in path.split("/") if p]
+
+		if parts == ["runs"]:
+			if method == "GET":
+				return 200, [run.get_info() for run in self.runs.values()]
+			if method == "POST":
+				return 201, self.start_run(body).get_info()
+
+		elif len(parts) >= 2 and parts[0] == "runs":
+			run = self.get_run(parts[1])
+			action = parts[2] if len(parts) > 2 else None
+
+			if method == "GET" and action is None:
+				return 200, run.get_info()
+			if method == "GET" and action == "metrics":
+				return 200, run.metrics[int(query.get("since", 0)):]
+			if method == "POST" and action == "settings":
+				run.set_settings(body)
+				return 200, run.get_info()
+			if method == "POST" and action == "stop":
+				self.stop_run(run)
+				return 200, run.get_info()
+
+		return 404, {"error": f"no route {method} {path}"}
+
+	async def stream(self, writer, run):
+		sent = 0
+		while True:
+			points = run.metrics[sent:]
+			for point in points:
+				writer.write((json.dumps(point) + "\n").encode())
+			sent += len(points)
+			await writer.drain()
+
+			if run.status != "running" and sent >= len(run.metrics):
+				break
+			await asyncio.sleep(0.1)
+
+	async def on_connection(self, reader, writer):
+		try:
+			await self.respond(reader, writer)
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def respond(self, reader, writer):
+		try:
+			request = await reader.readline()
+			(method, target, _) = request.decode().split(" ", 2)
+
+			headers = {}
+			while True:
+				line = (await reader.readline()).decode().strip()
+				if not line: break
+				(name, value) = line.split(":", 1)
+				headers[name.strip().lower()] = value.strip()
+
+			length = int(headers.get("content-length", 0))
+			body = json.loads(await reader.readexactly(length)) if length else {}
+
+			(path, _, query) = target.partition("?")
+			query = dict(p.partition("=")[::2] for p in query.split("&") if p)
+
+			parts = [p for p in path.split("/") if p]
+			if method == "GET" and len(parts) == 3 and parts[2] == "stream":
+				run = self.get_run(parts[1])
+				writer.write(b"HTTP/1.1 200 OK\r\n"
+						b"Content-Type: application/x-ndjson\r\n"
+						b"Connection: close\r\n\r\n")
+				await self.stream(writer, run)
+				return
+
+			(status, response) = self.handle(method, path, query, body)
+
+		except LookupError as e:
+			(status, response) = 404, {"error": str(e)}
+		except (ValueError, TypeError) as e:
+			(status, response) = 400, {"error": str(e)}
+
+		data = json.dumps(response).encode()
+		writer.write(f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+				f"Content-Type: application/json\r\n"
+				f"Content-Length: {len(data)}\r\n"
+				f"Connection: close\r\n\r\n".encode() + data)
+		await writer.drain()
+
+	async def serve(self, host = "127.0.0.1", port = 8765):
+		server = await asyncio.start_server(self.on_connection, host, port)
+		print(f"Simulation host listening on http://{host}:{port}")
+		async with server:
+			await server.serve_forever()
+
+def main():
+	port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+	asyncio.run(SimulationHost().serve(port = port))
+
+if __name__ == "__main__":
+	main()
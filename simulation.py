@@ -0,0 +1,175 @@
+import config
+
+import queue
+import threading
+import time
+
+class GraphForwarder:
+
+	'''
+	Stands in for a LiveGraph on the simulation thread. Qt widgets may only
+	be drawn from the GUI thread, so values are queued and added there.
+	'''
+	def __init__(self, values):
+		self.values = values
+
+	def add_val(self, index, y):
+		self.values.put((index, y))
+
+class SimulationThread:
+
+	'''
+	Runs World.update on a worker thread, so a slow simulation does not
+	hold up event handling and drawing on the GUI thread. Has the input
+	and render interface of World for PygameWindow.
+
+	Input is queued by the GUI thread and applied by the worker between
+	steps. Whenever the GUI has drawn a frame the worker publishes a new
+	snapshot of positions, which the GUI draws next. Neither thread locks
+	on its hot path; a snapshot is only replaced, never changed.
+
+	@param world     the World to run
+	@param step_time simulated seconds per update, one step by default
+	'''
+	def __init__(self, world, step_time = None):
+		self.world = world
+		self.step_time = config.STEP_TIME if step_time is None else step_time
+
+		self.inputs = queue.SimpleQueue()
+		self.posted_count = 0
+		# inputs applied so far, published with every snapshot
+		self.input_count = 0
+		# (input count, snapshot) last published by the worker
+		self.snapshot = None
+		self.frame_requested = True
+		# set whenever a snapshot is published
+		self.published = threading.Event()
+		# inputs reflected by the snapshot drawn last
+		self.drawn_inputs = 0
+		self.step_count = 0
+
+		self.finished = False
+		self.stopping = False
+		# exception that stopped the worker, raised again by update
+		self.error = None
+
+		self.graph = getattr(world, "rewards_graph", None)
+		self.graph_values = queue.SimpleQueue()
+		if self.graph is not None:
+			world.rewards_graph = GraphForwarder(self.graph_values)
+
+		self.thread = threading.Thread(target = self.run, daemon = True)
+		self.thread.start()
+
+	def run(self):
+		try:
+			self.step_until_stopped()
+		except Exception as e:
+			self.error = e
+			self.finished = True
+			# do not leave render waiting for a snapshot
+			self.published.set()
+
+	def step_until_stopped(self):
+		while not self.stopping:
+			applied = self.apply_inputs()
+
+			self.finished = self.world.update(self.step_time)
+			self.step_count += 1
+
+			# publish input without waiting for the next frame request
+			if self.frame_requested or applied or self.finished:
+				self.frame_requested = False
+				self.publish()
+
+			if self.finished: break
+			# let a waiting GUI thread take the GIL between steps
+			time.sleep(0)
+
+	'''
+	@return whether any input was applied
+	'''
+	def apply_inputs(self):
+		applied = False
+		while not self.inputs.empty():
+			(func, args) = self.inputs.get_nowait()
+			func(*args)
+			self.input_count += 1
+			applied = True
+
+		return applied
+
+	def publish(self):
+		self.snapshot = (self.input_count, self.world.get_snapshot())
+		self.published.set()
+
+	'''
+	Queues @func to be called with @args on the simulation thread
+
+	@return number of inputs applied once this one is
+	'''
+	def post(self, func, *args):
+		self.inputs.put((func, args))
+		self.posted_count += 1
+		return self.posted_count
+
+	def get_drawn_inputs(self):
+		return self.drawn_inputs
+
+	def on_mouse_move(self, mouse_pos):
+		self.post(self.world.on_mouse_move, mouse_pos)
+
+	def on_number_pressed(self, number):
+		self.post(self.world.on_number_pressed, number)
+
+	def on_key_pressed(self, key):
+		self.post(self.world.on_key_pressed, key)
+
+	'''
+	Adds queued graph values, the simulation runs on its own. Raises any
+	exception that stopped the simulation thread, once.
+
+	@return whether the world has finished
+	'''
+	def update(self, deltatime):
+		self.add_graph_values()
+
+		if self.error is not None:
+			(error, self.error) = (self.error, None)
+			raise error
+
+		return self.finished
+
+	'''
+	Draws the newest snapshot. If input is still waiting to be applied,
+	waits up to @config.INPUT_WAIT seconds for a snapshot showing it.
+	'''
+	def render(self, screen):
+		self.published.clear()
+		snapshot = self.snapshot
+		if snapshot is None or snapshot[0] < self.posted_count:
+			self.published.wait(config.INPUT_WAIT)
+			snapshot = self.snapshot
+
+		if snapshot is not None:
+			self.world.render(screen, snapshot[1])
+			self.drawn_inputs = snapshot[0]
+		self.frame_requested = True
+
+	def add_graph_values(self):
+		if self.graph is not None:
+			while not self.graph_values.empty():
+				self.graph.add_val(*self.graph_values.get_nowait())
+
+	def get_fitness(self):
+		return self.world.get_fitness()
+
+	def on_close(self):
+		self.stopping = True
+		self.thread.join()
+
+		self.add_graph_values()
+		if self.graph is not None:
+			self.world.rewards_graph = self.graph
+
+		self.world.on_close()
@@ -0,0 +1,154 @@
+import numpy as np
+
+'''
+Indices into a CSR layout for every (query, bucket) pair: the entries
+starts[i] .. starts[i] + counts[i] - 1 of every i, flattened
+
+@return (query of each entry, entry)
+'''
+def ragged_ranges(starts, counts):
+	total = int(counts.sum())
+	owners = np.repeat(np.arange(len(counts)), counts)
+	offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+	return owners, np.repeat(starts, counts) + offsets
+
+class GridIndex:
+
+	'''
+	Buckets points of a grid into square buckets of @bucket_size cells so
+	nearest neighbour and radius queries only look at nearby buckets. A
+	build is a counting sort, and queries are vectorized over all query
+	points, so a step over n agents costs about O(n) rather than the
+	O(n * m) of comparing every pair.
+
+	@param grid_w      grid width in cells
+	@param grid_h      grid height in cells
+	@param bucket_size bucket width in cells
+	'''
+	def __init__(self, grid_w, grid_h, bucket_size = 4):
+		self.bucket_size = bucket_size
+		self.buckets_w = -(-grid_w // bucket_size)
+		self.buckets_h = -(-grid_h // bucket_size)
+
+		self.xs = np.zeros(0, dtype = np.intp)
+		self.ys = np.zeros(0, dtype = np.intp)
+		self.order = np.zeros(0, dtype = np.intp)
+		self.starts = np.zeros(self.buckets_w * self.buckets_h, dtype = np.intp)
+		self.counts = np.zeros(self.buckets_w * self.buckets_h, dtype = np.intp)
+
+	def get_buckets(self, xs, ys):
+		return (xs // self.bucket_size) * self.buckets_h + ys // self.bucket_size
+
+	def build(self, xs, ys):
+		# copied, the points may be moved in place after the build
+		self.xs = np.array(xs)
+		self.ys = np.array(ys)
+
+		buckets = self.get_buckets(self.xs, self.ys)
+		self.counts = np.bincount(buckets, minlength = len(self.counts))
+		self.starts = np.cumsum(self.counts) - self.counts
+		self.order = np.argsort(buckets, kind = "stable")
+
+	'''
+	Gathers the points in the buckets at the offsets (dbxs, dbys) from the
+	bucket of every query
+
+	@return (query of each candidate, point index of each candidate)
+	'''
+	def gather(self, qbx, qby, dbxs, dbys):
+		bx = (qbx[:, None] + dbxs[None, :]).ravel()
+		by = (qby[:, None] + dbys[None, :]).ravel()
+		inside = (bx >= 0) & (bx < self.buckets_w) & \
+				 (by >= 0) & (by < self.buckets_h)
+		queries = np.flatnonzero(inside) // len(dbxs)
+		buckets = bx[inside] * self.buckets_h + by[inside]
+
+		(owners, entries) = ragged_ranges(
+				self.starts[buckets], self.counts[buckets])
+		return queries[owners], self.order[entries]
+
+	def get_d2(self, qxs, qys, queries, points):
+		return (self.xs[points] - qxs[queries]) ** 2 + \
+			   (self.ys[points] - qys[queries]) ** 2
+
+	'''
+	@return (index of the nearest point, squared distance) per query, -1
+	        and inf where there are no points
+	'''
+	def nearest(self, qxs, qys):
+		qxs = np.asarray(qxs)
+		qys = np.asarray(qys)
+		best = np.full(len(qxs), -1, dtype = np.intp)
+		best_d2 = np.full(len(qxs), np.inf)
+		if len(self.xs) == 0 or len(qxs) == 0:
+			return best, best_d2
+
+		qbx = qxs // self.bucket_size
+		qby = qys // self.bucket_size
+		active = np.arange(len(qxs))
+
+		for ring in range(max(self.buckets_w, self.buckets_h)):
+			(dbxs, dbys) = ring_offsets(ring)
+			(queries, points) = self.gather(
+					qbx[active], qby[active], dbxs, dbys)
+			queries = active[queries]
+			d2 = self.get_d2(qxs, qys, queries, points)
+
+			# keep the closest candidate per query
+			order = np.lexsort((d2, queries))
+			(queries, points, d2) = (queries[order], points[order], d2[order])
+			first = np.ones(len(order), dtype = bool)
+			first[1:] = queries[1:] != queries[:-1]
+			(queries, points, d2) = (queries[first], points[first], d2[first])
+
+			closer = d2 < best_d2[queries]
+			best[queries[closer]] = points[closer]
+			best_d2[queries[closer]] = d2[closer]
+
+			# points of later rings are at least ring * size + 1 away
+			bound = ring * self.bucket_size + 1
+			active = active[best_d2[active] > bound * bound]
+			if len(active) == 0: break
+
+		return best, best_d2
+
+	'''
+	@return number of points within @radius of every query
+	'''
+	def count_within(self, qxs, qys, radius):
+		qxs = np.asarray(qxs)
+		qys = np.asarray(qys)
+		if len(self.xs) == 0 or len(qxs) == 0:
+			return np.zeros(len(qxs), dtype = np.intp)
+
+		reach = int(np.ceil(radius / self.bucket_size))
+		(dbxs, dbys) = np.meshgrid(np.arange(-reach, reach + 1),
+				np.arange(-reach, reach + 1))
+		(queries, points) = self.gather(
+				qxs // self.bucket_size, qys // self.bucket_size,
+				dbxs.ravel(), dbys.ravel())
+		d2 = self.get_d2(qxs, qys, queries, points)
+
+		return np.bincount(queries[d2 <= radius * radius],
+				minlength = len(qxs))
+
+'''
+@return (dbxs, dbys) bucket offsets at Chebyshev distance @ring
+'''
+def ring_offsets(ring):
+	if ring == 0:
+		return np.zeros(1, dtype = np.intp), np.zeros(1, dtype = np.intp)
+
+	side = np.arange(-ring, ring)
+	dbxs = np.concatenate([side, np.full(2 * ring, ring), -side, np.full(2 * ring, -ring)])
+	dbys = np.concatenate([np.full(2 * ring, -ring), side, np.full(2 * ring, ring), -side])
+	return dbxs, dbys
+
+'''
+Nearest point by comparing every pair, for reference and benchmarks
+'''
+def brute_nearest(xs, ys, qxs, qys):
+	d2 = (np.asarray(qxs)[:, None] - np.asarray(xs)[None, :]) ** 2 + \
+		 (np.asarray(qys)[:, None] - np.asarray(ys)[None, :]) ** 2
+	best = d2.argmin(axis = 1)
+	return best, d2[np.arange(len(best)), best].astype(float)
@@ -0,0 +1,150 @@
+import config
+import utils
+import agent
+import ghosts
+import spatial
+
+import numpy as np
+
+class Squad(ghosts.GhostPool):
+
+	'''
+	A team of learning agents sharing one controller, stored like a ghost
+	pool. The other agent in each member's state is the nearest member of
+	the rival squad, so the tables of a single guard and hostile are used
+	unchanged. Whenever the squad moves, a spatial index finds its nearest
+	member to every cell of the grid, so lookups from the rival squad and
+	ghosts are a single gather.
+
+	@param vip        the VIP of the world
+	@param controller controller of the squad's table
+	@param color      render color of the members
+	@param can_suffer whether backed up rewards get the suffering factor
+	'''
+	def __init__(self, vip, controller, color, can_suffer = False):
+		self.vip = vip
+		self.can_suffer = can_suffer
+		# set once both squads exist
+		self.rival = None
+
+		self.index = None
+		if config.SPATIAL_BUCKET > 0:
+			self.index = spatial.GridIndex(
+					config.GRID_W, config.GRID_H, config.SPATIAL_BUCKET)
+			(self.cell_xs, self.cell_ys) = \
+					np.indices((config.GRID_W, config.GRID_H)).reshape(2, -1)
+			# nearest member to every cell as (x, y) grids
+			shape = (config.GRID_W, config.GRID_H)
+			self.nearest_xs = np.zeros(shape, dtype = np.int32)
+			self.nearest_ys = np.zeros(shape, dtype = np.int32)
+
+		self.reward_monitor = utils.ValueMonitor()
+
+		super(Squad, self).__init__(self, color, controller = controller)
+
+	def set_count(self, count):
+		super(Squad, self).set_count(count)
+		self.build_index()
+
+	def build_index(self):
+		if self.index is None: return
+
+		self.index.build(*self.get_cells())
+		(nearest, _) = self.index.nearest(self.cell_xs, self.cell_ys)
+		self.nearest_xs.flat = self.index.xs[nearest]
+		self.nearest_ys.flat = self.index.ys[nearest]
+
+	'''
+	@return (xs, ys) of the nearest member to every given cell
+	'''
+	def get_nearest_cells(self, xs, ys):
+		if self.index is None:
+			(mxs, mys) = self.get_cells()
+			(nearest, _) = spatial.brute_nearest(mxs, mys, xs, ys)
+			return mxs[nearest], mys[nearest]
+
+		return self.nearest_xs[xs, ys], self.nearest_ys[xs, ys]
+
+	'''
+	@return number of members within @dst of every given cell
+	'''
+	def count_within(self, xs, ys, dst):
+		if self.index is None:
+			(mxs, mys) = self.get_cells()
+			dst2 = (np.asarray(xs)[:, None] - mxs[None, :]) ** 2 + \
+				   (np.asarray(ys)[:, None] - mys[None, :]) ** 2
+			return (dst2 <= dst * dst).sum(axis = 1)
+
+		return self.index.count_within(xs, ys, dst)
+
+	def get_states(self, xs, ys):
+		return (xs, ys) + \
+			   self.vip.get_int_pos() + \
+			   self.rival.get_nearest_cells(xs, ys)
+
+	def cells_are_allowed(self, xs, ys):
+		return np.ones(len(xs), dtype = bool)
+
+	def step(self):
+		r = super(Squad, self).step()
+		self.build_index()
+
+		if r is not None:
+			self.reward_monitor.update(float(r.mean()))
+		return r
+
+	def attach_rewards_graph(self, graph_func):
+		self.reward_monitor.set_graph_func(
+				lambda mon: graph_func(mon.get_recent_average()))
+
+	def get_average_reward(self):
+		return self.reward_monitor.get_recent_average()
+
+	def dump(self, filename):
+		self.controller.dump(filename)
+
+class GuardSquad(Squad):
+
+	'''
+	@param q_table table to start from instead of a new or saved one
+	'''
+	def __init__(self, vip, use_saved_data = True, q_table = None):
+		controller = agent.create_controller(
+				config.GUARD_Q_FILE if use_saved_data else None,
+				gamma = config.GUARD_GAMMA,
+				exploration = 0,
+				q_table = q_table)
+
+		super(GuardSquad, self).__init__(vip, controller, (0, 255, 0),
+				can_suffer = True)
+
+	def create_ghost_pool(self, capacity = 0):
+		return ghosts.GhostPool(self, (200, 255, 200), capacity)
+
+	def get_rewards(self, xs, ys):
+		(hxs, hys) = self.rival.get_nearest_cells(xs, ys)
+		return agent.guard_rewards(self.vip.get_int_pos(), xs, ys, hxs, hys)
+
+class HostileSquad(Squad):
+
+	'''
+	@param q_table table to start from instead of a new or saved one
+	'''
+	def __init__(self, vip, use_saved_data = True, q_table = None):
+		controller = agent.create_controller(
+				config.HOSTILE_Q_FILE if use_saved_data else None,
+				gamma = config.HOSTILE_GAMMA,
+				exploration = 0.4,
+				q_table = q_table)
+
+		super(HostileSquad, self).__init__(vip, controller, (255, 0, 0))
+
+	def create_ghost_pool(self, capacity = 0):
+		return ghosts.GhostPool(self, (255, 200, 200), capacity)
+
+	def get_rewards(self, xs, ys):
+		(gxs, gys) = self.rival.get_nearest_cells(xs, ys)
+		return agent.hostile_rewards(self.vip.get_int_pos(), gxs, gys, xs, ys)
+
+	def cells_are_allowed(self, xs, ys):
+		return agent.hostile_cells_allowed(self.vip.get_int_pos(), xs, ys)
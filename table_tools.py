@@ -0,0 +1,310 @@
+import q_learner
+
+import sys
+import os.path
+import time
+import json
+import struct
+import zlib
+import bz2
+import lzma
+import pickle
+import numpy as np
+
+# stdlib (compressor, decompressor) factories of compressed tables,
+# fastest first
+CODECS = {
+	"zlib": (lambda: zlib.compressobj(6), zlib.decompressobj),
+	"bz2": (lambda: bz2.BZ2Compressor(9), bz2.BZ2Decompressor),
+	"lzma": (lambda: lzma.LZMACompressor(), lzma.LZMADecompressor),
+}
+
+MAGIC = b"BGQZ1\n"
+
+'''
+Streams a table as blocks of state rows, so no more than one block is in
+memory at a time when the table is memory mapped
+
+@param table       array whose last @action_dims dimensions are actions
+@param chunk_rows  states per block
+@yield             (first flat state index, block of shape (rows, actions))
+'''
+def iter_chunks(table, chunk_rows = 1 << 16, action_dims = 1):
+	action_count = int(np.prod(table.shape[-action_dims:]))
+	rows = table.reshape(-1, action_count)
+	for start in range(0, len(rows), chunk_rows):
+		yield start, np.asarray(rows[start:start + chunk_rows])
+
+class TableStats:
+
+	'''
+	Streaming statistics of a Q table: how many states and (s, a) entries
+	were ever written, value statistics over all and written entries, and
+	per state dimension the visited states and mean max Q at each index.
+	An entry counts as written when it is nonzero, as tables start zeroed.
+	'''
+	def __init__(self, table, action_dims = 1, chunk_rows = 1 << 16):
+		self.shape = table.shape
+		self.state_shape = table.shape[:-action_dims]
+
+		self.state_count = int(np.prod(self.state_shape))
+		self.visited_states = 0
+		self.entry_count = table.size
+		self.written_entries = 0
+
+		self.min = np.inf
+		self.max = -np.inf
+		self.sum = 0.0
+		self.sum2 = 0.0
+		self.written_sum = 0.0
+
+		self.dim_visits = [np.zeros(n, dtype = np.int64) for n in self.state_shape]
+		self.dim_max_q = [np.zeros(n) for n in self.state_shape]
+
+		for (start, block) in iter_chunks(table, chunk_rows, action_dims):
+			self.add_chunk(start, block)
+
+	def add_chunk(self, start, block):
+		written = block != 0
+		visited = written.any(axis = 1)
+
+		self.visited_states += int(np.count_nonzero(visited))
+		self.written_entries += int(np.count_nonzero(written))
+		self.min = min(self.min, float(block.min()))
+		self.max = max(self.max, float(block.max()))
+		self.sum += float(block.sum())
+		self.sum2 += float(np.square(block).sum())
+		self.written_sum += float(block[written].sum())
+
+		indices = start + np.flatnonzero(visited)
+		coords = np.unravel_index(indices, self.state_shape)
+		max_q = block[visited].max(axis = 1)
+		for (d, coord) in enumerate(coords):
+			n = self.state_shape[d]
+			self.dim_visits[d] += np.bincount(coord, minlength = n)
+			self.dim_max_q[d] += np.bincount(coord, weights = max_q, minlength = n)
+
+	def get_mean(self):
+		return self.sum / self.entry_count
+
+	def get_std(self):
+		return np.sqrt(max(0, self.sum2 / self.entry_count - self.get_mean() ** 2))
+
+	def print_report(self, name):
+		written_mean = self.written_sum / self.written_entries \
+				if self.written_entries > 0 else 0
+
+		print(f"\n\nQ table \"{name}\" {self.shape} \n\n"
+			  f"  Coverage: \n"
+			  f"      visited states: {self.visited_states} / {self.state_count} "
+			  f"({100 * self.visited_states / self.state_count:.2f}%) \n"
+			  f"      written (s, a): {self.written_entries} / {self.entry_count} "
+			  f"({100 * self.written_entries / self.entry_count:.2f}%) \n\n"
+			  f"  Values: \n"
+			  f"      min / max:      {self.min:.4f} / {self.max:.4f} \n"
+			  f"      mean / std:     {self.get_mean():.4f} / {self.get_std():.4f} \n"
+			  f"      written mean:   {written_mean:.4f} \n\n"
+			  f"  Per dimension (visited states, mean max Q by index): ")
+		for (d, visits) in enumerate(self.dim_visits):
+			with np.errstate(invalid = "ignore", divide = "ignore"):
+				means = np.where(visits > 0, self.dim_max_q[d] / visits, 0)
+			print(f"      dim {d}: " +
+				  " ".join(f"{v}" for v in visits) + "\n" +
+				  f"             " + " ".join(f"{m:.1f}" for m in means))
+		print("\n")
+
+'''
+Compares the greedy policies of two tables of the same shape
+
+@return (states visited in both, of which with the same greedy action,
+         greedy agreement over all states)
+'''
+def policy_agreement(table_a, table_b, action_dims = 1, chunk_rows = 1 << 16):
+	if table_a.shape != table_b.shape:
+		raise ValueError(f"table shapes differ: {table_a.shape} and {table_b.shape}")
+
+	both = 0
+	both_agree = 0
+	agree = 0
+	chunks = zip(iter_chunks(table_a, chunk_rows, action_dims),
+			iter_chunks(table_b, chunk_rows, action_dims))
+	for ((_, a), (_, b)) in chunks:
+		same = a.argmax(axis = 1) == b.argmax(axis = 1)
+		visited = (a != 0).any(axis = 1) & (b != 0).any(axis = 1)
+		both += int(np.count_nonzero(visited))
+		both_agree += int(np.count_nonzero(same & visited))
+		agree += int(np.count_nonzero(same))
+
+	state_count = table_a.size // int(np.prod(table_a.shape[-action_dims:]))
+	return both, both_agree, agree / state_count
+
+'''
+Writes a table sparsely: the gaps between the flat indices of nonzero
+entries and their values, compressed chunk by chunk with a stdlib codec
+'''
+def write_compressed(table, filename, codec = "zlib", chunk_rows = 1 << 16):
+	compressor = CODECS[codec][0]()
+	index_type = np.uint32 if table.size < (1 << 32) else np.uint64
+
+	nnz = 0
+	last = -1
+	with open(filename + ".tmp", "wb") as tmp:
+		for (start, block) in iter_chunks(table, chunk_rows):
+			flat = block.reshape(-1)
+			nonzero = np.flatnonzero(flat)
+			indices = start * block.shape[1] + nonzero
+			gaps = np.diff(indices, prepend = last).astype(index_type)
+			if len(indices) > 0: last = indices[-1]
+			nnz += len(indices)
+
+			tmp.write(compressor.compress(struct.pack("<Q", len(indices)) +
+					gaps.tobytes() + flat[nonzero].tobytes()))
+		tmp.write(compressor.flush())
+
+	header = json.dumps({
+		"shape": list(table.shape),
+		"dtype": table.dtype.str,
+		"index_dtype": np.dtype(index_type).str,
+		"codec": codec,
+		"nnz": nnz,
+	}).encode()
+
+	with open(filename, "wb") as fp, open(filename + ".tmp", "rb") as tmp:
+		fp.write(MAGIC + struct.pack("<I", len(header)) + header)
+		while True:
+			data = tmp.read(1 << 20)
+			if not data: break
+			fp.write(data)
+	os.remove(filename + ".tmp")
+
+'''
+Reads a table written by write_compressed, decompressing @read_size bytes
+of the file at a time straight into the zeroed table, so no more than a
+chunk of entries is held besides the table
+
+@param read_size compressed bytes read at a time
+'''
+def read_compressed(filename, read_size = 1 << 20):
+	with open(filename, "rb") as fp:
+		if fp.read(len(MAGIC)) != MAGIC:
+			raise ValueError(f"\"{filename}\" is not a compressed Q table")
+		(length,) = struct.unpack("<I", fp.read(4))
+		header = json.loads(fp.read(length))
+
+		dtype = np.dtype(header["dtype"])
+		index_dtype = np.dtype(header["index_dtype"])
+		entry_size = index_dtype.itemsize + dtype.itemsize
+		table = np.zeros(header["shape"], dtype = dtype)
+		flat = table.reshape(-1)
+
+		decompressor = CODECS[header["codec"]][1]()
+		# decompressed bytes of chunks not read whole yet
+		data = bytearray()
+		last = -1
+		while True:
+			compressed = fp.read(read_size)
+			if compressed:
+				data += decompressor.decompress(compressed)
+
+			offset = 0
+			while len(data) - offset >= 8:
+				(count,) = struct.unpack_from("<Q", data, offset)
+				if len(data) - offset - 8 < count * entry_size: break
+				offset += 8
+				# copies, as the buffer shrinks once the chunks are read
+				size = count * index_dtype.itemsize
+				gaps = np.frombuffer(data[offset:offset + size], index_dtype)
+				offset += size
+				size = count * dtype.itemsize
+				values = np.frombuffer(data[offset:offset + size], dtype)
+				offset += size
+
+				indices = last + np.cumsum(gaps.astype(np.int64))
+				flat[indices] = values
+				if count > 0: last = indices[-1]
+			del data[:offset]
+
+			if not compressed: break
+
+	if len(data) > 0:
+		raise ValueError(f"\"{filename}\" ends within a chunk")
+
+	return table
+
+'''
+Compares file size and load time of a table saved as a pickle, as .npy
+and compressed with every codec
+'''
+def bench_formats(table, directory = "."):
+	table = np.asarray(table)
+	rows = []
+
+	def add(name, filename, load):
+		start = time.perf_counter()
+		loaded = load(filename)
+		load_time = time.perf_counter() - start
+		if not np.array_equal(np.asarray(loaded), table):
+			raise ValueError(f"{name} did not load the table it saved")
+		rows.append((name, os.path.getsize(filename), load_time))
+		os.remove(filename)
+
+	filename = os.path.join(directory, "bench_table")
+	with open(filename + ".pickle", "wb") as fp:
+		pickle.dump(table, fp)
+	def load_pickle(f):
+		with open(f, "rb") as fp:
+			return pickle.load(fp)
+	add("pickle", filename + ".pickle", load_pickle)
+
+	np.save(filename + ".npy", table)
+	add("npy", filename + ".npy", np.load)
+
+	for codec in CODECS:
+		start = time.perf_counter()
+		write_compressed(table, filename + "." + codec, codec)
+		print(f"  wrote {codec} in {time.perf_counter() - start:.2f} s")
+		add(codec, filename + "." + codec, read_compressed)
+
+	print(f"\n  {'format':8} {'size':>12} {'ratio':>8} {'load':>10}")
+	for (name, size, load_time) in rows:
+		print(f"  {name:8} {size:12} {rows[0][1] / size:8.1f} "
+			  f"{load_time * 1000:8.1f} ms")
+	print()
+
+def open_any(filename):
+	with open(filename, "rb") as fp:
+		compressed = fp.read(len(MAGIC)) == MAGIC
+	return read_compressed(filename) if compressed else q_learner.open_table(filename)
+
+def main():
+	usage = "usage: table_tools.py stats <table> | compare <table> <table> | " \
+			"compress <table> <output> [codec] | bench <table>"
+	if len(sys.argv) < 3:
+		print(usage)
+		return
+
+	(command, args) = (sys.argv[1], sys.argv[2:])
+	if command == "stats":
+		TableStats(open_any(args[0])).print_report(args[0])
+
+	elif command == "compare":
+		(both, both_agree, agree) = policy_agreement(
+				open_any(args[0]), open_any(args[1]))
+		print(f"\nGreedy policy agreement \n\n"
+			  f"  states visited in both: {both} \n"
+			  f"  agreeing there:         {both_agree} "
+			  f"({100 * both_agree / max(1, both):.2f}%) \n"
+			  f"  agreeing over all:      {100 * agree:.2f}% \n")
+
+	elif command == "compress":
+		write_compressed(open_any(args[0]), args[1],
+				args[2] if len(args) > 2 else "zlib")
+
+	elif command == "bench":
+		bench_formats(open_any(args[0]))
+
+	else:
+		print(usage)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,273 @@
+import config
+
+import os
+import sys
+import json
+import itertools
+import struct
+import numpy as np
+
+MAGIC = b"BGTRAJ1\n"
+
+'''
+@param ghost_samples ghosts of each kind stored per step
+@return              structured dtype of one recorded step
+'''
+def record_dtype(ghost_samples):
+	fields = [
+		("step", np.int32),
+		("vip", np.int16, (2,)),
+		("guard", np.int16, (2,)),
+		("guard_action", np.int8),
+		("guard_reward", np.float32),
+		("hostile", np.int16, (2,)),
+		("hostile_action", np.int8),
+		("hostile_reward", np.float32),
+	]
+	if ghost_samples > 0:
+		fields += [
+			("ghost_guards", np.int16, (ghost_samples, 2)),
+			("ghost_hostiles", np.int16, (ghost_samples, 2)),
+		]
+
+	return np.dtype(fields)
+
+'''
+Creates the first of @filename, then "name.1.ext", "name.2.ext" and so on
+that does not exist yet. Creation is exclusive, so worlds of parallel
+processes each get their own file.
+
+@return (filename, file open for binary writing)
+'''
+def open_free_file(filename):
+	(base, ext) = os.path.splitext(filename)
+	for number in itertools.count():
+		name = filename if number == 0 else f"{base}.{number}{ext}"
+		try:
+			return name, open(name, "xb")
+		except FileExistsError:
+			pass
+
+class TrajectoryRecorder:
+
+	'''
+	Records every guard step of a world into a preallocated buffer of
+	fixed size records, which is appended to @filename a chunk at a time.
+	Since records have a fixed size the file is its own step index.
+
+	@param filename      file to write, numbered as in open_free_file when
+	                     taken, so worlds never overwrite each other
+	@param ghost_samples ghosts of each kind recorded per step
+	@param chunk_size    records buffered between writes
+	'''
+	def __init__(self, filename, ghost_samples = 0, chunk_size = 4096):
+		self.ghost_samples = ghost_samples
+		self.buffer = np.zeros(chunk_size, dtype = record_dtype(ghost_samples))
+		self.count = 0
+		self.record_count = 0
+		self.last_step = 0
+
+		header = json.dumps({
+			"grid": [config.GRID_W, config.GRID_H],
+			"map": config.MAP_FILE,
+			"ghost_samples": ghost_samples,
+			"step_time": config.STEP_TIME,
+		}).encode()
+
+		(self.filename, self.fp) = open_free_file(filename)
+		print(f"Recording trajectory to \"{self.filename}\"...")
+		self.fp.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+	'''
+	Records the world if its guard stepped since the last call
+	'''
+	def record(self, world):
+		step = world.guard.get_iteration_count()
+		if step == self.last_step: return
+		self.last_step = step
+
+		r = self.buffer[self.count]
+		r["step"] = step
+		r["vip"] = world.vip.get_int_pos()
+		r["guard"] = world.guard.get_int_pos()
+		r["guard_action"] = world.guard.last_a[0]
+		r["guard_reward"] = world.guard.last_r
+		r["hostile"] = world.hostile.get_int_pos()
+		r["hostile_action"] = world.hostile.last_a[0]
+		r["hostile_reward"] = world.hostile.last_r
+
+		if self.ghost_samples > 0:
+			for (field, pool) in [("ghost_guards", world.ghost_guards),
+					("ghost_hostiles", world.ghost_hostiles)]:
+				(xs, ys) = pool.get_cells()
+				n = min(self.ghost_samples, len(xs))
+				r[field][:n, 0] = xs[:n]
+				r[field][:n, 1] = ys[:n]
+				r[field][n:] = -1
+
+		self.count += 1
+		if self.count == len(self.buffer):
+			self.flush()
+
+	def flush(self):
+		self.fp.write(self.buffer[:self.count].tobytes())
+		self.fp.flush()
+		self.record_count += self.count
+		self.count = 0
+
+	def close(self):
+		if self.fp.closed: return
+		self.flush()
+		self.fp.close()
+
+'''
+Opens a recording read-only without loading it
+
+@return (header dict, memory mapped record array)
+'''
+def load_trajectory(filename):
+	with open(filename, "rb") as fp:
+		if fp.read(len(MAGIC)) != MAGIC:
+			raise ValueError(f"\"{filename}\" is not a trajectory recording")
+		(length,) = struct.unpack("<I", fp.read(4))
+		header = json.loads(fp.read(length))
+
+	offset = len(MAGIC) + 4 + length
+	dtype = record_dtype(header["ghost_samples"])
+	# a record cut short by a crash is left out
+	count = (os.path.getsize(filename) - offset) // dtype.itemsize
+	if count <= 0:
+		return header, np.zeros(0, dtype = dtype)
+
+	records = np.memmap(filename, dtype = dtype, mode = "r", offset = offset,
+			shape = (count,))
+
+	return header, records
+
+class ReplayWorld:
+
+	'''
+	Plays a recording back through World.render without simulating.
+	Behaves like a World to the pygame window. The recorded grid and map
+	are set in config until the replay is closed.
+
+		+ / -     double / halve the speed
+		space     pause
+		left/right jump 10% back / forward
+		0 - 9     jump to 0% - 90% of the recording
+
+	@param speed recorded steps per simulated step time
+	'''
+	def __init__(self, filename, speed = 1):
+		(self.header, self.records) = load_trajectory(filename)
+		if len(self.records) == 0:
+			raise ValueError(f"\"{filename}\" has no recorded steps")
+		import world
+
+		# render on the recorded grid and map, recordings older than maps
+		# were made on open grids
+		(w, h) = self.header["grid"]
+		self.grid_config = config.override({
+			"GRID_W": w, "GRID_H": h,
+			"CELL_W": config.SCREEN_W / w, "CELL_H": config.SCREEN_H / h,
+			"MAP_FILE": self.header.get("map"),
+		})
+		self.grid_config.__enter__()
+
+		try:
+			# the inner world only plays back, it neither records nor stores
+			with config.override({"GHOST_COUNT": self.header["ghost_samples"],
+					"TRAJECTORY_FILE": None, "RESULTS_FILE": None}):
+				self.world = world.World()
+		except Exception:
+			self.on_close()
+			raise
+
+		self.speed = speed
+		self.paused = False
+		self.position = 0.0
+		self.seek(0)
+
+	def seek(self, index):
+		self.position = float(min(max(index, 0), len(self.records) - 1))
+		self.apply(self.records[int(self.position)])
+
+	def apply(self, record):
+		for (agent, field) in [(self.world.vip, "vip"),
+				(self.world.guard, "guard"),
+				(self.world.hostile, "hostile")]:
+			agent.pos = agent.new_pos = agent.old_pos = \
+					tuple(int(v) for v in record[field])
+
+		if self.header["ghost_samples"] > 0:
+			for (pool, field) in [(self.world.ghost_guards, "ghost_guards"),
+					(self.world.ghost_hostiles, "ghost_hostiles")]:
+				cells = record[field]
+				cells = cells[cells[:, 0] >= 0]
+				pool.set_count(len(cells))
+				pool.xs[:len(cells)] = cells[:, 0]
+				pool.ys[:len(cells)] = cells[:, 1]
+
+	def update(self, deltatime):
+		if not self.paused:
+			steps = self.speed * deltatime / self.header["step_time"]
+			index = self.position + steps
+			if index >= len(self.records):
+				return True
+			self.position = index
+			self.apply(self.records[int(index)])
+
+		return False
+
+	def get_snapshot(self, copy = True):
+		return self.world.get_snapshot(copy)
+
+	def render(self, screen, snapshot = None):
+		self.world.render(screen, snapshot)
+
+	def on_mouse_move(self, mouse_pos):
+		pass
+
+	def on_number_pressed(self, number):
+		self.seek(int(len(self.records) * number / 10))
+
+	def on_key_pressed(self, key):
+		import pygame as pg
+		if key in (pg.K_PLUS, pg.K_EQUALS, pg.K_KP_PLUS):
+			self.speed *= 2
+		elif key in (pg.K_MINUS, pg.K_KP_MINUS):
+			self.speed /= 2
+		elif key == pg.K_SPACE:
+			self.paused ^= True
+		elif key == pg.K_LEFT:
+			self.seek(self.position - len(self.records) / 10)
+		elif key == pg.K_RIGHT:
+			self.seek(self.position + len(self.records) / 10)
+		else:
+			self.world.on_key_pressed(key)
+
+	'''
+	Restores the grid and map config of before the replay
+	'''
+	def on_close(self):
+		if self.grid_config is not None:
+			self.grid_config.__exit__(None, None, None)
+			self.grid_config = None
+
+def main():
+	if len(sys.argv) < 2:
+		print("usage: trajectory.py <recording> [speed]")
+		return
+
+	import gui
+	window = gui.PygameWindow()
+	window.run_world(ReplayWorld(sys.argv[1],
+			float(sys.argv[2]) if len(sys.argv) > 2 else 1))
+
+	running = True
+	while running:
+		(running, replaying) = window.update()
+		running &= replaying
+
+if __name__ == "__main__":
+	main()
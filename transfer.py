@@ -0,0 +1,152 @@
+import config
+import world
+
+import sys
+import random
+import numpy as np
+
+'''
+Open index grids over the 6 state dimensions (x, y, vip_x, vip_y,
+other_x, other_y) of a @w x @h grid
+'''
+def state_grids(w, h):
+	shapes = [(w if d % 2 == 0 else h) for d in range(6)]
+	grids = []
+	for (d, n) in enumerate(shapes):
+		shape = [1] * 6
+		shape[d] = n
+		grids.append(np.arange(n).reshape(shape))
+
+	return grids
+
+'''
+Maps a cell coordinate of a grid of @new_n cells to one of @old_n cells
+by scaling
+'''
+def rescale(coord, old_n, new_n):
+	return np.minimum(coord * old_n // new_n, old_n - 1)
+
+'''
+Initializes a table of a larger grid from a trained one by scaling every
+coordinate to the old grid
+
+@param table (x, y, vip_x, vip_y, other_x, other_y, actions) table
+'''
+def rescale_table(table, new_w, new_h):
+	(old_w, old_h) = table.shape[:2]
+	(x, y, vx, vy, ox, oy) = state_grids(new_w, new_h)
+
+	return table[
+		rescale(x, old_w, new_w), rescale(y, old_h, new_h),
+		rescale(vx, old_w, new_w), rescale(vy, old_h, new_h),
+		rescale(ox, old_w, new_w), rescale(oy, old_h, new_h)]
+
+'''
+Initializes a table of a larger grid from a trained one by keeping the
+offsets of the agents to the VIP. The VIP is shifted so that the centers
+of the grids match, and the agents are placed at their offsets from it,
+clipped to the old grid.
+
+@param table (x, y, vip_x, vip_y, other_x, other_y, actions) table
+'''
+def offset_table(table, new_w, new_h):
+	(old_w, old_h) = table.shape[:2]
+	(x, y, vx, vy, ox, oy) = state_grids(new_w, new_h)
+
+	old_vx = np.clip(vx - (new_w // 2 - old_w // 2), 0, old_w - 1)
+	old_vy = np.clip(vy - (new_h // 2 - old_h // 2), 0, old_h - 1)
+
+	return table[
+		np.clip(old_vx + (x - vx), 0, old_w - 1),
+		np.clip(old_vy + (y - vy), 0, old_h - 1),
+		old_vx, old_vy,
+		np.clip(old_vx + (ox - vx), 0, old_w - 1),
+		np.clip(old_vy + (oy - vy), 0, old_h - 1)]
+
+TRANSFERS = {
+	"rescale": rescale_table,
+	"offset": offset_table,
+}
+
+'''
+@return bytes of a dense table of a @w x @h grid
+'''
+def table_nbytes(w, h, action_count = 4):
+	return (w * h) ** 3 * action_count * np.dtype(float).itemsize
+
+'''
+Trains a headless world on a @size x @size grid until the guard's recent
+average reward reaches @target
+
+@param tables (guard, hostile) tables to start from, or None
+@return       (steps taken or None if @max_steps ran out, world)
+'''
+def train_to_target(size, target, max_steps, tables = None, seed = 0):
+	random.seed(seed)
+	np.random.seed(seed)
+
+	settings = {
+		"GRID_W": size, "GRID_H": size,
+		"RENDER_ENABLED": False,
+		"ITERATION_MAX": max_steps,
+		"CONVERGE_REWARD_TOLERANCE": 0,
+		"CONVERGE_Q_CHANGE": 0,
+	}
+	with config.override(settings):
+		w = world.World(tables = tables)
+
+		while not w.update(config.STEP_TIME):
+			if w.guard.get_iteration_count() >= w.guard.reward_monitor.average_size \
+					and w.guard.get_average_reward() >= target:
+				return w.guard.get_iteration_count(), w
+
+	return None, w
+
+'''
+Trains progressively larger grids, starting each from the tables of the
+previous one, then trains the largest from a cold start for comparison
+
+@param sizes     grid sizes in training order
+@param transfer  name of a function of @TRANSFERS
+@return          (steps per curriculum stage, cold start steps)
+'''
+def run_curriculum(sizes, target, max_steps, transfer = "offset", seed = 0):
+	print(f"\nCurriculum {sizes} to a guard average reward of {target} "
+		  f"({transfer} transfer) \n")
+
+	stages = []
+	tables = None
+	for size in sizes:
+		if tables is not None:
+			tables = tuple(TRANSFERS[transfer](t, size, size) for t in tables)
+
+		(steps, w) = train_to_target(size, target, max_steps, tables, seed)
+		stages.append(steps)
+		print(f"  {size:3} x {size:<3} {steps if steps is not None else '-'} steps")
+
+		tables = (w.guard.controller.q_table, w.hostile.controller.q_table)
+		del w
+
+	# free the last tables before the cold start
+	tables = None
+	(cold, _) = train_to_target(sizes[-1], target, max_steps, seed = seed)
+
+	total = sum(s if s is not None else max_steps for s in stages)
+	print(f"\n  curriculum total:   {total} steps "
+		  f"({stages[-1] if stages[-1] is not None else '-'} on the last grid)")
+	print(f"  cold start:         {cold if cold is not None else '-'} steps\n")
+
+	return stages, cold
+
+def main():
+	sizes = [int(v) for v in sys.argv[1:]] or [10, 13, 16]
+
+	for size in sizes:
+		if table_nbytes(size, size) > 2 ** 30:
+			print(f"A dense {size} x {size} table needs "
+				  f"{table_nbytes(size, size) / 2 ** 30:.1f} GiB per agent.")
+
+	run_curriculum(sizes, target = 2.0, max_steps = 20000)
+
+if __name__ == "__main__":
+	main()
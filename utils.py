@@ -1,12 +1,9 @@
 import config
 
 import pickle
-import time
 import random
 import math
 import collections
-import pyqtgraph as plt
-import numpy as np
 
 CARDINALS = [
 		( 0, -1), # up
@@ -57,6 +54,9 @@ class GraphData:
 class LiveGraph:
 
 	def __init__(self, title, subgraph_count, parent, sample_efficiency = 1):
+		# plotting is only needed with a window, so import it here
+		import pyqtgraph as plt
+
 		self.subgraph_count = subgraph_count
 		self.times = [0 for _ in range(subgraph_count)]
 
@@ -145,6 +145,74 @@ class ValueMonitor:
 	def get_count(self):
 		return self.value_count
 
+class ConvergenceMonitor:
+
+	'''
+	Decides when a training run should stop. Every @interval steps the
+	rolling average reward is recorded in a ValueMonitor. A run stops when
+	the last @patience + 1 recorded averages lie within @reward_tolerance,
+	when the mean absolute Q table change per update since the last check
+	falls to @change_threshold, or when @max_steps is reached. A tolerance
+	or threshold of 0 disables its test, as does a @max_steps of 0.
+	'''
+	def __init__(self, interval = 200, patience = 5, reward_tolerance = 0,
+			change_threshold = 0, max_steps = 0):
+		self.interval = interval
+		self.reward_tolerance = reward_tolerance
+		self.change_threshold = change_threshold
+		self.max_steps = max_steps
+
+		self.averages = ValueMonitor(patience + 1)
+		self.last_check = 0
+		self.last_change = (0, 0)
+
+		self.stop_reason = None
+		self.stop_step = None
+
+	'''
+	@param step           steps taken so far
+	@param average_reward rolling average reward
+	@param change         (sum of absolute Q changes, update count) so far
+	@return               whether the run should stop
+	'''
+	def update(self, step, average_reward, change):
+		if self.stop_reason is not None:
+			return True
+
+		if self.max_steps > 0 and step >= self.max_steps:
+			return self.stop(step, "max_steps")
+
+		if step - self.last_check < self.interval:
+			return False
+		self.last_check = step
+
+		self.averages.update(average_reward)
+		buffer = self.averages.buffer
+		if self.reward_tolerance > 0 and len(buffer) == buffer.maxlen and \
+				max(buffer) - min(buffer) <= self.reward_tolerance:
+			return self.stop(step, "reward_plateau")
+
+		(change_sum, updates) = change
+		(last_sum, last_updates) = self.last_change
+		self.last_change = change
+		if self.change_threshold > 0 and updates > last_updates and \
+				(change_sum - last_sum) / (updates - last_updates) \
+				<= self.change_threshold:
+			return self.stop(step, "q_converged")
+
+		return False
+
+	def stop(self, step, reason):
+		self.stop_step = step
+		self.stop_reason = reason
+		return True
+
+	def get_stop_reason(self):
+		return self.stop_reason
+
+	def get_stop_step(self):
+		return self.stop_step
+
 
 def lin_interp(a, b, alpha):
 	return a + (b - a) * alpha
@@ -1,112 +1,276 @@
 import config
 import agent
 import utils
-import q_learner
+import heatmap
+import trajectory
+import squads
+import results
+import gridmap
 
-import sys
+import numpy as np
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
-from PyQt5.QtWidgets import QMainWindow, QApplication, QWidget 
-from PyQt5.QtGui import QGridLayout
-from PyQt5.QtCore import QTimer
+# state of a world at one step, as drawn by World.render. Cells are the
+# (vip, guard, hostile) cells overlays are drawn for, and guard_qs the
+# guard's action values by cell when text or the Q heatmap is shown.
+Snapshot = collections.namedtuple("Snapshot", ["step", "vip_pos",
+		"guard_pos", "hostile_pos", "ghost_guard_cells", "ghost_hostile_cells",
+		"cells", "guard_qs"])
 
-import os.path
-import pygame as pg
-import numpy as np
-import random
+# positions of a world.MultiWorld at one step
+SquadSnapshot = collections.namedtuple("SquadSnapshot", ["step", "vip_pos",
+		"guard_cells", "hostile_cells", "ghost_guard_cells",
+		"ghost_hostile_cells"])
+
+'''
+@return copies of the cells of @pools, or views that change as they move
+'''
+def get_pool_cells(pools, copy):
+	cells = [pool.get_cells() for pool in pools]
+	if copy:
+		cells = [tuple(c.copy() for c in pool_cells) for pool_cells in cells]
+
+	return cells
+
+
+class BaseWorld:
+
+	'''
+	Parts shared by World and MultiWorld: the VIP, a ghost pool per team,
+	input handling, convergence and stored results. Subclasses create the
+	agents and pools in their own __init__, then call init_run.
+	'''
+	def init_run(self):
+		self.convergence = utils.ConvergenceMonitor(
+				interval = config.CONVERGE_INTERVAL,
+				patience = config.CONVERGE_PATIENCE,
+				reward_tolerance = config.CONVERGE_REWARD_TOLERANCE,
+				change_threshold = config.CONVERGE_Q_CHANGE,
+				max_steps = config.ITERATION_MAX)
+
+		self.results = None
+		if config.RESULTS_FILE is not None:
+			self.results = results.RunRecorder(results.get_store(),
+					type(self).__name__)
+
+	def mouse_vip(self, mouse_pos):
+		self.vip.move_to(utils.to_world(mouse_pos))
+
+	def set_ghost_count(self, count):
+		count = max(0, count)
+
+		# pools grow and shrink in bulk
+		self.ghost_guards.set_count(count)
+		self.ghost_hostiles.set_count(count)
+
+		config.GHOST_COUNT = count
+
+	def set_ghost_exploration(self, exploration):
+		self.ghost_guards.controller.exploration = exploration
+		self.ghost_hostiles.controller.exploration = exploration
+
+		config.GHOST_EXPLORATION = exploration
+
+	'''
+	@param follow_reward whether the ghosts learn towards the reward rather
+	                     than away from it
+	'''
+	def set_ghost_follow_reward(self, follow_reward):
+		self.ghost_guards.controller.follow_reward = follow_reward
+		self.ghost_hostiles.controller.follow_reward = follow_reward
+
+		config.GHOST_FOLLOW_REWARD = follow_reward
+
+	'''
+	@return (sum of absolute changes, update count) of the guard Q table
+	'''
+	def get_guard_q_change(self):
+		controller = self.get_guard_controller()
+		if controller.sweeper is not None:
+			return (controller.sweeper.change_sum, controller.sweeper.update_count)
+
+		controllers = [controller] + self.ghost_guards.get_controllers()
+		return (sum(c.change_sum for c in controllers),
+				sum(c.update_count for c in controllers))
+
+	'''
+	Writes the n-step backups still pending once the run has finished
+	'''
+	def flush_traces(self):
+		for learner in self.get_learners():
+			learner.flush_traces()
+
+	def render_grid(self, screen):
+		import pygame as pg
+		grid_map = gridmap.get_map()
+		for x in range(config.GRID_W):
+			for y in range(config.GRID_H):
+				if grid_map.walls[x, y] or grid_map.no_go[x, y]:
+					color = (60, 60, 60) if grid_map.walls[x, y] else (255, 220, 220)
+					(left, top) = utils.to_screen((x - 0.5, y - 0.5))
+					pg.draw.rect(screen, color, (left, top,
+							config.CELL_W + 1, config.CELL_H + 1))
+					continue
+
+				pos = utils.to_screen((x, y))
+				pg.draw.circle(screen, (100, 100, 100), pos, 5)
+
+	def on_mouse_move(self, mouse_pos):
+		if config.VIP_STATE == config.VIPState.MOUSE: 
+			self.mouse_vip(mouse_pos)
+
+	def on_number_pressed(self, number):
+		self.set_ghost_count(number * config.GHOST_COUNT_INTERVAL)
 
+	def on_key_pressed(self, key):
+		import pygame as pg
+		if key == pg.K_RETURN:
+			# toggle mouse control, scripted only with a path to follow
+			state = config.VIPState(
+					(config.VIP_STATE + 1) % len(config.VIPState))
+			if state == config.VIPState.SCRIPTED and self.vip.path is None:
+				state = config.VIPState((state + 1) % len(config.VIPState))
+			config.VIP_STATE = state
+			print(f"VIP_STATE is now {config.VIP_STATE.name}.")
+
+		elif key == pg.K_g:
+			# toggle ghost display
+			config.RENDER_GHOSTS_ENABLED ^= True
 
-class World():
+class World(BaseWorld):
 
-	def __init__(self, main_window, use_saved_data = False):
+	'''
+	@param main_window window providing the rewards graph, or None to run
+	                   without graphs
+	@param tables      (guard, hostile) Q tables to start from, or None
+	'''
+	def __init__(self, main_window = None, use_saved_data = False,
+			tables = None):
+		(guard_table, hostile_table) = (None, None) if tables is None else tables
 		self.use_saved_data = use_saved_data
-		self.vip = agent.VIP((config.GRID_W / 2, config.GRID_H / 2))
+		grid_map = gridmap.get_map()
+		self.vip = agent.VIP(grid_map.nearest_open(
+				(config.GRID_W / 2, config.GRID_H / 2)))
 
 		self.guard = agent.Guard(
-			pos = (0, 0), 
+			pos = grid_map.nearest_open((0, 0)), 
 			vip = self.vip, 
 			hostile = None, 
-			use_saved_data = use_saved_data)
-
-		self.ghost_guards = []
+			use_saved_data = use_saved_data,
+			q_table = guard_table)
 
 		self.hostile = agent.Hostile(
-			pos = (config.GRID_W - 1, config.GRID_H - 1), 
+			pos = grid_map.nearest_open((config.GRID_W - 1, config.GRID_H - 1)), 
 			vip = self.vip, 
 			guard = self.guard, 
-			use_saved_data = use_saved_data)
-
-		self.ghost_hostiles = []
+			use_saved_data = use_saved_data,
+			q_table = hostile_table)
 
 		# hostile needed to be created before giving it to the guard
 		self.guard.hostile = self.hostile
-		
-		ghost_count = config.GHOST_COUNT
-		config.GHOST_COUNT = 0
-		self.set_ghost_count(ghost_count)
 
-		if config.RENDER_ENABLED:
-			self.font = pg.font.SysFont("Hack", 12)
+		self.ghost_guards = self.guard.create_ghost_pool(config.GHOST_COUNT)
+		self.ghost_hostiles = self.hostile.create_ghost_pool(config.GHOST_COUNT)
+		self.set_ghost_count(config.GHOST_COUNT)
 
-		# get rewards graph
-		self.rewards_graph = main_window.rewards_graph
-		# set graph callbacks for agents
-		self.guard.attach_rewards_graph(
-				lambda val: self.rewards_graph.add_val(0, val))
-		self.hostile.attach_rewards_graph(
-				lambda val: self.rewards_graph.add_val(1, val))
+		# steps ghost batches in parallel
+		self.executor = None
+		if config.GHOST_THREADS > 1:
+			self.executor = ThreadPoolExecutor(config.GHOST_THREADS)
 
-	def mouse_vip(self, mouse_pos):
-		self.vip.move_to(utils.to_world(mouse_pos))
+		self.recorder = None
+		if config.TRAJECTORY_FILE is not None:
+			self.recorder = trajectory.TrajectoryRecorder(
+					config.TRAJECTORY_FILE, config.TRAJECTORY_GHOSTS)
 
-	def set_ghost_count(self, count):
-		count = max(0, count)
-		current_count = config.GHOST_COUNT
-
-		if count > current_count:
-			# add ghosts
-			for i in range(count - current_count):
-				self.ghost_guards.append(
-					self.guard.create_ghost(utils.randcell()))
-				self.ghost_hostiles.append(
-					self.hostile.create_ghost(utils.randcell()))
-
-		elif count < current_count:
-			# remove ghosts
-			for i in range(current_count - count):
-				del self.ghost_guards[-1]
-				del self.ghost_hostiles[-1]
+		self.init_run()
 
-		config.GHOST_COUNT = count
+		if config.RENDER_ENABLED:
+			import pygame as pg
+			self.font = pg.font.SysFont("Hack", 12)
+			self.heatmap = heatmap.HeatmapRenderer()
+
+		if main_window is not None:
+			# get rewards graph
+			self.rewards_graph = main_window.rewards_graph
+			# set graph callbacks for agents
+			self.guard.attach_rewards_graph(
+					lambda val: self.rewards_graph.add_val(0, val))
+			self.hostile.attach_rewards_graph(
+					lambda val: self.rewards_graph.add_val(1, val))
+
+	'''
+	Starts the VIP on @scenario, it follows the path while
+	@config.VIP_STATE is SCRIPTED
+	'''
+	def set_scenario(self, scenario):
+		self.vip.move_to(scenario.start)
+		self.vip.set_path(scenario.get_path(
+				lambda: (self.guard.get_int_pos(), self.hostile.get_int_pos())))
 
 	def update(self, deltatime):
 		hostile_rewards = []
 		guard_rewards = []
 
-		for ghost in self.ghost_hostiles:
-			ghost.update(deltatime)
-
-		for ghost in self.ghost_guards:
-			ghost.update(deltatime)
+		self.update_ghosts(deltatime)
 
 		self.hostile.update(deltatime)
 		self.guard.update(deltatime)
 
 		self.vip.update(deltatime)
 
+		if self.recorder is not None:
+			self.recorder.record(self)
+
 		hostile_reward = self.hostile.get_average_reward()
 		guard_reward = self.guard.get_average_reward()
 
 		#print(f"rewards: hostile = {hostile_reward} guard = {guard_reward}")
 
-		# end program if episode count is given
-		if config.ITERATION_MAX > 0 and \
-			self.guard.get_iteration_count() >= config.ITERATION_MAX:
-			return True
-
-		return False
+		# end program once converged or out of steps
+		finished = self.convergence.update(
+				self.guard.get_iteration_count(),
+				guard_reward,
+				self.get_guard_q_change())
+
+		if finished:
+			self.flush_traces()
+		if self.results is not None:
+			self.results.record(self, self.guard.get_iteration_count(), finished)
+		# finish the recording even if the world is never closed
+		if finished and self.recorder is not None:
+			self.recorder.close()
+		return finished
 
-	def get_cell_text(self, cell_pos):
-		qs = self.guard.get_superpos_qs(cell_pos)
+	'''
+	Steps both ghost pools, split into batches on the thread pool if there
+	is one. Ghosts only read the main agents, and guards and hostiles have
+	separate tables, so the pools can step at the same time.
+	'''
+	def update_ghosts(self, deltatime):
+		pools = [self.ghost_hostiles, self.ghost_guards]
+		if self.executor is None:
+			for pool in pools:
+				pool.update(deltatime)
+			return
+
+		futures = [self.executor.submit(pool.step, start, stop, controller)
+				for pool in pools if pool.tick(deltatime)
+				for (start, stop, controller) in
+					pool.get_batches(config.GHOST_THREADS)]
+		for future in futures:
+			future.result()
+
+	def get_guard_controller(self):
+		return self.guard.controller
+
+	def get_learners(self):
+		return (self.guard, self.hostile, self.ghost_guards, self.ghost_hostiles)
+
+	def get_cell_text(self, cell_pos, qs = None):
+		if qs is None:
+			qs = self.guard.get_superpos_qs(cell_pos)
 		return "{:.3}\n{:.3}\n{:.3}\n{:.3}\n".format(
 			qs[0], qs[1], qs[2], qs[3])
 
@@ -119,171 +283,309 @@ class World():
 			(nx, ny) = utils.to_screen((x - 0.5, y - 0.5))
 			screen.blit(text_surface, (nx, ny + i * h))
 
-	def render_grid_text(self, screen):
+	'''
+	@param q_grid action values of every cell, see get_snapshot
+	'''
+	def render_grid_text(self, screen, q_grid):
 		for x in range(config.GRID_W): 
 			for y in range(config.GRID_H):
 				self.render_cell_text(screen, (x, y),
-					self.get_cell_text((x, y)))
+					self.get_cell_text((x, y), q_grid[x, y]))
 	
-	def render_grid(self, screen):
-		for x in range(config.GRID_W):
-			for y in range(config.GRID_H):
-				pos = utils.to_screen((x, y))
-				pg.draw.circle(screen, (100, 100, 100), pos, 5)
-
-	def render(self, screen):
-		self.render_grid(screen)
+	'''
+	Everything render draws, so a snapshot taken on the simulation thread
+	draws the same frame while the world keeps changing
 
-		self.vip.render(screen)
+	@param copy whether ghost cells and action values are copied, rather
+	            than views that change as the world steps
+	'''
+	def get_snapshot(self, copy = True):
+		(guard_cells, hostile_cells) = get_pool_cells(
+				[self.ghost_guards, self.ghost_hostiles], copy)
+
+		# a single slice of the table, only read when it is drawn
+		guard_qs = None
+		if config.RENDER_TEXT_ENABLED or \
+				config.HEATMAP_STATE == config.HeatmapState.GUARD_Q:
+			guard_qs = self.guard.get_superpos_q_grid()
+			if copy:
+				guard_qs = guard_qs.copy()
+
+		return Snapshot(self.guard.get_iteration_count(), self.vip.pos,
+				self.guard.pos, self.hostile.pos, guard_cells, hostile_cells,
+				(self.vip.get_int_pos(), self.guard.get_int_pos(),
+				 self.hostile.get_int_pos()), guard_qs)
 
-		if config.RENDER_GHOSTS_ENABLED:
-			for ghost in self.ghost_guards:
-				ghost.render(screen)
+	'''
+	@param snapshot state to draw, the current one by default
+	'''
+	def render(self, screen, snapshot = None):
+		if snapshot is None:
+			snapshot = self.get_snapshot(copy = False)
 
-		if config.RENDER_GHOSTS_ENABLED:
-			for ghost in self.ghost_hostiles:
-				ghost.render(screen)
+		self.heatmap.render(screen, snapshot)
+		self.render_grid(screen)
 
-		self.guard.render(screen)
-		self.hostile.render(screen)
+		self.vip.render(screen, snapshot.vip_pos)
 
-		if config.RENDER_TEXT_ENABLED:
-			self.render_grid_text(screen)
+		if config.RENDER_GHOSTS_ENABLED:
+			self.ghost_guards.render(screen, snapshot.ghost_guard_cells)
+			self.ghost_hostiles.render(screen, snapshot.ghost_hostile_cells)
 
+		self.guard.render(screen, snapshot.guard_pos)
+		self.hostile.render(screen, snapshot.hostile_pos)
 
-	def on_mouse_move(self, mouse_pos):
-		if config.VIP_STATE == config.VIPState.MOUSE: 
-			self.mouse_vip(mouse_pos)
+		if config.RENDER_TEXT_ENABLED and snapshot.guard_qs is not None:
+			self.render_grid_text(screen, snapshot.guard_qs)
 
-	def on_number_pressed(self, number):
-		self.set_ghost_count(number * config.GHOST_COUNT_INTERVAL)
 
 	def on_key_pressed(self, key):
-		if key == pg.K_RETURN:
-			# toggle mouse control
-			config.VIP_STATE = config.VIPState((config.VIP_STATE + 1) % 3)
-			print(f"VIP_STATE is now {config.VIP_STATE.name}.")
+		import pygame as pg
+		if key == pg.K_q:
+			config.RENDER_TEXT_ENABLED ^= True
 
-		elif key == pg.K_g:
-			# toggle ghost display
-			config.RENDER_GHOSTS_ENABLED ^= True
+		elif key == pg.K_h:
+			# cycle heatmaps
+			config.HEATMAP_STATE = config.HeatmapState(
+					(config.HEATMAP_STATE + 1) % len(config.HeatmapState))
+			print(f"HEATMAP_STATE is now {config.HEATMAP_STATE.name}.")
 
-		elif key == pg.K_q:
-			config.RENDER_TEXT_ENABLED ^= True
+		else:
+			super(World, self).on_key_pressed(key)
 
 	def get_fitness(self):
 		return self.guard.reward_monitor \
 			.get_cumulative_average()
 
+	'''
+	@return metrics stored every @config.RESULTS_INTERVAL steps
+	'''
+	def get_metrics(self):
+		return {
+			"guard_reward": self.guard.get_average_reward(),
+			"hostile_reward": self.hostile.get_average_reward(),
+			"ghost_count": len(self.ghost_guards),
+		}
+
+	def get_stats(self):
+		guard_mon = self.guard.reward_monitor
+		hostile_mon = self.hostile.reward_monitor
+
+		return {
+			"iterations": guard_mon.get_count(),
+			"stop_reason": self.convergence.get_stop_reason(),
+			"stop_step": self.convergence.get_stop_step(),
+			"guard_average": guard_mon.get_cumulative_average(),
+			"guard_total": guard_mon.get_sum(),
+			"hostile_average": hostile_mon.get_cumulative_average(),
+			"hostile_total": hostile_mon.get_sum(),
+		}
+
 	def on_close(self):
+		if self.recorder is not None:
+			self.recorder.close()
+		if self.results is not None:
+			self.results.finish(self)
+		if self.executor is not None:
+			self.executor.shutdown()
+
 		#plt.show(self.rewards_graph.p)
 		# print stats
-		guard_mon = self.guard.reward_monitor
-		guard_avg = guard_mon.get_cumulative_average()
-		guard_sum = guard_mon.get_sum()
-
-		hostile_mon = self.hostile.reward_monitor
-		hostile_avg = hostile_mon.get_cumulative_average()
-		hostile_sum = hostile_mon.get_sum()
-		
-		iterations = self.guard.reward_monitor.get_count()
+		stats = self.get_stats()
 		
-		
-		print(f"\n\nStatistics over {iterations} iterations \n\n"
+		print(f"\n\nStatistics over {stats['iterations']} iterations \n"
+			  f"  (stopped by {stats['stop_reason']}) \n\n"
 			  f"  Guard: \n"
-			  f"      average reward: {guard_avg} \n"
-			  f"      total reward:   {guard_sum} \n\n"
+			  f"      average reward: {stats['guard_average']} \n"
+			  f"      total reward:   {stats['guard_total']} \n\n"
 			  f"  Hostile: \n"
-			  f"      average reward: {hostile_avg} \n"
-			  f"      total reward:   {hostile_sum} \n\n\n")
+			  f"      average reward: {stats['hostile_average']} \n"
+			  f"      total reward:   {stats['hostile_total']} \n\n\n")
 
 		if self.use_saved_data:
 			self.hostile.dump(config.HOSTILE_Q_FILE)
 			self.guard.dump(config.GUARD_Q_FILE)
 
-class PygameWindow():
+class MultiWorld(BaseWorld):
 
-	def __init__(self):
+	'''
+	A world of @config.GUARD_COUNT guards and @config.HOSTILE_COUNT
+	hostiles around one VIP. Each team is a squad sharing one Q table, and
+	every agent sees only the nearest agent of the other team, found with
+	a spatial index so a step stays near-linear in agent count. Input
+	handling and ghost controls are shared with World through BaseWorld.
+
+	@param main_window window providing the rewards graph, or None to run
+	                   without graphs
+	@param tables      (guard, hostile) Q tables to start from, or None
+	'''
+	def __init__(self, main_window = None, use_saved_data = False,
+			tables = None):
+		(guard_table, hostile_table) = (None, None) if tables is None else tables
+		self.use_saved_data = use_saved_data
+		self.vip = agent.VIP(gridmap.get_map().nearest_open(
+				(config.GRID_W / 2, config.GRID_H / 2)))
 
-		if config.RENDER_ENABLED:
-			pg.init()
-			pg.display.set_caption("Bodyguarding")
-			self.screen = pg.display.set_mode(
-				(config.SCREEN_W, config.SCREEN_H), pg.RESIZABLE)
+		self.guards = squads.GuardSquad(self.vip, use_saved_data, guard_table)
+		self.hostiles = squads.HostileSquad(self.vip, use_saved_data,
+				hostile_table)
+		self.guards.rival = self.hostiles
+		self.hostiles.rival = self.guards
 
-			self.clock = pg.time.Clock()
-			self.clock.tick()
+		# every agent needs a nearest rival
+		self.guards.set_count(max(1, config.GUARD_COUNT))
+		self.hostiles.set_count(max(1, config.HOSTILE_COUNT))
 
-		self.deltatime = 0
-		self.world = None
+		self.ghost_guards = self.guards.create_ghost_pool(config.GHOST_COUNT)
+		self.ghost_hostiles = self.hostiles.create_ghost_pool(config.GHOST_COUNT)
+		self.set_ghost_count(config.GHOST_COUNT)
+
+		self.init_run()
+
+		if main_window is not None:
+			self.rewards_graph = main_window.rewards_graph
+			self.guards.attach_rewards_graph(
+					lambda val: self.rewards_graph.add_val(0, val))
+			self.hostiles.attach_rewards_graph(
+					lambda val: self.rewards_graph.add_val(1, val))
+
+	'''
+	Adversarial paths see the guard and hostile nearest to the VIP
+	'''
+	def set_scenario(self, scenario):
+		def observe():
+			(vx, vy) = self.vip.get_int_pos()
+			(gxs, gys) = self.guards.get_nearest_cells(np.array([vx]), np.array([vy]))
+			(hxs, hys) = self.hostiles.get_nearest_cells(np.array([vx]), np.array([vy]))
+			return (int(gxs[0]), int(gys[0])), (int(hxs[0]), int(hys[0]))
 
-	def run_world(self, world):
-		self.world = world
+		self.vip.move_to(scenario.start)
+		self.vip.set_path(scenario.get_path(observe))
 
-	def on_resize(self, w, h):
+	def update(self, deltatime):
+		self.ghost_hostiles.update(deltatime)
+		self.ghost_guards.update(deltatime)
 
-		config.SCREEN_W = w
-		config.SCREEN_H = h
-		config.CELL_W = config.SCREEN_W / config.GRID_W
-		config.CELL_H = config.SCREEN_H / config.GRID_H
-		print(f"{w} x {h}")
+		self.hostiles.update(deltatime)
+		self.guards.update(deltatime)
 
+		self.vip.update(deltatime)
 
-	def update_no_render(self):
-		world_running = not self.world.update(10)
+		# end program once converged or out of steps
+		finished = self.convergence.update(
+				self.guards.get_iteration_count(),
+				self.guards.get_average_reward(),
+				self.get_guard_q_change())
 
-		if not world_running:
-			self.world.on_close()
-			self.world = None
+		if finished:
+			self.flush_traces()
+		if self.results is not None:
+			self.results.record(self, self.guards.get_iteration_count(), finished)
+		return finished
 
-		return True, world_running
+	def get_guard_controller(self):
+		return self.guards.controller
 
-	def update(self):
-		if self.world is None: return True, False
+	def get_learners(self):
+		return (self.guards, self.hostiles, self.ghost_guards, self.ghost_hostiles)
+
+	'''
+	@return threat of every hostile to the VIP, covered by the guard
+	        nearest to that hostile
+	'''
+	def get_threats(self):
+		(hxs, hys) = self.hostiles.get_cells()
+		(gxs, gys) = self.guards.get_nearest_cells(hxs, hys)
+		return agent.threat_levels(self.vip.get_int_pos(), gxs, gys, hxs, hys)
 
-		if not config.RENDER_ENABLED:
-			return self.update_no_render()
+	'''
+	@return fraction of hostiles with a guard within @config.COVER_DST
+	'''
+	def get_coverage(self):
+		(hxs, hys) = self.hostiles.get_cells()
+		covered = self.guards.count_within(hxs, hys, config.COVER_DST) > 0
+		return float(covered.mean())
 
-		running = True
-		for event in pg.event.get():
-			if event.type == pg.QUIT:
-				running = False
+	'''
+	@param copy whether cells are copied, rather than views that change as
+	            the agents move
+	'''
+	def get_snapshot(self, copy = True):
+		(guard_cells, hostile_cells, ghost_guard_cells, ghost_hostile_cells) = \
+				get_pool_cells([self.guards, self.hostiles,
+					self.ghost_guards, self.ghost_hostiles], copy)
 
-			if event.type == pg.VIDEORESIZE:
-				# resize window
-				screen = pg.display.set_mode(
-					(event.w, event.h), pg.RESIZABLE)
-				self.on_resize(event.w, event.h)
+		return SquadSnapshot(self.guards.get_iteration_count(), self.vip.pos,
+				guard_cells, hostile_cells, ghost_guard_cells,
+				ghost_hostile_cells)
 
-			if event.type == pg.MOUSEMOTION:
-				self.world.on_mouse_move(pg.mouse.get_pos())
+	'''
+	@param snapshot positions to draw, the current ones by default
+	'''
+	def render(self, screen, snapshot = None):
+		if snapshot is None:
+			snapshot = self.get_snapshot(copy = False)
 
-			if event.type == pg.KEYUP:
-				if event.key == pg.K_ESCAPE:
-					running = False
+		self.render_grid(screen)
 
-				num = event.key - pg.K_0
-				if num >= 0 and num <= 9:
-					self.world.on_number_pressed(num)
+		self.vip.render(screen, snapshot.vip_pos)
 
-				self.world.on_key_pressed(event.key)
+		if config.RENDER_GHOSTS_ENABLED:
+			self.ghost_guards.render(screen, snapshot.ghost_guard_cells)
+			self.ghost_hostiles.render(screen, snapshot.ghost_hostile_cells)
 
-		# update world
-		world_running = not self.world.update(self.deltatime)
-		# clear canvas
-		self.screen.fill((255, 255, 255))
-		# render world
-		self.world.render(self.screen)
+		self.guards.render(screen, snapshot.guard_cells)
+		self.hostiles.render(screen, snapshot.hostile_cells)
 
-		pg.display.flip()
+	def get_fitness(self):
+		return self.guards.reward_monitor \
+			.get_cumulative_average()
 
-		self.deltatime = self.clock.tick(config.TARGET_FPS) / 1000
+	def get_metrics(self):
+		return {
+			"guard_reward": self.guards.get_average_reward(),
+			"hostile_reward": self.hostiles.get_average_reward(),
+			"ghost_count": len(self.ghost_guards),
+			"coverage": self.get_coverage(),
+		}
+
+	def get_stats(self):
+		guard_mon = self.guards.reward_monitor
+		hostile_mon = self.hostiles.reward_monitor
+
+		return {
+			"iterations": guard_mon.get_count(),
+			"stop_reason": self.convergence.get_stop_reason(),
+			"stop_step": self.convergence.get_stop_step(),
+			"guard_count": len(self.guards),
+			"hostile_count": len(self.hostiles),
+			"guard_average": guard_mon.get_cumulative_average(),
+			"guard_total": guard_mon.get_sum(),
+			"hostile_average": hostile_mon.get_cumulative_average(),
+			"hostile_total": hostile_mon.get_sum(),
+			"threat": float(self.get_threats().sum()),
+			"coverage": self.get_coverage(),
+		}
 
-		if not (running and world_running):
-			self.world.on_close()
-			self.world = None
+	def on_close(self):
+		if self.results is not None:
+			self.results.finish(self)
+		stats = self.get_stats()
+
+		print(f"\n\nStatistics over {stats['iterations']} iterations \n"
+			  f"  (stopped by {stats['stop_reason']}) \n\n"
+			  f"  Guards ({stats['guard_count']}): \n"
+			  f"      average reward: {stats['guard_average']} \n"
+			  f"      total reward:   {stats['guard_total']} \n\n"
+			  f"  Hostiles ({stats['hostile_count']}): \n"
+			  f"      average reward: {stats['hostile_average']} \n"
+			  f"      total reward:   {stats['hostile_total']} \n\n"
+			  f"  Final threat:   {stats['threat']} \n"
+			  f"  Final coverage: {stats['coverage']} \n\n\n")
 
-		return running, world_running
+		if self.use_saved_data:
+			self.hostiles.dump(config.HOSTILE_Q_FILE)
+			self.guards.dump(config.GUARD_Q_FILE)
 
 class WorldTester:
 	
@@ -340,107 +642,6 @@ class WorldTesterChain:
 
 		return None
 
-class MainWindow(QMainWindow):
-
-	def __init__(self, parent = None):
-		super().__init__()
-
-		self.title = "Graphs and Stuff"
-		self.width = 1200
-		self.height = 900
-
-		self.setWindowTitle(self.title)
-		self.setGeometry(0, 0, self.width, self.height)
-
-		self.layout = QGridLayout()
-		self.layout.setContentsMargins(10, 10, 10, 10)
-		self.layout_widget = QWidget()
-		self.layout_widget.setLayout(self.layout)
-		self.setCentralWidget(self.layout_widget)
-
-		self.rewards_graph = utils.LiveGraph(
-				title = "Guard vs. Hostile", 
-				subgraph_count = 2, 
-				sample_efficiency = 0.05,
-				parent = self)
-		self.suffer_graph = utils.LiveGraph(
-				"Performance by Suffering", 1, self)
-		self.ghost_graph = utils.LiveGraph(
-				"Performance by Ghosting", 1, self)
-		self.exploration_graph = utils.LiveGraph(
-				"Performance by Ghost Exploration", 1, self)
-
-		self.layout.addWidget(self.rewards_graph.widget, 0, 0)
-		self.layout.addWidget(self.exploration_graph.widget, 0, 1)
-		self.layout.addWidget(self.suffer_graph.widget, 1, 0)
-		self.layout.addWidget(self.ghost_graph.widget, 1, 1)
-
-		# create testing chain
-		self.tester = WorldTesterChain([
-			WorldTester(config.set_suffering,
-					lambda p, r: self.suffer_graph.add_point(0, p, r),
-					0, 2, 20, config.SUFFERING),
-			WorldTester(config.set_ghost_exploration,
-					lambda p, r: self.exploration_graph.add_point(0, p, r),
-					0, 0.1, 1, config.GHOST_EXPLORATION),
-			WorldTester(config.set_ghost_count, 
-					lambda p, r: self.ghost_graph.add_point(0, p, r),
-					0, 20, 200, config.GHOST_COUNT)
-			])
-
-		# create pygame window
-		self.pg_window = PygameWindow()
-
-		#self.pg_window.run_world(self.tester.next_world(self))
-		self.pg_window.run_world(World(self))
-		
-		self.show()
-
-		self.is_closed = False
-
-		# setup pygame update loop
-		self.timer = QTimer()
-		self.timer.timeout.connect(self.update_pygame)
-		self.timer.start(0)
-
-
-	def update_pygame(self):
-		pg_is_running, world_is_running = self.pg_window.update()
-		
-		
-		if not (pg_is_running and world_is_running):
-			
-			if pg_is_running:
-				world = self.tester.next_world(self)
-				if world is not None:
-					self.pg_window.run_world(world)
-					return
-
-			
-			self.close()
-
-	def close(self):
-		if not self.is_closed: self.on_close()
-		self.is_closed = True
-		super().close()
-
-	def on_close(self):
-		# dump graph data
-		self.rewards_graph.dump("reward.gph")
-		self.suffer_graph.dump("suffer.gph")
-		self.ghost_graph.dump("ghost.gph")
-		self.exploration_graph.dump("exploration.gph")
-
-def main():
-
-	# create window 
-	app = QApplication(sys.argv)
-	window = MainWindow()
-	# run the app
-	app.exec_()
-
-	window.close()
-
 def test_shit():
 
 	config.GHOST_EXPLORATION = 0.5
@@ -474,5 +675,6 @@ def test_shit():
 		config.GHOST_EXPLORATION += 0.2
 
 if __name__ == "__main__":
-	main()
+	import gui
+	gui.main()
 